@@ -0,0 +1,305 @@
+"""
+Headless batch planning, without Streamlit.
+
+    python batch_planner.py requests.jsonl --out batch_runs --workers 4
+
+Reads one request per line ({"id": ..., "client_need": ...}) from a JSONL file, or every
+*.jsonl and *.txt file of a directory (a .txt file is one client email named after the file),
+plans each request on a pool of worker processes and writes its artifacts to <out>/<id>/.
+A summary of throughput and failures is written to <out>/summary.json.
+
+Every stage result is checkpointed in <out>/<id>/checkpoints/. With --resume, requests that
+already succeeded are skipped and the others restart from their first incomplete stage.
+With --stream-sink file, the streamed tokens are logged in <out>/<id>/stream_logs/. All the
+workers share the completion cache of LLM_CACHE_DIR.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Trello cards are only created when asked for, a batch run should not fill a board by default
+DEFAULT_SKIPPED_STAGES = ("trello",)
+
+
+def load_requests(path: str) -> List[Dict[str, str]]:
+    """
+    Loads the planning requests from a JSONL file or a directory
+
+    Returns:
+        List[Dict[str, str]]: Requests with an id and a client_need
+    """
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(path, name) for name in os.listdir(path) if name.endswith((".jsonl", ".txt"))
+    )
+    requests = []
+    for file in files:
+        stem = os.path.splitext(os.path.basename(file))[0]
+        with open(file, "r", encoding="utf-8") as f:
+            if file.endswith(".txt"):
+                requests.append({"id": stem, "client_need": f.read()})
+                continue
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                client_need = record.get("client_need") or record.get("email") or record.get("text")
+                if not client_need:
+                    raise ValueError(f"{file}:{line_number} has no client_need")
+                requests.append({"id": str(record.get("id") or f"{stem}-{line_number}"), "client_need": client_need})
+    seen = Counter()
+    for request in requests:
+        # Ids become directory names, keep them safe and unique
+        request_id = re.sub(r"[^A-Za-z0-9_.-]+", "_", request["id"]) or "request"
+        seen[request_id] += 1
+        request["id"] = request_id if seen[request_id] == 1 else f"{request_id}-{seen[request_id]}"
+    return requests
+
+
+def init_worker(llm_concurrency: int, requests_per_minute: float, tokens_per_minute: float, stream_sink: str, llm_cache_dir: str) -> None:
+    """
+    Configures a worker process with its share of the LLM budget
+    """
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(processName)s] %(levelname)s %(message)s")
+    import stream_sinks
+    from completion_cache import completion_cache
+    from openai_helpers import client_manager
+    from rate_limiter import rate_limiter
+    client_manager.configure(max_concurrency=llm_concurrency)
+    rate_limiter.configure(requests_per_minute, tokens_per_minute)
+    stream_sinks.PLANNER_STREAM_SINK = stream_sink
+    # All the workers read and fill the same completion cache
+    completion_cache.directory = llm_cache_dir
+
+
+def write_artifacts(request_dir: str, values: Dict) -> None:
+    """
+    Writes the outputs of the stages that completed, under stable file names
+    """
+    def write(name: str, content: str) -> None:
+        with open(os.path.join(request_dir, name), "w", encoding="utf-8") as f:
+            f.write(content)
+
+    if "wbs" in values:
+        write("wbs.md", values["wbs"])
+        write("dependency_graph.json", json.dumps({"nodes": values["nodes"], "edges": values["edges"]}, indent=2))
+    if values.get("dependency_graph_file"):
+        shutil.copyfile(values["dependency_graph_file"], os.path.join(request_dir, "dependency_graph.png"))
+    if "tasks" in values:
+        write("tasks.json", json.dumps(values["tasks"], indent=2))
+    if values.get("tasks"):
+        from excel_generator import gantt_excel_bytes
+        with open(os.path.join(request_dir, "gantt.xlsx"), "wb") as f:
+            f.write(gantt_excel_bytes(values["tasks"]))
+        from gantt_generator import gantt_figure_json
+        # Plotly JSON, opened with plotly.io.read_json without building the figure again
+        write("gantt.plotly.json", gantt_figure_json(values["tasks"]))
+    if "team_structure_dict" in values:
+        write("team.json", json.dumps(values["team_structure_dict"], indent=2))
+    if "resource_plan" in values:
+        write("resources.json", json.dumps(values["resource_plan"], indent=2))
+    if "estimate" in values:
+        write("estimate.md", values["estimate"])
+    if "board_id" in values:
+        write("trello.json", json.dumps({"board_id": values["board_id"]}))
+
+
+def plan_request(request: Dict[str, str], out_dir: str, skipped_stages: List[str], resume: bool = False) -> Dict:
+    """
+    Plans one request in a worker process
+
+    Args:
+        request (Dict[str, str]): The request, with an id and a client_need
+        out_dir (str): Folder receiving the request folder
+        skipped_stages (List[str]): Pipeline stages not to run
+        resume (bool): Reuse the checkpoints of a previous run of the same request
+
+    Returns:
+        dict: id, status (ok, partial or failed), seconds, per-stage timings and errors
+    """
+    import stream_sinks
+    import utils
+    from checkpoints import checkpoint_store
+    from main import PLANNING_PIPELINE
+    from pipeline import Pipeline
+    from tracing import trace_run
+
+    request_dir = os.path.abspath(os.path.join(out_dir, request["id"]))
+    result_path = os.path.join(request_dir, "result.json")
+    if resume and os.path.isfile(result_path):
+        with open(result_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous["status"] == "ok":
+            return dict(previous, seconds=0.0, resumed=True)
+    os.makedirs(request_dir, exist_ok=True)
+    checkpoints = checkpoint_store(request_dir)
+    if not resume:
+        checkpoints.clear()
+    pipeline = Pipeline([stage for stage in PLANNING_PIPELINE.stages if stage.name not in skipped_stages])
+    start = time.perf_counter()
+    # A worker plans one request at a time: the streamed tokens are logged in the request folder,
+    # the scratch files (the dependency graph image) go to a temporary folder
+    stream_sinks.STREAM_LOG_DIR = os.path.join(request_dir, "stream_logs")
+    work_dir = tempfile.mkdtemp(prefix=f"plan_{request['id']}_")
+    utils.PLANNER_WORK_DIR = work_dir
+    try:
+        with trace_run(request["id"]) as trace:
+            try:
+                run = pipeline.run({"client_need": request["client_need"]}, memo=checkpoints)
+            finally:
+                trace.export_jsonl(request_dir)
+        write_artifacts(request_dir, run.values)
+    except Exception as e:
+        logger.error(f"Request {request['id']} failed: {e}", exc_info=True)
+        return {"id": request["id"], "status": "failed", "seconds": time.perf_counter() - start, "stages": [], "errors": {"pipeline": str(e)}}
+    finally:
+        # Files worth keeping were copied to the request folder and the checkpoints
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    completed = [stage.name for stage in pipeline.stages if stage.name in run.timings and stage.name not in run.errors]
+    result = {
+        "id": request["id"],
+        "status": "ok" if run.ok else "partial" if completed else "failed",
+        "seconds": round(time.perf_counter() - start, 3),
+        "stages": run.stage_records(pipeline),
+        "errors": {name: f"{type(error).__name__}: {error}" for name, error in run.errors.items()},
+    }
+    with open(os.path.join(request_dir, "result.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+def summarize(results: List[Dict], wall_time: float, workers: int) -> Dict:
+    """
+    Aggregates the results of a batch: throughput, stage durations and failures
+    """
+    statuses = Counter(result["status"] for result in results)
+    stage_seconds = {}
+    stage_failures = Counter()
+    resumed_stages = Counter()
+    for result in results:
+        for row in result["stages"]:
+            if row["status"] == "done":
+                stage_seconds.setdefault(row["stage"], []).append(row["seconds"])
+            elif row["status"] == "memoized":
+                resumed_stages[row["stage"]] += 1
+            elif row["status"] in ("failed", "skipped"):
+                stage_failures[f"{row['stage']}.{row['status']}"] += 1
+    return {
+        "requests": len(results),
+        "workers": workers,
+        "statuses": dict(statuses),
+        "wall_time": round(wall_time, 3),
+        "requests_per_hour": round(len(results) / wall_time * 3600, 1) if wall_time > 0 else None,
+        "mean_request_seconds": round(sum(r["seconds"] for r in results) / len(results), 3) if results else None,
+        "mean_stage_seconds": {stage: round(sum(s) / len(s), 3) for stage, s in stage_seconds.items()},
+        "stage_failures": dict(stage_failures),
+        "resumed_requests": sum(1 for r in results if r.get("resumed")),
+        "stages_restored_from_checkpoints": dict(resumed_stages),
+        "failed_requests": {r["id"]: r["errors"] for r in results if r["status"] != "ok"},
+    }
+
+
+def run_batch(
+    requests: List[Dict[str, str]],
+    out_dir: str,
+    workers: int = 4,
+    llm_concurrency: int = 8,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+    skipped_stages: List[str] = DEFAULT_SKIPPED_STAGES,
+    stream_sink: str = "file",
+    resume: bool = False,
+) -> Dict:
+    """
+    Plans every request on a pool of worker processes
+
+    Args:
+        requests (List[Dict[str, str]]): Requests with an id and a client_need
+        out_dir (str): Folder receiving one sub folder per request and summary.json
+        workers (int): Number of worker processes, each planning one request at a time
+        llm_concurrency (int): Concurrent completions, sync and async, allowed across all the workers.
+            The number of workers is capped to it.
+        requests_per_minute (float, optional): Request budget shared by the workers, defaults to the configured limit
+        tokens_per_minute (float, optional): Token budget shared by the workers, defaults to the configured limit
+        skipped_stages (List[str]): Pipeline stages not to run
+        stream_sink (str): Where the workers send the streamed tokens, see stream_sinks.create_stream_sink
+        resume (bool): Skip the requests that already succeeded and resume the others from their checkpoints
+
+    Returns:
+        dict: The batch summary
+    """
+    from completion_cache import LLM_CACHE_DIR
+    from rate_limiter import SAMBA_NOVA_REQUESTS_PER_MINUTE, SAMBA_NOVA_TOKENS_PER_MINUTE
+
+    os.makedirs(out_dir, exist_ok=True)
+    # Each process has its own client and limiter, so the budgets are split between them,
+    # and there are no more workers than concurrent completions so each one gets at least one
+    workers = max(1, min(workers, len(requests), llm_concurrency))
+    initargs = (
+        max(1, llm_concurrency // workers),
+        (requests_per_minute if requests_per_minute is not None else SAMBA_NOVA_REQUESTS_PER_MINUTE) / workers,
+        (tokens_per_minute if tokens_per_minute is not None else SAMBA_NOVA_TOKENS_PER_MINUTE) / workers,
+        stream_sink,
+        os.path.abspath(LLM_CACHE_DIR),
+    )
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+        futures = {executor.submit(plan_request, request, out_dir, list(skipped_stages), resume): request for request in requests}
+        for future in as_completed(futures):
+            request = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died, e.g. killed by the OS
+                result = {"id": request["id"], "status": "failed", "seconds": 0.0, "stages": [], "errors": {"worker": str(e)}}
+            results.append(result)
+            logger.info(f"📦 [{len(results)}/{len(requests)}] {result['id']}: {result['status']} in {result['seconds']:.1f}s")
+    summary = summarize(results, time.perf_counter() - start, workers)
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Plan a batch of client emails without the Streamlit app")
+    parser.add_argument("input", help="JSONL file, or directory of .jsonl and .txt files")
+    parser.add_argument("--out", default="batch_runs", help="Output directory")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="Concurrent completions across all workers, also caps --workers")
+    parser.add_argument("--requests-per-minute", type=float, default=None)
+    parser.add_argument("--tokens-per-minute", type=float, default=None)
+    parser.add_argument("--trello", action="store_true", help="Also create the Trello boards")
+    parser.add_argument("--resume", action="store_true", help="Resume from the checkpoints of a previous run in --out")
+    parser.add_argument("--stream-sink", default="file", help="none, log, stdout or file (one log per request and stage)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args()
+    requests = load_requests(args.input)
+    logger.info(f"Planning {len(requests)} requests with {args.workers} workers")
+    summary = run_batch(
+        requests,
+        args.out,
+        workers=args.workers,
+        llm_concurrency=args.llm_concurrency,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        skipped_stages=[] if args.trello else list(DEFAULT_SKIPPED_STAGES),
+        stream_sink=args.stream_sink,
+        resume=args.resume,
+    )
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,351 @@
+"""
+Repeatable benchmarks of the planner.
+
+    python benchmarks.py llm --requests 40 --concurrency 8 --tokens-per-second 400
+    python benchmarks.py schedule --tasks 100 1000 10000
+    python benchmarks.py gantt --tasks 50 500 --months 6 24
+    python benchmarks.py excel --tasks 1000 --months 36 --granularity day
+
+The llm benchmark streams completions from the local mock endpoint (mock_server.py), or
+from --base-url, and reports time to first token, throughput and error counts per prompt.
+The schedule benchmark times the critical path scheduler on random dependency graphs.
+The gantt benchmark compares the build time and JSON size of the GANTT figures.
+The excel benchmark times the Excel GANTT export and reports the workbook size.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Dict, List
+
+from openai import APIStatusError
+
+import prompts
+from mock_server import MockSettings, start_mock_server
+from openai_helpers import PROMPT_NAMES, acollect_chat_completion, client_manager
+from rate_limiter import rate_limiter
+from scheduling import schedule_tasks
+from gantt_generator import generate_gantt_chart
+from excel_generator import generate_gantt_excel
+from timescale import GRANULARITIES
+from stream_validator import StreamValidationError
+from tracing import trace_run
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+BENCHMARK_PROMPTS = [
+    "WBS_CREATOR_PROMPT",
+    "GANTT_CHART_CREATOR_PROMPT",
+    "GANTT_DURATION_ESTIMATOR_PROMPT",
+    "TEAM_STRUCTURE_CREATOR_PROMPT",
+    "COST_ESTIMATOR_PROMPT",
+    "PROMPT_CARD_CREATOR_FOR_TRELLO",
+]
+BENCHMARK_CLIENT_NEED = "We need a web application to book meeting rooms, with a REST backend and a mobile friendly interface."
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Returns the q-th percentile (0-100) of the values, using the nearest rank
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def summarize_spans(records: List[Dict]) -> Dict[str, Dict]:
+    """
+    Aggregates the llm.completion spans of a traced run by prompt
+    """
+    summary = {}
+    for record in records:
+        if record["name"] != "llm.completion":
+            continue
+        entry = summary.setdefault(record["prompt"], {"ttft": [], "duration": [], "tokens_per_second": [], "completion_tokens": 0, "errors": 0})
+        if record.get("error"):
+            entry["errors"] += 1
+            continue
+        if record.get("ttft") is not None:
+            entry["ttft"].append(record["ttft"])
+        if record.get("tokens_per_second") is not None:
+            entry["tokens_per_second"].append(record["tokens_per_second"])
+        entry["duration"].append(record["duration"])
+        entry["completion_tokens"] += record.get("completion_tokens") or 0
+    return {
+        prompt: {
+            "completions": len(entry["duration"]),
+            "errors": entry["errors"],
+            "ttft_p50": percentile(entry["ttft"], 50),
+            "ttft_p95": percentile(entry["ttft"], 95),
+            "duration_p50": percentile(entry["duration"], 50),
+            "duration_p95": percentile(entry["duration"], 95),
+            "tokens_per_second_mean": statistics.fmean(entry["tokens_per_second"]) if entry["tokens_per_second"] else float("nan"),
+            "completion_tokens": entry["completion_tokens"],
+        }
+        for prompt, entry in summary.items()
+    }
+
+
+async def run_llm_requests(prompt_names: List[str], requests: int, concurrency: int, validate: bool) -> Dict[str, int]:
+    """
+    Streams `requests` completions per prompt, at most `concurrency` at a time
+
+    Returns:
+        dict: Number of failed completions by error type
+    """
+    client_manager.configure(max_concurrency=concurrency)
+    failures = {}
+
+    async def one(system_prompt: str):
+        try:
+            await acollect_chat_completion(BENCHMARK_CLIENT_NEED, system_prompt=system_prompt, use_cache=False, validate=validate)
+        except StreamValidationError as e:
+            failures[f"validation.{e.reason}"] = failures.get(f"validation.{e.reason}", 0) + 1
+        except APIStatusError as e:
+            failures[f"http.{e.status_code}"] = failures.get(f"http.{e.status_code}", 0) + 1
+
+    await asyncio.gather(*(one(getattr(prompts, name)) for name in prompt_names for _ in range(requests)))
+    await client_manager.aclose()
+    return failures
+
+
+def benchmark_llm(args) -> Dict:
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = start_mock_server(MockSettings(
+            ttft=args.ttft,
+            tokens_per_second=args.tokens_per_second,
+            malformed_rate=args.malformed_rate,
+            truncated_rate=args.truncated_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            transcripts_dir=args.transcripts_dir,
+            seed=args.seed,
+        ))
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    client_manager.configure(base_url=base_url, api_key=args.api_key, max_retries=0)
+    rate_limiter.configure(args.requests_per_minute, args.tokens_per_minute)
+
+    start = time.perf_counter()
+    try:
+        with trace_run() as run:
+            failures = asyncio.run(run_llm_requests(args.prompts, args.requests, args.concurrency, args.validate))
+    finally:
+        if server is not None:
+            server.shutdown()
+    wall_time = time.perf_counter() - start
+
+    per_prompt = summarize_spans(run.records())
+    total_tokens = sum(entry["completion_tokens"] for entry in per_prompt.values())
+    return {
+        "base_url": base_url,
+        "requests": args.requests * len(args.prompts),
+        "concurrency": args.concurrency,
+        "wall_time": round(wall_time, 3),
+        "aggregate_tokens_per_second": round(total_tokens / wall_time, 1) if wall_time > 0 else None,
+        "failures": failures,
+        "connections": client_manager.stats(),
+        "rate_limiter": rate_limiter.metrics(),
+        "prompts": per_prompt,
+    }
+
+
+def print_llm_report(report: Dict) -> None:
+    print(f"\n{report['requests']} completions against {report['base_url']} with concurrency {report['concurrency']}")
+    print(f"Wall time {report['wall_time']:.2f}s, aggregate throughput {report['aggregate_tokens_per_second']} tokens/s")
+    print(f"{'prompt':<34}{'ok':>5}{'err':>5}{'ttft p50':>10}{'ttft p95':>10}{'dur p50':>10}{'dur p95':>10}{'tok/s':>9}")
+    for prompt, entry in report["prompts"].items():
+        print(
+            f"{prompt:<34}{entry['completions']:>5}{entry['errors']:>5}"
+            f"{entry['ttft_p50']:>10.3f}{entry['ttft_p95']:>10.3f}"
+            f"{entry['duration_p50']:>10.3f}{entry['duration_p95']:>10.3f}{entry['tokens_per_second_mean']:>9.1f}"
+        )
+    if report["failures"]:
+        print(f"Failures: {report['failures']}")
+    print(f"Connections: {report['connections']}")
+    print(f"Rate limiter: {report['rate_limiter']}")
+
+
+def random_dependency_graph(task_count: int, dependencies_per_task: int = 2, seed: int = 0):
+    """
+    Returns a random acyclic WBS: task names, [a, b] edges where b depends on a, and durations in working days
+    """
+    rng = random.Random(seed)
+    nodes = [f"Task {i}" for i in range(task_count)]
+    edges = []
+    for i in range(1, task_count):
+        # Mostly recent dependencies, so the graph has long chains like a real plan
+        for _ in range(rng.randint(0, dependencies_per_task)):
+            edges.append([nodes[max(i - 1 - int(rng.expovariate(0.1)), 0)], nodes[i]])
+    durations = {name: rng.randint(1, 20) for name in nodes}
+    return nodes, edges, durations
+
+
+def benchmark_schedule(args) -> List[Dict]:
+    rows = []
+    for task_count in args.tasks:
+        nodes, edges, durations = random_dependency_graph(task_count, args.dependencies, args.seed)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            schedule = schedule_tasks(nodes, edges, durations)
+            scheduled = time.perf_counter()
+            tasks = schedule.to_tasks()
+            timings.append((scheduled - start, time.perf_counter() - scheduled))
+        rows.append({
+            "tasks": task_count,
+            "edges": len(edges),
+            "cpm_ms": round(1000 * min(t[0] for t in timings), 2),
+            "dates_ms": round(1000 * min(t[1] for t in timings), 2),
+            "working_days": schedule.finish,
+            "critical_tasks": len(schedule.critical_tasks()),
+            "end_date": tasks[-1]["end_date"] if tasks else None,
+        })
+    return rows
+
+
+def random_gantt_tasks(task_count: int, months: int, seed: int = 0) -> List[Dict]:
+    """
+    Returns task_count GANTT tasks of one to eight weeks spread over a project of `months` months
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 11, 18)
+    span = months * 30
+    tasks = []
+    for i in range(task_count):
+        length = rng.randint(7, 56)
+        offset = rng.randint(0, max(span - length, 0))
+        tasks.append({
+            "name": f"Task {i}",
+            "start_date": (start + timedelta(days=offset)).strftime('%Y-%m-%d'),
+            "end_date": (start + timedelta(days=offset + length - 1)).strftime('%Y-%m-%d'),
+        })
+    # The first and the last task pin the project length
+    tasks[0]["start_date"] = start.strftime('%Y-%m-%d')
+    tasks[-1]["end_date"] = (start + timedelta(days=span - 1)).strftime('%Y-%m-%d')
+    return tasks
+
+
+def benchmark_gantt(args) -> List[Dict]:
+    rows = []
+    for task_count in args.tasks:
+        for months in args.months:
+            tasks = random_gantt_tasks(task_count, months, args.seed)
+            for mode, large in (("classic", False), ("large", True)):
+                if mode == "classic" and task_count > args.max_classic_tasks:
+                    continue
+                start = time.perf_counter()
+                fig = generate_gantt_chart(tasks, large=large, granularity=args.granularity)
+                built = time.perf_counter()
+                payload = fig.to_json()
+                rows.append({
+                    "mode": mode,
+                    "tasks": task_count,
+                    "months": months,
+                    "build_ms": round(1000 * (built - start), 1),
+                    "json_ms": round(1000 * (time.perf_counter() - built), 1),
+                    "json_kb": round(len(payload) / 1024, 1),
+                    "traces": len(fig.data),
+                    "shapes": len(fig.layout.shapes),
+                })
+    return rows
+
+
+def benchmark_excel(args) -> List[Dict]:
+    rows = []
+    for task_count in args.tasks:
+        for months in args.months:
+            tasks = random_gantt_tasks(task_count, months, args.seed)
+            timings = []
+            for _ in range(args.repeat):
+                buffer = BytesIO()
+                start = time.perf_counter()
+                generate_gantt_excel(tasks, buffer, args.granularity)
+                timings.append(time.perf_counter() - start)
+            rows.append({
+                "tasks": task_count,
+                "months": months,
+                "build_ms": round(1000 * min(timings), 1),
+                "xlsx_kb": round(len(buffer.getvalue()) / 1024, 1),
+            })
+    return rows
+
+
+def print_table(rows: List[Dict]) -> None:
+    if not rows:
+        return
+    columns = list(rows[0])
+    print("".join(f"{column:>16}" for column in columns))
+    for row in rows:
+        print("".join(f"{str(row[column]):>16}" for column in columns))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Planner benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    llm = subparsers.add_parser("llm", help="Streaming completion latency and throughput")
+    llm.add_argument("--requests", type=int, default=10, help="Completions per prompt")
+    llm.add_argument("--concurrency", type=int, default=8)
+    llm.add_argument("--prompts", nargs="+", default=BENCHMARK_PROMPTS, choices=sorted(set(PROMPT_NAMES.values())))
+    llm.add_argument("--validate", action="store_true", help="Validate the responses while they stream")
+    llm.add_argument("--base-url", default=None, help="Endpoint to benchmark instead of the local mock")
+    llm.add_argument("--api-key", default="mock")
+    llm.add_argument("--ttft", type=float, default=0.3)
+    llm.add_argument("--tokens-per-second", type=float, default=300.0)
+    llm.add_argument("--malformed-rate", type=float, default=0.0)
+    llm.add_argument("--truncated-rate", type=float, default=0.0)
+    llm.add_argument("--rate-limit-rate", type=float, default=0.0)
+    llm.add_argument("--transcripts-dir", default=None)
+    llm.add_argument("--seed", type=int, default=0)
+    llm.add_argument("--requests-per-minute", type=float, default=None, help="Override the client side rate limit")
+    llm.add_argument("--tokens-per-minute", type=float, default=None, help="Override the client side token limit")
+    llm.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    schedule = subparsers.add_parser("schedule", help="Critical path scheduler on random dependency graphs")
+    schedule.add_argument("--tasks", type=int, nargs="+", default=[100, 1000, 10000])
+    schedule.add_argument("--dependencies", type=int, default=2, help="Maximum dependencies per task")
+    schedule.add_argument("--repeat", type=int, default=5, help="Runs per size, the fastest is reported")
+    schedule.add_argument("--seed", type=int, default=0)
+    schedule.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    gantt = subparsers.add_parser("gantt", help="GANTT figure build time and payload size")
+    gantt.add_argument("--tasks", type=int, nargs="+", default=[50, 200, 500])
+    gantt.add_argument("--months", type=int, nargs="+", default=[6, 12, 24])
+    gantt.add_argument("--max-classic-tasks", type=int, default=500, help="Larger plans are only built in the large plan mode")
+    gantt.add_argument("--granularity", choices=GRANULARITIES, default=None, help="Time scale, picked from the project length by default")
+    gantt.add_argument("--seed", type=int, default=0)
+    gantt.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    excel = subparsers.add_parser("excel", help="Excel GANTT export time and workbook size")
+    excel.add_argument("--tasks", type=int, nargs="+", default=[100, 300, 1000])
+    excel.add_argument("--months", type=int, nargs="+", default=[6, 18, 36])
+    excel.add_argument("--repeat", type=int, default=3, help="Runs per size, the fastest is reported")
+    excel.add_argument("--granularity", choices=GRANULARITIES, default=None, help="Time scale, picked from the project length by default")
+    excel.add_argument("--seed", type=int, default=0)
+    excel.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    if args.benchmark == "llm":
+        report = benchmark_llm(args)
+        if args.json:
+            print(json.dumps(report, indent=2, default=str))
+        else:
+            print_llm_report(report)
+    else:
+        rows = {"schedule": benchmark_schedule, "gantt": benchmark_gantt, "excel": benchmark_excel}[args.benchmark](args)
+        if args.json:
+            print(json.dumps(rows, indent=2))
+        else:
+            print_table(rows)
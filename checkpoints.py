@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CHECKPOINT_DIR_NAME = "checkpoints"
+
+
+class CheckpointStore(MutableMapping):
+    """
+    Stage results persisted in a run directory, one JSON file per stage result.
+
+    It is keyed like the memo of Pipeline.run (stage name and input hash), so passing it
+    as memo checkpoints every stage as soon as it completes, and a later run with the same
+    store resumes from the first stage that did not complete. Outputs that are paths to
+    files (the dependency graph image) are copied next to the checkpoint,
+    so they survive the cleanup of the working directory.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory (str): Folder holding the checkpoints, created on first write
+        """
+        self.directory = os.path.abspath(directory)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace(":", "-") + ".json")
+
+    def _load(self, key: str) -> Dict[str, Any]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            raise KeyError(key)
+        if any(not os.path.isfile(checkpoint["outputs"][name]) for name in checkpoint["files"]):
+            logger.warning(f"Checkpoint {key} refers to a missing file, ignoring it")
+            raise KeyError(key)
+        return checkpoint
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        return self._load(key)["outputs"]
+
+    def __contains__(self, key) -> bool:
+        try:
+            self._load(key)
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key: str, outputs: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        outputs = dict(outputs)
+        files = []
+        for name, value in outputs.items():
+            if isinstance(value, str) and os.path.isfile(value) and os.path.dirname(os.path.abspath(value)) != self.directory:
+                copy = os.path.join(self.directory, f"{key.replace(':', '-')}-{name}{os.path.splitext(value)[1]}")
+                shutil.copyfile(value, copy)
+                outputs[name] = copy
+                files.append(name)
+        try:
+            payload = json.dumps({"key": key, "outputs": outputs, "files": files}, ensure_ascii=False, indent=2)
+        except TypeError as e:
+            # A checkpoint is an optimization, never a reason to fail the run
+            logger.warning(f"Stage result {key} cannot be checkpointed: {e}")
+            return
+        # Write to a temporary file first so a crash never leaves a partial checkpoint
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self._path(key))
+        logger.info(f"💾 Checkpointed {key.split(':')[0]}")
+
+    def __delitem__(self, key: str) -> None:
+        checkpoint = self._load(key)
+        for name in checkpoint["files"]:
+            os.remove(checkpoint["outputs"][name])
+        os.remove(self._path(key))
+
+    def __iter__(self) -> Iterator[str]:
+        if not os.path.isdir(self.directory):
+            return iter(())
+        keys = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                    keys.append(json.load(f)["key"])
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def clear(self) -> None:
+        """
+        Removes every checkpoint of the run
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def checkpoint_store(run_dir: str) -> CheckpointStore:
+    """
+    Returns the checkpoint store of a run directory
+    """
+    return CheckpointStore(os.path.join(run_dir, CHECKPOINT_DIR_NAME))
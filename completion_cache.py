@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Dict, Generator, List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", ".llm_cache")
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE", "on").lower() not in ("0", "off", "false", "no")
+LLM_CACHE_MAX_BYTES = int(float(os.environ.get("LLM_CACHE_MAX_MB", 200)) * 1024 * 1024)
+LLM_CACHE_MAX_AGE = float(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", 7)) * 24 * 3600
+
+# Splits a cached response into word-sized pieces so a replay looks like a live stream
+_REPLAY_PATTERN = re.compile(r'\s*\S+\s*|\s+')
+
+
+class CompletionCache:
+    """
+    Content-addressed on-disk cache of full streamed completions.
+
+    Each entry is stored in its own file named after the hash of the request. The
+    modification time of the file is refreshed on every hit, so evicting the oldest
+    files first gives an LRU policy bounded both by total size and by age.
+    """
+
+    def __init__(self, directory: str = LLM_CACHE_DIR, max_bytes: int = LLM_CACHE_MAX_BYTES, max_age: float = LLM_CACHE_MAX_AGE):
+        """
+        Args:
+            directory (str): Folder where the cached completions are stored
+            max_bytes (int): Maximum total size of the cache on disk
+            max_age (float): Seconds after which an unused entry expires
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bytes_read": 0, "bytes_written": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, str]], model: str, temperature: float, top_p: float) -> str:
+        """
+        Builds the cache key of a request
+
+        Args:
+            messages (List[Dict[str, str]]): The full message list, system prompt included
+            model (str): The model name
+            temperature (float): The sampling temperature
+            top_p (float): The nucleus sampling parameter
+
+        Returns:
+            str: The hex digest identifying the request
+        """
+        payload = json.dumps(
+            {"messages": messages, "model": model, "temperature": temperature, "top_p": top_p},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += value
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached completion for the key, or None on a miss or expired entry
+        """
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                self._count("evictions")
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)
+        except OSError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        self._count("bytes_read", len(text.encode("utf-8")))
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        """
+        Stores a completion, then evicts old entries if the cache grew past its limits
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        data = text.encode("utf-8")
+        # Write to a temporary file first so a concurrent reader never sees a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        self._count("bytes_written", len(data))
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes expired entries, then the least recently used ones until the cache fits in max_bytes
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        now = time.time()
+        entries = []
+        for name in names:
+            if not name.endswith(".txt"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._count("evictions")
+
+    def clear(self) -> None:
+        """
+        Removes every cached completion
+        """
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            if name.endswith(".txt"):
+                os.remove(os.path.join(self.directory, name))
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns hit, miss, byte and eviction counters since the process started
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def replay_stream(text: str) -> Generator[str, None, None]:
+    """
+    Yields a cached completion in small chunks, the same way a live stream would
+    """
+    for match in _REPLAY_PATTERN.finditer(text):
+        yield match.group(0)
+
+
+completion_cache = CompletionCache()
@@ -1,126 +1,160 @@
 from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from datetime import datetime, timedelta
-from calendar import monthrange
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill, Font, Alignment, Border, Side, NamedStyle
+from openpyxl.worksheet.dimensions import ColumnDimension
+from array import array
+from bisect import bisect_left, bisect_right
 from openpyxl.utils import get_column_letter
+from io import BytesIO
+from task_model import TableCache, TaskTable
+from timescale import long_label, period_label, period_start, periods, resolve_granularity
 
-def generate_gantt_excel(tasks: list, filename: str = "gantt_chart.xlsx") -> None:
+# Width of the columns of each time scale, and the larger unit of the merged header above them
+COLUMN_WIDTHS = {"day": 3, "week": 4, "month": 5, "quarter": 5}
+HEADER_GRANULARITY = {"day": "month", "week": "month", "month": "year", "quarter": "year"}
+
+def _gantt_styles() -> list:
+    """
+    The styles of the workbook, registered once as named styles and shared by all the cells
     """
-    Creates a Gantt chart in Excel format, showing only workdays
+    center = Alignment(horizontal='center')
+    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
+    thin = Side(style='thin')
+    return [
+        NamedStyle(name="gantt_title", font=Font(size=14, bold=True), alignment=center),
+        NamedStyle(name="gantt_header", font=Font(color="FFFFFF", bold=True), fill=header_fill, alignment=center),
+        NamedStyle(name="gantt_cell", alignment=center),
+        NamedStyle(
+            name="gantt_bar",
+            fill=PatternFill(start_color="2980B9", end_color="2980B9", fill_type="solid"),
+            border=Border(left=thin, right=thin, top=thin, bottom=thin),
+            alignment=center,
+        ),
+        # A task covering only part of a week, month or quarter
+        NamedStyle(
+            name="gantt_bar_partial",
+            fill=PatternFill(start_color="A9CCE3", end_color="A9CCE3", fill_type="solid"),
+            border=Border(left=thin, right=thin, top=thin, bottom=thin),
+            alignment=center,
+        ),
+    ]
+
+def _styled(ws, value, style: str) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+def generate_gantt_excel(tasks: list, filename = "gantt_chart.xlsx", granularity: str = None) -> None:
+    """
+    Creates a Gantt chart in Excel format, with one column per working day, week, month or quarter
+    
+    The workbook is streamed row by row in openpyxl write-only mode: only the cells of the
+    headers, the task names and the bars are written, all sharing a few named styles, and the
+    bar of a task is the range of columns found by bisecting its dates. A task covering only
+    some of the working days of a week, month or quarter is shaded lighter in that column.
     
     Args:
-        tasks (list): List of dictionaries containing task information
+        tasks (list or TaskTable): List of dictionaries containing task information
             Each dict should have: name, start_date, end_date
-        filename (str): Name of the output Excel file
+        filename (str or file-like): Name of the output Excel file, or a binary buffer to write it to
+        granularity (str, optional): day, week, month or quarter, picked from the project length by default
+        
+    Raises:
+        ValueError: If the time scale is unknown
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Gantt Chart"
-    
-    # Define styles
-    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-    task_fill = PatternFill(start_color="2980B9", end_color="2980B9", fill_type="solid")
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Add title row first
-    title_cell = ws.cell(row=1, column=1, value="Project Timeline")
-    title_cell.font = Font(size=14, bold=True)
-    title_cell.alignment = Alignment(horizontal='center')
+    # Get project date range, the dates are parsed once by the task table
+    tasks = TaskTable.of(tasks)
+    project_start = tasks.project_start
+    project_end = tasks.project_end
+    granularity = resolve_granularity(granularity, tasks.span_days)
     
-    # Get project date range
-    start_dates = [datetime.strptime(task['start_date'].replace('-00', '-01'), '%Y-%m-%d') for task in tasks]
-    end_dates = [datetime.strptime(task['end_date'].replace('-00', '-01'), '%Y-%m-%d') for task in tasks]
-    project_start = min(start_dates)
-    project_end = max(end_dates)
+    # One column per period, starting from column B (A is for task names)
+    if not tasks:
+        columns = []
+    elif granularity == "day":
+        # Skip weekends
+        columns = [(day, day) for day, _ in periods(project_start, project_end, "day") if day.weekday() < 5]
+    else:
+        columns = periods(project_start, project_end, granularity)
+    starts = array('l', (start.toordinal() for start, _ in columns))
+    ends = array('l', (end.toordinal() for _, end in columns))
+    # First and last working day of each column, a task covering both fills the whole column
+    first_workday = array('l', (start.toordinal() + (7 - start.weekday() if start.weekday() >= 5 else 0) for start, _ in columns))
+    last_workday = array('l', (end.toordinal() - (end.weekday() - 4 if end.weekday() >= 5 else 0) for _, end in columns))
+    last_col = len(columns) + 1
     
-    # Create date headers
-    current_date = project_start
-    date_columns = []
-    col = 2  # Start from column B (A is for task names)
+    wb = Workbook(write_only=True)
+    for style in _gantt_styles():
+        wb.add_named_style(style)
+    ws = wb.create_sheet("Gantt Chart")
     
-    # Format task names column
+    # The sheet layout is written with the first row, so it is set up before any row
     ws.column_dimensions['A'].width = 40
+    if columns:
+        ws.column_dimensions['B'] = ColumnDimension(ws, index='B', min=2, max=last_col, width=COLUMN_WIDTHS[granularity])
+    ws.freeze_panes = 'B4'
     
-    # Add month headers (Row 2) and day headers (Row 3)
-    current_month = None
-    month_start_col = col
-    
-    while current_date <= project_end:
-        # Skip weekends
-        if current_date.weekday() >= 5:
-            current_date += timedelta(days=1)
-            continue
-        
-        # Set column width
-        column_letter = get_column_letter(col)
-        ws.column_dimensions[column_letter].width = 3
-        
-        # Handle month headers
-        month_str = current_date.strftime('%B %Y')
-        if current_month != month_str:
-            if current_month is not None and col > month_start_col:
-                # Merge previous month cells
-                merge_range = f'{get_column_letter(month_start_col)}2:{get_column_letter(col-1)}2'
-                ws.merge_cells(merge_range)
-                ws.cell(row=2, column=month_start_col).fill = header_fill
-                ws.cell(row=2, column=month_start_col).font = header_font
-            
-            current_month = month_str
-            month_start_col = col
-            ws.cell(row=2, column=col, value=current_month)
-        
-        # Add day number
-        ws.cell(row=3, column=col, value=current_date.day)
-        date_columns.append((col, current_date))
-        
-        col += 1
-        current_date += timedelta(days=1)
+    # Add title row first
+    ws.append([_styled(ws, "Project Timeline", "gantt_title")])
+    if last_col > 1:
+        ws.merged_cells.add(f'A1:{get_column_letter(last_col)}1')
     
-    # Merge the last month
-    if col > month_start_col:
-        merge_range = f'{get_column_letter(month_start_col)}2:{get_column_letter(col-1)}2'
-        ws.merge_cells(merge_range)
-        ws.cell(row=2, column=month_start_col).fill = header_fill
-        ws.cell(row=2, column=month_start_col).font = header_font
+    # Add month or year headers (Row 2) and period headers (Row 3)
+    group = HEADER_GRANULARITY[granularity]
+    headers = [_styled(ws, "Tasks", "gantt_header")]
+    labels = [_styled(ws, "", "gantt_cell")]
+    group_start_col = 2
+    current_group = None
+    for col, (start, _) in enumerate(columns, start=2):
+        if period_start(start, group) != current_group:
+            if col > group_start_col + 1:
+                ws.merged_cells.add(f'{get_column_letter(group_start_col)}2:{get_column_letter(col - 1)}2')
+            group_start_col = col
+            current_group = period_start(start, group)
+            headers.append(_styled(ws, long_label(start, group), "gantt_header"))
+        else:
+            headers.append(None)
+        labels.append(_styled(ws, start.day if granularity in ("day", "week") else period_label(start, granularity), "gantt_cell"))
+    if columns and last_col > group_start_col:
+        ws.merged_cells.add(f'{get_column_letter(group_start_col)}2:{get_column_letter(last_col)}2')
+    ws.append(headers)
+    ws.append(labels)
     
-    # Merge title cell
-    title_merge_range = f'A1:{get_column_letter(col-1)}1'
-    ws.merge_cells(title_merge_range)
+    # Add tasks, each row stops at the end of its bar
+    for task in tasks:
+        task_start, task_end = task.start.toordinal(), task.end.toordinal()
+        first = bisect_left(ends, task_start)
+        last = bisect_right(starts, task_end)
+        row = [_styled(ws, task.name, "gantt_cell")]
+        row.extend([None] * first)
+        row.extend(
+            _styled(ws, None, "gantt_bar" if task_start <= first_workday[i] and task_end >= last_workday[i] else "gantt_bar_partial")
+            for i in range(first, last)
+        )
+        ws.append(row)
     
-    # Add "Tasks" header
-    ws.cell(row=2, column=1, value="Tasks")
-    ws.cell(row=2, column=1).fill = header_fill
-    ws.cell(row=2, column=1).font = header_font
-    ws.cell(row=3, column=1, value="")  # Empty cell for day numbers row
+    # Save workbook
+    wb.save(filename) 
+
+def _excel_bytes(table: TaskTable, granularity: str) -> bytes:
+    buffer = BytesIO()
+    generate_gantt_excel(table, buffer, granularity)
+    return buffer.getvalue()
+
+_workbooks = TableCache(maxsize=32)
+
+def gantt_excel_bytes(tasks: list, granularity: str = None) -> bytes:
+    """
+    Builds the Gantt Excel workbook in memory, without touching the disk
+
+    The result is cached by task content, so rendering the download button again,
+    or downloading the same plan twice, does not rebuild the workbook.
     
-    # Add tasks
-    for row, task in enumerate(tasks, start=4):
-        # Add task name
-        ws.cell(row=row, column=1, value=task['name'])
-        
-        # Add task bar
-        task_start = datetime.strptime(task['start_date'].replace('-00', '-01'), '%Y-%m-%d')
-        task_end = datetime.strptime(task['end_date'].replace('-00', '-01'), '%Y-%m-%d')
+    Args:
+        tasks (list or TaskTable): List of dictionaries with name, start_date and end_date
+        granularity (str, optional): See generate_gantt_excel
         
-        for col, date in date_columns:
-            if task_start <= date <= task_end:
-                cell = ws.cell(row=row, column=col)
-                cell.fill = task_fill
-                cell.border = border
-    
-    # Center align all cells
-    for row in ws.iter_rows(min_row=1, max_row=row, min_col=1, max_col=col-1):
-        for cell in row:
-            cell.alignment = Alignment(horizontal='center')
-    
-    # Freeze panes
-    ws.freeze_panes = 'B4'
-    
-    # Save workbook
-    wb.save(filename) 
\ No newline at end of file
+    Returns:
+        bytes: The content of the .xlsx file
+    """
+    return _workbooks.get(tasks, _excel_bytes, granularity)
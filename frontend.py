@@ -6,7 +6,25 @@ from trello_utils import process_trello_function_calls
 import plotly.express as px
 from PIL import Image
 import os
-from main import create_wbs_and_dependecy_graph, create_gantt_chart,create_team_structure, create_cost_estimate, create_trello_cards
+import hashlib
+from main import PLANNING_PIPELINE
+from pipeline import StageMemo
+from tracing import trace_run
+from rate_limiter import rate_limiter
+from checkpoints import checkpoint_store
+from job_queue import job_queue
+
+# Show the per-stage timings of the last run in an extra tab
+SHOW_DIAGNOSTICS = os.environ.get("PLANNER_DIAGNOSTICS", "0").lower() in ("1", "on", "true", "yes")
+
+# Optional folder where stage results are checkpointed, so a failed or interrupted plan
+# resumes from its first incomplete stage even after a restart of the app
+PLANNER_CHECKPOINT_DIR = os.environ.get("PLANNER_CHECKPOINT_DIR")
+
+# Plan on the shared job queue and poll it, instead of holding the script thread for the whole pipeline.
+# Off by default: a job has no Streamlit containers, so its completions are not streamed to the page
+# (no live tokens or progressive task tables), each tab is only filled once its stage is done.
+PLANNER_BACKGROUND_JOBS = os.environ.get("PLANNER_BACKGROUND_JOBS", "0").lower() in ("1", "on", "true", "yes")
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -14,29 +32,139 @@ logging.basicConfig(level=logging.INFO)
 # Set page config for wide layout
 st.set_page_config(layout="wide")
 
-def process_tab_content(user_input:str):
-    logging.info("Starting process_tab_content")
-    try:
-        wbs, nodes, edges = create_wbs_and_dependecy_graph(user_input, st.session_state["tabs"][0], st.session_state["tabs"][1])
-        logging.info("WBS and dependency graph created")
-        
-        logging.info("Starting Gantt chart creation...")
-        try:
-            tasks = create_gantt_chart(st.session_state["tabs"][2], user_input, wbs, nodes, edges)
-            logging.info("Gantt chart creation completed successfully")
-        except Exception as e:
-            logging.error(f"Failed to create Gantt chart: {str(e)}", exc_info=True)
-            return
-        logging.info("Starting team structure creation...")
-        team_structure = create_team_structure(st.session_state["tabs"][3],user_input, tasks)
-        logging.info("Team structure creation completed successfully")
-        create_cost_estimate(st.session_state["tabs"][4],user_input, tasks, team_structure)
-
-        create_trello_cards(st.session_state["tabs"][5],user_input, tasks, team_structure)
+# Pipeline stage -> index of the tab it streams and renders into
+STAGE_TABS = {
+    "wbs": 0,
+    "dependency_graph": 1,
+    "gantt": 2,
+    "plan_editor": 2,
+    "team_structure": 3,
+    "resources": 3,
+    "cost_estimate": 4,
+    "trello": 5,
+}
+
+def process_tab_content(user_input:str, tabs, replay:bool=False):
+    """
+    Plans the project, or with replay=True only re-renders the stages memoized in this
+    session, e.g. when a widget interaction reruns the script
+    """
+    if replay:
+        run_pipeline(user_input, tabs, replay_only=True)
+    else:
+        logging.info("Starting process_tab_content")
+        with trace_run() as run:
+            try:
+                st.session_state["last_stages"] = run_pipeline(user_input, tabs)
+            finally:
+                run.export_jsonl()
+                st.session_state["last_trace"] = run.records()
+    if SHOW_DIAGNOSTICS and "last_trace" in st.session_state:
+        render_diagnostics(tabs[6], st.session_state["last_trace"], st.session_state.get("last_stages", []))
+
+def render_diagnostics(tab, records, stage_rows):
+    """
+    Shows the spans of the last run: stage timings and critical path, LLM latency and throughput
+    """
+    with tab:
+        llm_calls = [r for r in records if r["name"] == "llm.completion"]
+        st.markdown("#### Stages")
+        critical_path = [row["stage"] for row in sorted(stage_rows, key=lambda r: r["start"] or 0) if row["critical_path"]]
+        if critical_path:
+            st.caption(f"Critical path: {' → '.join(critical_path)}")
+        st.dataframe(stage_rows, use_container_width=True)
+        st.markdown("#### LLM calls")
+        st.dataframe(
+            [{k: r.get(k) for k in ("prompt", "duration", "ttft", "prompt_tokens", "completion_tokens", "tokens_per_second", "finish_reason", "cache_hit")} for r in llm_calls],
+            use_container_width=True
+        )
+        st.markdown("#### Rate limiter")
+        st.json(rate_limiter.metrics())
+        st.markdown("#### All spans")
+        st.dataframe(records, use_container_width=True)
+
+def stage_memo(user_input:str):
+    """
+    Returns where the stage results of a plan are memoized: the checkpoint folder of the
+    client need if PLANNER_CHECKPOINT_DIR is set, a bounded memo in the session state otherwise
+    """
+    if PLANNER_CHECKPOINT_DIR:
+        return checkpoint_store(os.path.join(PLANNER_CHECKPOINT_DIR, hashlib.sha256(user_input.encode("utf-8")).hexdigest()[:16]))
+    if "stage_memo" not in st.session_state:
+        st.session_state["stage_memo"] = StageMemo()
+    return st.session_state["stage_memo"]
+
+def show_stage_error(stage, error, tab):
+    if tab is not None:
+        with tab:
+            st.error(f"An error occurred: {str(error)}")
+
+def run_pipeline(user_input:str, tabs, replay_only:bool=False):
+    """
+    Runs the planning pipeline, streaming and rendering every stage into its tab.
+    Stage results are memoized in the session by input hash, so a stage already
+    computed for the same inputs is rendered without any LLM or network call.
 
+    Returns:
+        list: One row per stage with its timing, status and critical path flag
+    """
+    try:
+        containers = {stage: tabs[index] for stage, index in STAGE_TABS.items()}
+        run = PLANNING_PIPELINE.run(
+            {"client_need": user_input},
+            containers,
+            on_error=show_stage_error,
+            memo=stage_memo(user_input),
+            replay_only=replay_only,
+        )
+        return run.stage_records(PLANNING_PIPELINE)
     except Exception as e:
         logging.error(f"Error in process_tab_content: {str(e)}", exc_info=True)
         st.error(f"An error occurred: {str(e)}")
+        return []
+
+def submit_job(user_input:str):
+    """
+    Queues the plan on the job queue. The job memoizes every stage result in the session memo,
+    so each rerun of the page renders the stages completed so far.
+    """
+    st.session_state["job_id"] = job_queue.submit(user_input, memo=stage_memo(user_input))
+    st.session_state["job_events_seen"] = 0
+
+@st.fragment(run_every=1)
+def job_progress(job_id:str):
+    """
+    Polls the planning job every second and reruns the whole page when a stage completes,
+    so its tab is rendered, or when the job ends
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return
+    stages = job.stages_by_status()
+    completed = [name for name, event in stages.items() if event != "started"]
+    total = len(PLANNING_PIPELINE.stages)
+    running = [name for name, event in stages.items() if event == "started"]
+    label = f"Running {', '.join(running)}" if running else f"Queued, {job_queue.queue_depth()} job(s) waiting" if job.status == "queued" else "Planning..."
+    st.progress(len(completed) / total, text=f"{label} ({len(completed)}/{total} stages)")
+    if len(completed) > st.session_state.get("job_events_seen", 0) or job.done:
+        st.session_state["job_events_seen"] = len(completed)
+        st.rerun(scope="app")
+
+def show_job(left_col):
+    """
+    Shows the progress of the session's planning job, or its outcome once it is done
+    """
+    job = job_queue.get(st.session_state.get("job_id", ""))
+    if job is None:
+        return
+    with left_col:
+        if not job.done:
+            job_progress(job.job_id)
+        elif job.error:
+            st.error(f"An error occurred: {job.error}")
+    if job.done:
+        st.session_state["last_stages"] = job.stage_records
+        st.session_state["last_trace"] = job.trace
 
 def main():
     
@@ -51,6 +179,8 @@ def main():
         "Economics",
         "Trello"
     ]
+    if SHOW_DIAGNOSTICS:
+        tab_names.append("Diagnostics")
     
     # Create two columns with different widths
     left_col, right_col = st.columns([1, 3])  # 1:3 ratio between left and right columns
@@ -58,16 +188,30 @@ def main():
     # Put text input and button in the left column
     with left_col:
         user_input = st.text_area("", height=150, placeholder="Enter your project description here...")
-        if st.button("Plan For Me!"):
-            if not user_input.strip():
-                st.error("Please enter a project description before proceeding.")
-            else:
-                process_tab_content(user_input)
+        plan_clicked = st.button("Plan For Me!")
     
-    # Put tabs in the right column
+    # Put tabs in the right column. They are created before running the pipeline so the
+    # stages stream into the tabs of this run rather than into the ones of the previous run.
     with right_col:
         tabs = st.tabs(tab_names)
         st.session_state["tabs"] = tabs
+    
+    if plan_clicked:
+        if not user_input.strip():
+            with left_col:
+                st.error("Please enter a project description before proceeding.")
+        elif PLANNER_BACKGROUND_JOBS:
+            submit_job(user_input)
+            st.session_state["planned_input"] = user_input
+        else:
+            process_tab_content(user_input, tabs)
+            st.session_state["planned_input"] = user_input
+    if PLANNER_BACKGROUND_JOBS:
+        show_job(left_col)
+    if "planned_input" in st.session_state and not (plan_clicked and not PLANNER_BACKGROUND_JOBS):
+        # Any other interaction reruns the script: show the last plan again from the memo,
+        # or with a background job the stages it has completed so far
+        process_tab_content(st.session_state["planned_input"], tabs, replay=True)
 
 if __name__ == "__main__":
     main()
@@ -1,29 +1,89 @@
 import plotly.figure_factory as ff
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import logging
 from textwrap import wrap
 import plotly.graph_objects as go
+import os
+from task_model import TableCache, TaskTable
+from timescale import PARENT_GRANULARITY, long_label, next_period, period_start, periods, resolve_granularity
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-def generate_gantt_chart(tasks: list) -> go.Figure:
+# Above either size the chart is built by generate_large_gantt_chart, whose cost does not grow with the project length
+GANTT_LARGE_PLAN_TASKS = int(os.environ.get("GANTT_LARGE_PLAN_TASKS", 60))
+GANTT_LARGE_PLAN_DAYS = int(os.environ.get("GANTT_LARGE_PLAN_DAYS", 365))
+
+_DAY_MS = 24 * 3600 * 1000
+
+# Labelled ticks of each time scale, one per larger period (see timescale.PARENT_GRANULARITY), and their format
+AXIS_TICKS = {
+    "day": (7 * _DAY_MS, '%b %d'),
+    "week": ('M1', '%B %Y'),
+    "month": ('M3', '%b %Y'),
+    "quarter": ('M12', '%Y'),
+}
+# Grid lines between the periods of each time scale
+MINOR_TICKS = {"day": _DAY_MS, "week": 7 * _DAY_MS, "month": 'M1', "quarter": 'M3'}
+
+def is_large_plan(tasks: list) -> bool:
+    """
+    Whether a plan has too many tasks or spans too many days for one shape per grid line
+    """
+    if len(tasks) > GANTT_LARGE_PLAN_TASKS:
+        return True
+    return TaskTable.of(tasks).span_days > GANTT_LARGE_PLAN_DAYS
+
+def _axis_range(start: date, end: date, granularity: str) -> tuple:
+    """
+    Returns the first day of the period of the project start and the day after the period of its end
+    """
+    return period_start(start, granularity), next_period(period_start(end, granularity), granularity)
+
+def _partial_period_shading(start: date, end: date, axis_start: date, axis_end: date) -> list:
+    """
+    Grey rectangles over the parts of the first and last periods outside the project
+    """
+    shading = []
+    for x0, x1 in ((axis_start, start), (end + timedelta(days=1), axis_end)):
+        if x0 < x1:
+            shading.append(dict(
+                type='rect', xref='x', yref='paper', x0=x0, x1=x1, y0=0, y1=1,
+                fillcolor='rgba(128, 128, 128, 0.12)', line=dict(width=0), layer='below',
+            ))
+    return shading
+
+def generate_gantt_chart(tasks: list, large: bool = None, granularity: str = None) -> go.Figure:
     """
     Creates a Gantt chart from a list of tasks
+    
+    Args:
+        tasks (list or TaskTable): The tasks, with name, start_date and end_date
+        large (bool, optional): Force or disable the large plan mode, chosen with is_large_plan by default
+        granularity (str, optional): Grid and ticks by day, week, month or quarter, picked from the project length by default
+        
+    Raises:
+        ValueError: If the time scale is unknown
     """
+    tasks = TaskTable.of(tasks)
+    granularity = resolve_granularity(granularity, tasks.span_days)
+    if large is None:
+        large = is_large_plan(tasks)
+    if large:
+        return generate_large_gantt_chart(tasks, granularity)
     try:
         logger.info(f"Creating Gantt chart for {len(tasks)} tasks")
         
         # 1. Sort tasks by start date
-        sorted_tasks = sorted(tasks, key=lambda x: datetime.strptime(x['start_date'], '%Y-%m-%d'))
+        sorted_tasks = tasks.sorted_by_start()
         
         # 2. Prepare data for plotly
         df = []
         for task in sorted_tasks:
             df.append(dict(
-                Task=task['name'],
-                Start=task['start_date'],
-                Finish=task['end_date'],
+                Task=task.name,
+                Start=task.start_date,
+                Finish=task.end_date,
                 Resource='Task'
             ))
             
@@ -39,33 +99,21 @@ def generate_gantt_chart(tasks: list) -> go.Figure:
             bar_width=0.2,
         )
         
-        # Get project date range
-        start_date = min(datetime.strptime(task['start_date'], '%Y-%m-%d') for task in tasks)
-        end_date = max(datetime.strptime(task['end_date'], '%Y-%m-%d') for task in tasks)
-        
-        # Generate month labels for the top of the chart
-        current_date = start_date.replace(day=1)  # Start from first day of the month
-        month_labels = []
-        month_positions = []
+        # Get project date range, the axis is widened to whole periods
+        start_date = tasks.project_start
+        end_date = tasks.project_end
+        axis_start, axis_end = _axis_range(start_date, end_date, granularity)
+        parent = PARENT_GRANULARITY[granularity]
         
-        while current_date <= end_date:
-            month_labels.append(current_date.strftime('%B %Y'))
-            month_positions.append(current_date)
-            # Move to first day of next month
-            if current_date.month == 12:
-                current_date = current_date.replace(year=current_date.year + 1, month=1)
-            else:
-                current_date = current_date.replace(month=current_date.month + 1)
-        
-        # Add month labels as annotations at the top with better positioning
+        # Label the larger periods at the top of the chart, e.g. the months of a weekly chart
         annotations = []
-        for label, pos in zip(month_labels, month_positions):
+        for period, _ in periods(start_date, end_date, parent):
             annotations.append(dict(
-                x=pos,
+                x=max(period, axis_start),
                 y=1.15,  # Increased distance from top of chart
                 xref='x',
                 yref='paper',
-                text=label,
+                text=long_label(period, parent),
                 showarrow=False,
                 font=dict(size=10),  # Slightly smaller font
                 textangle=-45,
@@ -73,27 +121,20 @@ def generate_gantt_chart(tasks: list) -> go.Figure:
                 yanchor='bottom'  # Align text to the bottom
             ))
         
-        # Add vertical lines for weeks and months
-        current_date = start_date
-        while current_date <= end_date:
-            # Add dotted line for each Monday
-            if current_date.weekday() == 0:
-                fig.add_vline(
-                    x=current_date,
-                    line_dash="dot",
-                    line_color="gray",
-                    opacity=0.3
-                )
-            
-            # Add solid line for first day of each month
-            if current_date.day == 1:
-                fig.add_vline(
-                    x=current_date,
-                    line_color="darkgray",
-                    opacity=0.5
-                )
-            
-            current_date += timedelta(days=1)
+        # Dotted lines between periods and solid lines between the larger periods, added at once
+        # rather than one add_vline per line, so the cost follows the number of periods
+        shapes = list(fig.layout.shapes) + _partial_period_shading(start_date, end_date, axis_start, axis_end)
+        parent_starts = {period for period, _ in periods(start_date, end_date, parent)}
+        for period, _ in periods(start_date, end_date, granularity):
+            if period <= axis_start:
+                continue
+            solid = period in parent_starts
+            shapes.append(dict(
+                type='line', xref='x', yref='paper', x0=period, x1=period, y0=0, y1=1,
+                line=dict(color='darkgray' if solid else 'gray', dash='solid' if solid else 'dot', width=1),
+                opacity=0.5 if solid else 0.3,
+            ))
+        fig.update_layout(shapes=shapes)
         
         # 4. Update layout for better visualization
         fig.update_layout(
@@ -103,8 +144,10 @@ def generate_gantt_chart(tasks: list) -> go.Figure:
             xaxis=dict(
                 title='',
                 tickangle=45,
-                tickformat='%B %Y',  # Show month names
-                dtick='M1',  # Show tick for every month
+                tickformat=AXIS_TICKS[granularity][1],
+                dtick=AXIS_TICKS[granularity][0],
+                tick0=period_start(axis_start, parent),
+                range=[axis_start, axis_end],
                 showgrid=True,
                 gridcolor='rgba(128, 128, 128, 0.2)',
                 side='bottom',
@@ -114,8 +157,8 @@ def generate_gantt_chart(tasks: list) -> go.Figure:
             yaxis=dict(
                 title='Tasks',
                 tickmode='array',
-                ticktext=[('<br>'.join(wrap(task['name'], width=35)) 
-                          if len(task['name']) > 25 else task['name']) 
+                ticktext=[('<br>'.join(wrap(task.name, width=35)) 
+                          if len(task.name) > 25 else task.name) 
                           for task in reversed(sorted_tasks)],
                 tickvals=list(range(len(tasks))),
                 automargin=True,
@@ -147,4 +190,137 @@ def generate_gantt_chart(tasks: list) -> go.Figure:
             
     except Exception as e:
         logger.error(f"Error generating Gantt chart: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+def generate_gantt_preview(tasks: list) -> go.Figure:
+    """
+    Creates a lightweight Gantt chart of the tasks received so far, redrawn while the GANTT streams.
+    Tasks with missing or invalid dates are left out.
+    """
+    names, starts, durations = [], [], []
+    for task in TaskTable.of(tasks, skip_invalid=True):
+        names.append(task.name)
+        starts.append(task.start_date)
+        # Bars on a date axis are measured in milliseconds, the end day is included
+        durations.append(task.days * _DAY_MS)
+    
+    fig = go.Figure(go.Bar(
+        y=names,
+        x=durations,
+        base=starts,
+        orientation='h',
+        marker_color='#2980b9',
+        opacity=0.8,
+        hovertemplate='<b>%{y}</b><br>Start: %{base|%B %d, %Y}<extra></extra>'
+    ))
+    fig.update_layout(
+        height=max(300, len(names) * 30 + 120),
+        xaxis=dict(type='date', showgrid=True, gridcolor='rgba(128, 128, 128, 0.2)'),
+        yaxis=dict(autorange='reversed', automargin=True),
+        margin=dict(l=150, r=50, t=30, b=50),
+        plot_bgcolor='white',
+        showlegend=False
+    )
+    return fig
+
+def generate_large_gantt_chart(tasks: list, granularity: str = None) -> go.Figure:
+    """
+    Creates a Gantt chart for large plans: all the bars are a single go.Bar trace with base
+    offsets, and the grid lines of the periods are axis ticks rather than one shape per line,
+    so the figure size only grows with the number of tasks. Critical tasks, when the tasks
+    carry a critical flag, are highlighted.
+    """
+    tasks = TaskTable.of(tasks)
+    granularity = resolve_granularity(granularity, tasks.span_days)
+    logger.info(f"Creating large plan Gantt chart for {len(tasks)} tasks")
+    ordered = tasks.sorted_by_start()
+    
+    fig = go.Figure(go.Bar(
+        y=[task.name for task in ordered],
+        # Bars on a date axis are measured in milliseconds, the end day is included
+        x=[task.days * _DAY_MS for task in ordered],
+        base=[task.start_date for task in ordered],
+        customdata=[task.end_date for task in ordered],
+        orientation='h',
+        marker_color=['#c0392b' if task.critical else '#2980b9' for task in ordered],
+        opacity=0.8,
+        hovertemplate='<b>%{y}</b><br>Start: %{base|%B %d, %Y}<br>End: %{customdata|%B %d, %Y}<extra></extra>'
+    ))
+    
+    start_date = tasks.project_start or datetime.now().date()
+    end_date = tasks.project_end or start_date
+    axis_start, axis_end = _axis_range(start_date, end_date, granularity)
+    major, tickformat = AXIS_TICKS[granularity]
+    fig.update_layout(
+        title='Project Timeline',
+        height=min(max(600, len(ordered) * 18 + 200), 20000),
+        font=dict(family='Arial, sans-serif'),
+        xaxis=dict(
+            type='date',
+            side='top',
+            tickformat=tickformat,
+            dtick=major,
+            tick0=period_start(axis_start, PARENT_GRANULARITY[granularity]).isoformat(),
+            range=[axis_start.isoformat(), axis_end.isoformat()],
+            tickangle=-45,
+            tickfont=dict(size=10),
+            showgrid=True,
+            gridcolor='rgba(128, 128, 128, 0.5)',
+            # Grid of the periods drawn by the axis, instead of one vline per period
+            minor=dict(dtick=MINOR_TICKS[granularity], tick0=axis_start.isoformat(), showgrid=True, gridcolor='rgba(128, 128, 128, 0.15)', griddash='dot'),
+        ),
+        shapes=_partial_period_shading(start_date, end_date, axis_start, axis_end),
+        yaxis=dict(autorange='reversed', automargin=True, tickfont=dict(size=10)),
+        margin=dict(l=150, r=50, t=100, b=50),
+        bargap=0.3,
+        plot_bgcolor='white',
+        showlegend=False
+    )
+    return fig
+
+_figures = TableCache(maxsize=32)
+_figure_jsons = TableCache(maxsize=32)
+_images = TableCache(maxsize=8)
+
+def gantt_figure(tasks: list, large: bool = None, granularity: str = None) -> go.Figure:
+    """
+    Returns the Gantt chart of the tasks, built once per task content
+
+    The figure is shared by every caller with the same tasks, e.g. each rerun of the page,
+    so it must not be modified.
+    
+    Args:
+        tasks (list or TaskTable): List of dictionaries with name, start_date and end_date
+        large (bool, optional): See generate_gantt_chart
+        granularity (str, optional): See generate_gantt_chart
+    """
+    return _figures.get(tasks, generate_gantt_chart, large, granularity)
+
+def _figure_json(table: TaskTable) -> str:
+    return gantt_figure(table).to_json()
+
+def gantt_figure_json(tasks: list) -> str:
+    """
+    Returns the Gantt chart of the tasks serialized as Plotly JSON, serialized once per task content
+    """
+    return _figure_jsons.get(tasks, _figure_json)
+
+def _image_bytes(table: TaskTable, format: str, granularity: str) -> bytes:
+    logger.info(f"🖼️ Exporting Gantt chart as {format}")
+    return gantt_figure(table, granularity=granularity).to_image(format=format, width=1600, height=900, scale=2)
+
+def gantt_image_bytes(tasks: list, format: str = "png", granularity: str = None) -> bytes:
+    """
+    Renders the Gantt chart as a static image, only when asked for since it starts kaleido
+
+    Args:
+        tasks (list): List of dictionaries with name, start_date and end_date
+        format (str): png or svg
+        granularity (str, optional): See generate_gantt_chart
+        
+    Returns:
+        bytes: The image
+        
+    Raises:
+        ValueError: If kaleido is not installed
+    """
+    return _images.get(tasks, _image_bytes, format, granularity)
@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, MutableMapping, Optional
+
+from tracing import trace_run
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Planning jobs running at the same time in this process, shared by every Streamlit session
+PLANNER_JOB_WORKERS = int(os.environ.get("PLANNER_JOB_WORKERS", 2))
+# Finished jobs kept for result retrieval before the oldest are forgotten
+PLANNER_JOB_HISTORY = int(os.environ.get("PLANNER_JOB_HISTORY", 100))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """
+    A planning request running in the background, with its progress events and result
+    """
+
+    def __init__(self, client_need: str):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.client_need = client_need
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # (seconds since creation, event, stage name) in the order they happened
+        self.events: List[tuple] = []
+        self.values: Dict[str, Any] = {}
+        self.stage_records: List[Dict] = []
+        self.trace: List[Dict] = []
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def add_event(self, event: str, stage: str) -> None:
+        with self._lock:
+            self.events.append((round(time.time() - self.created, 3), event, stage))
+
+    def events_since(self, index: int = 0) -> List[tuple]:
+        """
+        Returns the events after the first `index` ones, to poll for progress incrementally
+        """
+        with self._lock:
+            return self.events[index:]
+
+    def stages_by_status(self) -> Dict[str, str]:
+        """
+        Returns the latest status of every stage that has started
+        """
+        with self._lock:
+            return {stage: event for _, event, stage in self.events}
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "stages": self.stages_by_status(),
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Runs planning jobs on a pool of worker threads, so a Streamlit session only submits
+    a job and polls it instead of holding its script thread for the whole pipeline.
+    """
+
+    def __init__(self, workers: int = PLANNER_JOB_WORKERS, history: int = PLANNER_JOB_HISTORY):
+        """
+        Args:
+            workers (int): Number of jobs planned at the same time
+            history (int): Number of finished jobs kept for result retrieval
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planner-job")
+        self.history = history
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, client_need: str, memo: Optional[MutableMapping] = None) -> str:
+        """
+        Queues a planning job
+
+        Args:
+            client_need (str): The client email to plan
+            memo (MutableMapping, optional): Where the stage results are memoized, see Pipeline.run.
+                Passing the session memo lets the page render each stage as soon as it is done.
+
+        Returns:
+            str: The job id
+        """
+        job = Job(client_need)
+        with self._lock:
+            self.jobs[job.job_id] = job
+            self._prune()
+        self.executor.submit(self._run, job, memo)
+        logger.info(f"📥 Job {job.job_id} queued, {self.queue_depth()} waiting")
+        return job.job_id
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def _run(self, job: Job, memo: Optional[MutableMapping]) -> None:
+        from main import PLANNING_PIPELINE
+
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            with trace_run(f"job_{job.job_id}") as trace:
+                try:
+                    run = PLANNING_PIPELINE.run({"client_need": job.client_need}, memo=memo, on_progress=job.add_event)
+                finally:
+                    trace.export_jsonl()
+                    job.trace = trace.records()
+            job.values = run.values
+            job.stage_records = run.stage_records(PLANNING_PIPELINE)
+            job.error = "; ".join(f"{name}: {error}" for name, error in run.errors.items()) or None
+            job.status = DONE
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            logger.info(f"📤 Job {job.job_id} {job.status} in {job.finished - job.started:.1f}s")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Returns the job, or None if it is unknown or was forgotten
+        """
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def result(self, job_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Waits for a job to finish and returns the values it produced
+
+        Raises:
+            KeyError: If the job is unknown
+            TimeoutError: If the job is still running after timeout seconds
+        """
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not job.done:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} is still {job.status}")
+            time.sleep(0.1)
+        return job.values
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if job.status == QUEUED)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of known jobs by status
+        """
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {status: statuses.count(status) for status in (QUEUED, RUNNING, DONE, FAILED)}
+
+
+job_queue = JobQueue()
@@ -1,72 +1,246 @@
-from openai_helpers import generate_chat_completion
+from openai_helpers import generate_chat_completion, agenerate_chat_completion, acollect_chat_completion, store_completion
 from prompts import *
 from utils import *
 from trello_utils import *
+from stream_parser import FunctionCallStreamParser, GANTT_TASK_PATH, TASK_DURATION_PATH, DEPENDENCY_EDGE_PATH, FUNCTION_CALL_PATH
+from tracing import span, traced
+from stream_sinks import create_stream_sink
+from rate_limiter import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from pipeline import Pipeline, Stage
+from scheduling import WorkCalendar, schedule_tasks, level_resources
+from plan_model import PlanModel
+from gantt_generator import gantt_figure, gantt_image_bytes
+from timescale import GRANULARITIES
 import streamlit as st
+from collections import Counter
+import hashlib
+import json
+import os
+import time
 
-def create_wbs_and_dependecy_graph(client_need,tab_wbs,tab_dependency_graph):
-    response_stream = generate_chat_completion(f"This is the raw client email: {client_need}", system_prompt=WBS_CREATOR_PROMPT)
+# Number of GANTT samples generated concurrently, 1 keeps the sequential retries. With the cpm
+# scheduler the duration estimates are sampled, and the live GANTT table is not streamed.
+GANTT_SPECULATIVE_SAMPLES = int(os.environ.get("GANTT_SPECULATIVE_SAMPLES", 1))
+# Fraction of the WBS tasks a GANTT sample must cover to be accepted
+GANTT_MIN_WBS_COVERAGE = float(os.environ.get("GANTT_MIN_WBS_COVERAGE", 0.9))
+# "cpm": the LLM only estimates durations and the dates follow from the dependency graph,
+# "llm": the LLM writes every date of the GANTT chart
+GANTT_SCHEDULER = os.environ.get("GANTT_SCHEDULER", "cpm").lower()
+# How many times each speculative slot produced the accepted GANTT, used to tune the fan-out
+gantt_slot_wins = Counter()
+
+def compute_wbs(client_need, container=None):
+    response_stream = generate_chat_completion(f"This is the raw client email: {client_need}", system_prompt=WBS_CREATOR_PROMPT, priority=PRIORITY_INTERACTIVE)
     wbs = ""
-    for chunk in response_stream:
-        wbs += chunk
-        print(chunk, end="")
+    parser = FunctionCallStreamParser(watch=[DEPENDENCY_EDGE_PATH])
+    with create_stream_sink("wbs", container) as sink:
+        for chunk in response_stream:
+            wbs += chunk
+            sink.write(chunk)
+            for _, edge in parser.feed(chunk):
+                logger.info(f"🔗 Dependency received: {edge[0]} -> {edge[1]}")
         
-    wbs, function_call = process_wbs(wbs)
+    with span("parse"):
+        wbs, function_call = process_wbs(wbs)
+    return {"wbs": wbs, "nodes": function_call[0]["parameters"]["nodes"], "edges": function_call[0]["parameters"]["edges"]}
+
+def render_wbs(tab_wbs, wbs, nodes, edges):
     with tab_wbs:
         st.markdown("``` <br>  "+wbs)
+
+def compute_dependency_graph(nodes, edges, container=None):
+    return {"dependency_graph_file": generate_dependency_graph(nodes, edges)}
+
+def render_dependency_graph(tab_dependency_graph, dependency_graph_file):
     with tab_dependency_graph:
         # Display the dependency graph with high quality
         st.image(
-            generate_dependency_graph(function_call[0]["parameters"]["nodes"],function_call[0]["parameters"]["edges"]),
+            dependency_graph_file,
             use_container_width=True,
             output_format='PNG'
         )
-    return wbs, function_call[0]["parameters"]["nodes"],function_call[0]["parameters"]["edges"]
 
+@traced("create_wbs_and_dependecy_graph")
+def create_wbs_and_dependecy_graph(client_need,tab_wbs,tab_dependency_graph):
+    result = compute_wbs(client_need, tab_wbs)
+    with span("render"):
+        render_wbs(tab_wbs, **result)
+    with span("render_dependency_graph"):
+        render_dependency_graph(tab_dependency_graph, **compute_dependency_graph(result["nodes"], result["edges"]))
+    return result["wbs"], result["nodes"], result["edges"]
 
-def create_gantt_chart(tab_gantt, client_need, wbs, dependency_graph_nodes, dependency_graph_edges):
-    max_retries = 4
-    retry_count = 0
+
+async def sample_gantt_speculatively(prompt, dependency_graph_nodes, fan_out, system_prompt=GANTT_CHART_CREATOR_PROMPT, coverage_of=None):
+    """
+    Generates fan_out GANTT samples concurrently and returns the first valid one.
+    The other samples are cancelled as soon as a winner is found. If no sample covers
+    enough of the WBS, the parseable sample with the best coverage is returned.
+    
+    Args:
+        prompt (str): The user prompt
+        dependency_graph_nodes (list): The WBS tasks
+        fan_out (int): Number of concurrent samples
+        system_prompt (str): GANTT_CHART_CREATOR_PROMPT, or GANTT_DURATION_ESTIMATOR_PROMPT for the cpm scheduler
+        coverage_of (callable, optional): Returns the fraction of the WBS covered by a sample and raises if
+            it cannot be parsed. Defaults to the coverage of the GANTT tasks.
+    
+    Returns:
+        str: The raw text of the accepted sample
+    """
+    request = dict(system_prompt=system_prompt, temperature=0.2, top_p=0.9)
+    if coverage_of is None:
+        coverage_of = lambda text: validate_gantt_tasks(extract_gantt_tasks(text), dependency_graph_nodes)
     
-    while retry_count < max_retries:
+    async def sample(slot):
+        # Only the first slot may replay a cached answer, the others are always new samples
+        gantt = await acollect_chat_completion(prompt, use_cache=slot == 0, validate=True, priority=PRIORITY_INTERACTIVE, **request)
+        coverage = coverage_of(gantt)
+        return slot, gantt, coverage
+    
+    pending = {asyncio.create_task(sample(slot)) for slot in range(fan_out)}
+    best = None
+    errors = []
+    try:
+        while pending and (best is None or best[2] < GANTT_MIN_WBS_COVERAGE):
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    slot, gantt, coverage = task.result()
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                logger.info(f"🎲 GANTT sample {slot} covers {coverage:.0%} of the WBS")
+                if best is None or coverage > best[2]:
+                    best = (slot, gantt, coverage)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    if best is None:
+        raise Exception(f"Failed to process GANTT chart after {fan_out} concurrent samples: {'; '.join(errors)}")
+    slot, gantt, coverage = best
+    gantt_slot_wins[slot] += 1
+    logger.info(f"🏆 GANTT sample {slot} accepted, wins per slot so far: {dict(sorted(gantt_slot_wins.items()))}")
+    store_completion(prompt, gantt, **request)
+    return gantt
+
+def estimate_task_durations(client_need, wbs, nodes, edges=(), container=None):
+    """
+    Asks the LLM how many working days each WBS task takes
+
+    With GANTT_SPECULATIVE_SAMPLES > 1 the estimate is sampled speculatively, like the GANTT of
+    the llm scheduler. Otherwise each estimate is shown in the live GANTT table as soon as it
+    is parsed, with provisional dates: it starts when its dependencies already received end.
+
+    Returns:
+        dict: WBS task name -> working days
+    """
+    prompt = f"This is the raw client email: {client_need}\n This is the WBS: {wbs}\n Estimate the duration of every task."
+    if GANTT_SPECULATIVE_SAMPLES > 1:
+        text = asyncio.run(sample_gantt_speculatively(
+            prompt, nodes, GANTT_SPECULATIVE_SAMPLES,
+            system_prompt=GANTT_DURATION_ESTIMATOR_PROMPT,
+            coverage_of=lambda text: len(extract_task_durations(text, nodes)) / max(len(nodes), 1),
+        ))
+        with span("parse"):
+            return extract_task_durations(text, nodes)
+
+    max_retries = 4
+    calendar = WorkCalendar.from_env()
+    predecessors = {}
+    for before, after in edges:
+        predecessors.setdefault(after, []).append(before)
+    for attempt in range(max_retries):
         try:
-            response_stream = generate_chat_completion(f"This is the raw client email: {client_need}\n This is the WBS: {wbs}\n Think step by step and create a full and complete GANTT chart.", system_prompt=GANTT_CHART_CREATOR_PROMPT, temperature=0.2, top_p=0.9)
-            gantt = ""
-            for chunk in response_stream:
-                gantt += chunk
-                print(chunk, end="")
-            
-            tasks, _, excel_filename = process_gantt(gantt_text=gantt)
-            break
+            response_stream = generate_chat_completion(prompt, system_prompt=GANTT_DURATION_ESTIMATOR_PROMPT, temperature=0.2, top_p=0.9, refresh_cache=attempt > 0, validate=True, priority=PRIORITY_INTERACTIVE)
+            text = ""
+            parser = FunctionCallStreamParser(watch=[TASK_DURATION_PATH])
+            # Provisional working day span of each task received so far
+            received = {}
+            with create_stream_sink("gantt", container) as sink:
+                for chunk in response_stream:
+                    text += chunk
+                    sink.write(chunk)
+                    for _, estimate in parser.feed(chunk):
+                        logger.info(f"⏱️ Duration received: {estimate.get('name')} {estimate.get('days')} days")
+                        node = find_wbs_node(estimate.get("name", ""), nodes)
+                        days = estimate.get("days")
+                        if node is None or node in received or not isinstance(days, (int, float)):
+                            continue
+                        start = max((received[p][1] for p in predecessors.get(node, ()) if p in received), default=0)
+                        end = start + max(int(round(days)), 1)
+                        received[node] = (start, end)
+                        sink.add_item({
+                            "name": node,
+                            "start_date": calendar.date_at(start).isoformat(),
+                            "end_date": calendar.date_at(end - 1).isoformat(),
+                        })
+            with span("parse", attempt=attempt + 1):
+                return extract_task_durations(text, nodes)
         except Exception as e:
-            retry_count += 1
-            if retry_count == max_retries:
-                raise Exception(f"Failed to process GANTT chart after {max_retries} attempts: {str(e)}")
-            print(f"Attempt {retry_count} failed, retrying...")
-            
+            if attempt == max_retries - 1:
+                raise Exception(f"Failed to estimate the task durations after {max_retries} attempts: {str(e)}")
+            logger.warning(f"Attempt {attempt + 1} failed, retrying...")
+
+def compute_gantt(client_need, wbs, nodes, edges=None, container=None):
+    max_retries = 4
+    retry_count = 0
     
+    if GANTT_SCHEDULER == "cpm" and edges is not None:
+        durations = estimate_task_durations(client_need, wbs, nodes, edges, container)
+        missing = [node for node in nodes if node not in durations]
+        if missing:
+            logger.warning(f"No duration estimated for {len(missing)} task(s), using the default: {', '.join(missing[:5])}")
+        with span("schedule", tasks=len(nodes)):
+            schedule = schedule_tasks(nodes, edges, durations, break_cycles=True)
+            tasks = schedule.to_tasks()
+        logger.info(f"🛤️ Project ends on {schedule.finish_date}, critical path: {' -> '.join(schedule.critical_path())}")
+    elif GANTT_SPECULATIVE_SAMPLES > 1:
+        prompt = f"This is the raw client email: {client_need}\n This is the WBS: {wbs}\n Think step by step and create a full and complete GANTT chart."
+        gantt = asyncio.run(sample_gantt_speculatively(prompt, nodes, GANTT_SPECULATIVE_SAMPLES))
+        with span("parse"):
+            tasks, _, _ = process_gantt(gantt_text=gantt)
+    else:
+        while retry_count < max_retries:
+            try:
+                response_stream = generate_chat_completion(f"This is the raw client email: {client_need}\n This is the WBS: {wbs}\n Think step by step and create a full and complete GANTT chart.", system_prompt=GANTT_CHART_CREATOR_PROMPT, temperature=0.2, top_p=0.9, refresh_cache=retry_count > 0, validate=True, priority=PRIORITY_INTERACTIVE)
+                gantt = ""
+                parser = FunctionCallStreamParser(watch=[GANTT_TASK_PATH])
+                with create_stream_sink("gantt", container) as sink:
+                    for chunk in response_stream:
+                        gantt += chunk
+                        sink.write(chunk)
+                        for _, task in parser.feed(chunk):
+                            logger.info(f"🧩 Task received: {task.get('name')}")
+                            sink.add_item(task)
+            
+                with span("parse", attempt=retry_count + 1):
+                    tasks, _, _ = process_gantt(gantt_text=gantt)
+                break
+            except Exception as e:
+                retry_count += 1
+                if retry_count == max_retries:
+                    raise Exception(f"Failed to process GANTT chart after {max_retries} attempts: {str(e)}")
+                logger.warning(f"Attempt {retry_count} failed, retrying...")
+    return {"tasks": tasks}
+
+def render_gantt(tab_gantt, tasks):
     with tab_gantt:
-        # Create a fragment to prevent rerun on download
+        # Auto picks the time scale from the project length
+        granularity = st.selectbox("Time scale", ["auto", *GRANULARITIES], key="gantt_granularity")
+        granularity = None if granularity == "auto" else granularity
         with st.container():
-            # Read the Excel file as binary and encode in base64
-            import base64
-            with open(excel_filename, 'rb') as f:
-                excel_data = base64.b64encode(f.read()).decode()
-            
-            st.markdown(f"""
-                <iframe name="dummyframe" id="dummyframe" style="display: none;"></iframe>
-                <a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{excel_data}" 
-                   download="{excel_filename}" 
-                   target="dummyframe" 
-                   class="css-1cpxqw2">
-                    📥 Download Excel
-                </a>
-                """,
-                unsafe_allow_html=True
+            # Served from memory by Streamlit's media endpoint, the bytes are cached by task content
+            st.download_button(
+                "📥 Download Excel",
+                data=gantt_excel_bytes(tasks, granularity),
+                file_name="gantt_chart.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             )
             
-        # Display Gantt chart
-        fig = generate_gantt_chart(tasks)
+        # Display Gantt chart, built once per task set and reused on every rerun
+        fig = gantt_figure(tasks, granularity=granularity)
         st.plotly_chart(
             fig, 
             use_container_width=True,
@@ -78,60 +252,231 @@ def create_gantt_chart(tab_gantt, client_need, wbs, dependency_graph_nodes, depe
             },
             height=800
         )
-    
-    return tasks
+        # The static export starts kaleido, so it is only rendered on demand
+        if st.button("🖼️ Export image", key="gantt_export_image"):
+            try:
+                st.download_button("📥 Download PNG", data=gantt_image_bytes(tasks, "png", granularity), file_name="gantt_chart.png", mime="image/png")
+                st.download_button("📥 Download SVG", data=gantt_image_bytes(tasks, "svg", granularity), file_name="gantt_chart.svg", mime="image/svg+xml")
+            except Exception as e:
+                logger.error(f"Gantt image export failed: {e}", exc_info=True)
+                st.error(f"The image export is not available: {str(e)}")
 
-def create_team_structure(tab_team_structure, client_need, tasks):
-    response_stream = generate_chat_completion(f"This is the raw client email: {client_need}\n These are the tasks: {tasks}", system_prompt=TEAM_STRUCTURE_CREATOR_PROMPT)
+def compute_editable_plan(tasks, edges, container=None):
+    return {"editable_plan": {"tasks": tasks, "edges": edges}}
+
+def render_plan_editor(tab_gantt, editable_plan):
+    # The model lives in the session, so edits accumulate across reruns without running the pipeline again
+    key = hashlib.sha256(json.dumps(editable_plan, sort_keys=True).encode("utf-8")).hexdigest()
+    models = st.session_state.setdefault("plan_models", {})
+    if key not in models:
+        models.clear()
+        models[key] = PlanModel(editable_plan["tasks"], editable_plan["edges"])
+    model = models[key]
+    with tab_gantt:
+        with st.expander("✏️ Edit the plan"):
+            task = st.selectbox("Task", model.names, key="plan_edit_task")
+            days = st.number_input("Working days", min_value=0, max_value=1000, value=model.duration(task), key=f"plan_edit_days_{task}")
+            depends_on = st.multiselect("Depends on", [name for name in model.names if name != task], default=model.dependencies(task), key=f"plan_edit_deps_{task}")
+            start = time.perf_counter()
+            changed = set()
+            try:
+                changed.update(model.set_duration(task, days))
+                current = model.dependencies(task)
+                for before in current:
+                    if before not in depends_on:
+                        changed.update(model.remove_dependency(before, task))
+                for before in depends_on:
+                    if before not in current:
+                        changed.update(model.add_dependency(before, task))
+            except ValueError as e:
+                st.error(str(e))
+            if changed:
+                st.caption(f"{len(changed)} task(s) rescheduled in {(time.perf_counter() - start) * 1000:.1f} ms")
+            st.metric("Project end", str(model.finish_date))
+            st.plotly_chart(model.figure(), use_container_width=True, key="plan_edit_chart")
+            # Every edit changes the tasks, so the workbook is only built when it is asked for
+            if st.button("📊 Export edited Excel", key="plan_edit_export"):
+                st.download_button(
+                    "📥 Download edited Excel",
+                    data=gantt_excel_bytes(model.to_tasks()),
+                    file_name="gantt_chart_edited.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key="plan_edit_download",
+                )
+
+@traced("create_gantt_chart")
+def create_gantt_chart(tab_gantt, client_need, wbs, dependency_graph_nodes, dependency_graph_edges):
+    result = compute_gantt(client_need, wbs, dependency_graph_nodes, dependency_graph_edges, tab_gantt)
+    with span("render"):
+        render_gantt(tab_gantt, **result)
+    return result["tasks"]
+
+def compute_team_structure(client_need, tasks, container=None):
+    response_stream = generate_chat_completion(f"This is the raw client email: {client_need}\n These are the tasks: {tasks}", system_prompt=TEAM_STRUCTURE_CREATOR_PROMPT, priority=PRIORITY_INTERACTIVE)
     team = ""
-    for chunk in response_stream:
-        team += chunk
-        print(chunk, end="")
-    team_structure, team_structure_dict = process_team_structure(team)
+    with create_stream_sink("team", container) as sink:
+        for chunk in response_stream:
+            team += chunk
+            sink.write(chunk)
+    with span("parse"):
+        team_structure, team_structure_dict = process_team_structure(team)
     
     logger.info(team_structure)
+    return {"team_structure": team_structure, "team_structure_dict": team_structure_dict}
+
+def render_team_structure(tab_team_structure, team_structure, team_structure_dict):
     with tab_team_structure:
         st.markdown(team_structure)
-    return team_structure_dict
 
-def create_cost_estimate(tab_cost_estimate, client_need, tasks, team_structure_dict):
-    response_stream = generate_chat_completion(f"This is the raw client email: {client_need}\n These are the tasks: {tasks}\n This is the team structure: {team_structure_dict}",system_prompt=COST_ESTIMATOR_PROMPT)
+@traced("create_team_structure")
+def create_team_structure(tab_team_structure, client_need, tasks):
+    result = compute_team_structure(client_need, tasks, tab_team_structure)
+    with span("render"):
+        render_team_structure(tab_team_structure, **result)
+    return result["team_structure_dict"]
+
+def compute_resource_plan(tasks, edges, team_structure_dict, container=None):
+    with span("level_resources", tasks=len(tasks)):
+        plan = level_resources(tasks, edges, team_structure_dict)
+    logger.info(f"👥 With the proposed team the project ends on {plan['finish_date']} ({plan['working_days']} working days, {plan['unconstrained_working_days']} without resource limits)")
+    return {"resource_plan": plan}
+
+def render_resource_plan(tab_team_structure, resource_plan):
+    with tab_team_structure:
+        st.markdown("## Resource Plan")
+        # Changing a headcount reruns the script, the plan is levelled again without any LLM call
+        columns = st.columns(min(len(resource_plan["headcount"]), 4) or 1)
+        headcount = {}
+        for i, (role, count) in enumerate(resource_plan["headcount"].items()):
+            headcount[role] = columns[i % len(columns)].number_input(role, min_value=1, max_value=100, value=count, step=1, key=f"headcount_{role}")
+        if headcount != resource_plan["headcount"]:
+            resource_plan = level_resources(resource_plan["tasks"], resource_plan["edges"], {}, headcount=headcount)
+        st.metric(
+            "Project end",
+            resource_plan["finish_date"],
+            delta=f"{resource_plan['working_days'] - resource_plan['unconstrained_working_days']} working days from the team size",
+            delta_color="inverse",
+        )
+        st.dataframe(
+            [{"role": role, "members": resource_plan["headcount"][role], "utilization": f"{utilization:.0%}"} for role, utilization in resource_plan["utilization"].items()],
+            use_container_width=True,
+        )
+        st.dataframe(
+            [{k: task[k] for k in ("name", "role", "start_date", "end_date", "delay_days")} for task in resource_plan["tasks"]],
+            use_container_width=True,
+        )
+
+async def cost_estimate_rounds(client_need, tasks, team_structure_dict, sink):
+    """
+    Runs both cost estimation rounds and the salary fetching on a single event loop
+    """
+    response_stream = agenerate_chat_completion(f"This is the raw client email: {client_need}\n These are the tasks: {tasks}\n This is the team structure: {team_structure_dict}",system_prompt=COST_ESTIMATOR_PROMPT, priority=PRIORITY_BACKGROUND)
     estimate = ""
-    for chunk in response_stream:
+    async for chunk in response_stream:
         estimate += chunk
-        print(chunk, end="")
+        sink.write(chunk)
     
-    function_call_salary_result=asyncio.run(process_estimate(estimate))
+    with span("salary_scraping"):
+        function_call_salary_result=await process_estimate(estimate)
     m=[{"role": "user", "content": f"This is the raw client email: {client_need}\n These are the tasks: {tasks}\n This is the team structure: {team_structure_dict}"},{"role":"assistant", "content":estimate}]
     
-    response_stream = generate_chat_completion(function_call_salary_result, previous_messages=m, system_prompt=COST_ESTIMATOR_PROMPT)
+    response_stream = agenerate_chat_completion(function_call_salary_result, previous_messages=m, system_prompt=COST_ESTIMATOR_PROMPT, priority=PRIORITY_BACKGROUND)
     estimate = ""
-    for chunk in response_stream:
+    async for chunk in response_stream:
       estimate += chunk
-      print(chunk, end="")
+      sink.write(chunk)
+    return estimate
+
+def compute_cost_estimate(client_need, tasks, team_structure_dict, container=None):
+    with create_stream_sink("cost_estimate", container) as sink:
+        estimate = asyncio.run(cost_estimate_rounds(client_need, tasks, team_structure_dict, sink))
+    return {"estimate": estimate}
 
+def render_cost_estimate(tab_cost_estimate, estimate):
     with tab_cost_estimate:
         st.markdown(estimate)
 
+@traced("create_cost_estimate")
+def create_cost_estimate(tab_cost_estimate, client_need, tasks, team_structure_dict):
+    result = compute_cost_estimate(client_need, tasks, team_structure_dict, tab_cost_estimate)
+    with span("render"):
+        render_cost_estimate(tab_cost_estimate, **result)
 
 
-def create_trello_cards(tab,user_input, tasks, team_structure):
-    response_stream=generate_chat_completion(f"Requirements: {user_input}\n Tasks: {tasks}\n Team structure: {team_structure}", system_prompt=PROMPT_CARD_CREATOR_FOR_TRELLO)
+
+async def stream_trello_calls(prompt, sink, previous_messages=None):
+    """
+    Streams a Trello round and starts every function call as soon as it is parsed,
+    so boards and cards get created while the model is still generating
+    """
+    response_stream=agenerate_chat_completion(prompt, previous_messages=previous_messages, system_prompt=PROMPT_CARD_CREATOR_FOR_TRELLO, priority=PRIORITY_BACKGROUND)
     trello_output=""
-    for chunk in response_stream:
-        trello_output+=chunk
-        print(chunk, end="")
-    
-    res=asyncio.run(process_trello_function_calls(trello_output))
+    parser=FunctionCallStreamParser(watch=[FUNCTION_CALL_PATH])
+    pending=[]
+    try:
+        async for chunk in response_stream:
+            trello_output+=chunk
+            sink.write(chunk)
+            for _, call in parser.feed(chunk):
+                coroutine=dispatch_trello_call(call)
+                if coroutine is not None:
+                    pending.append(asyncio.create_task(coroutine))
+        for _, call in parser.close():
+            coroutine=dispatch_trello_call(call)
+            if coroutine is not None:
+                pending.append(asyncio.create_task(coroutine))
+    finally:
+        # Let the calls already started finish even if the stream failed, instead of
+        # having them cancelled halfway through by asyncio.run, and keep one failed card
+        # from failing the others
+        with span("trello_io", calls=len(pending)):
+            results = await asyncio.gather(*pending, return_exceptions=True)
+        failures = [result for result in results if isinstance(result, BaseException)]
+        for failure in failures:
+            logger.error(f"❌ Trello call failed: {failure!r}")
+        if failures:
+            sink.write(f"\n{len(failures)} of {len(results)} Trello calls failed\n")
+    return trello_output, [result for result in results if not isinstance(result, BaseException)]
+
+async def trello_rounds(user_input, tasks, team_structure, sink):
+    """
+    Runs the board creation and the card creation rounds on a single event loop
+    """
+    trello_output, res=await stream_trello_calls(f"Requirements: {user_input}\n Tasks: {tasks}\n Team structure: {team_structure}", sink)
     logger.info(res)
-    response_stream=generate_chat_completion(f"Board ID: {res[0][0]}",previous_messages=[{"role":"user", "content":f"Requirements: {user_input}\n Tasks: {tasks}\n Team structure: {team_structure}"},{"role":"assistant", "content":trello_output}], system_prompt=PROMPT_CARD_CREATOR_FOR_TRELLO)
-    trello_output=""
-    for chunk in response_stream:
-        trello_output+=chunk
-        print(chunk, end="")
-    asyncio.run(process_trello_function_calls(trello_output))
+    if not res:
+        raise ValueError("The Trello board could not be created")
+    await stream_trello_calls(f"Board ID: {res[0][0]}", sink, previous_messages=[{"role":"user", "content":f"Requirements: {user_input}\n Tasks: {tasks}\n Team structure: {team_structure}"},{"role":"assistant", "content":trello_output}])
+    return res
+
+def compute_trello_cards(client_need, tasks, team_structure_dict, container=None):
+    with create_stream_sink("trello", container) as sink:
+        res=asyncio.run(trello_rounds(client_need, tasks, team_structure_dict, sink))
+    return {"board_id": res[0][1]}
+
+def render_trello_cards(tab, board_id):
     with tab:
         st.success("Trello cards created successfully")
-        st.write(f"Trello board URL: https://trello.com/b/{res[0][1]}")
+        st.write(f"Trello board URL: https://trello.com/b/{board_id}")
+
+@traced("create_trello_cards")
+def create_trello_cards(tab,user_input, tasks, team_structure):
+    result = compute_trello_cards(user_input, tasks, team_structure, tab)
+    with span("render"):
+        render_trello_cards(tab, **result)
+
+# The planning pipeline as a DAG: each stage starts as soon as its inputs are ready,
+# so the dependency graph overlaps the GANTT call and cost estimate overlaps Trello
+PLANNING_PIPELINE = Pipeline([
+    Stage("wbs", compute_wbs, inputs=["client_need"], outputs=["wbs", "nodes", "edges"], render=render_wbs),
+    Stage("dependency_graph", compute_dependency_graph, inputs=["nodes", "edges"], outputs=["dependency_graph_file"], render=render_dependency_graph),
+    Stage("gantt", compute_gantt, inputs=["client_need", "wbs", "nodes", "edges"], outputs=["tasks"], render=render_gantt),
+    Stage("plan_editor", compute_editable_plan, inputs=["tasks", "edges"], outputs=["editable_plan"], render=render_plan_editor),
+    Stage("team_structure", compute_team_structure, inputs=["client_need", "tasks"], outputs=["team_structure", "team_structure_dict"], render=render_team_structure),
+    Stage("resources", compute_resource_plan, inputs=["tasks", "edges", "team_structure_dict"], outputs=["resource_plan"], render=render_resource_plan),
+    Stage("cost_estimate", compute_cost_estimate, inputs=["client_need", "tasks", "team_structure_dict"], outputs=["estimate"], render=render_cost_estimate),
+    Stage("trello", compute_trello_cards, inputs=["client_need", "tasks", "team_structure_dict"], outputs=["board_id"], render=render_trello_cards),
+])
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
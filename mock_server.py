@@ -0,0 +1,387 @@
+"""
+Local stand-in for the Samba Nova /v1/chat/completions endpoint.
+
+It replays a transcript for each prompt of prompts.py with a configurable time to first
+token, tokens/second and error injection, so the pipeline can be benchmarked and tested
+without network access or API quota. Point the client at it with:
+
+    python mock_server.py --port 8000 --tokens-per-second 400
+    SAMBA_NOVA_BASE_URL=http://127.0.0.1:8000/v1 SAMBA_NOVA_API_KEY=mock streamlit run frontend.py
+
+The mock accepts any API key, but the client refuses to send an empty one. The cost estimate
+still looks up the salaries on salary.com, offline set SALARY_FETCH_TIMEOUT=5 to give up quickly.
+
+Recorded transcripts can be dropped in --transcripts-dir as <PROMPT_NAME>.txt, or
+<PROMPT_NAME>.<round>.txt for the prompts answered in two rounds (cost estimate and
+Trello). The files written by the "file" stream sink are a convenient source.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import prompts
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PROMPT_NAMES = {value: name for name, value in vars(prompts).items() if name.isupper() and isinstance(value, str)}
+_TOKEN_PATTERN = re.compile(r'\s*\S+\s*|\s+')
+
+DEFAULT_TRANSCRIPTS = {
+    "WBS_CREATOR_PROMPT": """<wbs>
+1 - Requirements Analysis
+  1.1 - Stakeholder Interviews
+  1.2 - Functional Specification
+2 - Development of the Backend
+  2.1 - Development of the Database Schema
+  2.2 - Development of the REST API
+3 - Development of the User Interface
+  3.1 - Design of the User Interface
+  3.2 - Implementation of the User Interface
+4 - Testing and Release
+  4.1 - Integration Testing
+  4.2 - Production Release
+</wbs>
+<function_call>
+[
+    {
+        "name": "generate_dependency_graph",
+        "parameters": {
+            "nodes": ["Stakeholder Interviews", "Functional Specification", "Development of the Database Schema", "Development of the REST API", "Design of the User Interface", "Implementation of the User Interface", "Integration Testing", "Production Release"],
+            "edges": [["Stakeholder Interviews", "Functional Specification"], ["Functional Specification", "Development of the Database Schema"], ["Functional Specification", "Design of the User Interface"], ["Development of the Database Schema", "Development of the REST API"], ["Design of the User Interface", "Implementation of the User Interface"], ["Development of the REST API", "Integration Testing"], ["Implementation of the User Interface", "Integration Testing"], ["Integration Testing", "Production Release"]]
+        }
+    }
+]
+</function_call>""",
+    "GANTT_CHART_CREATOR_PROMPT": """<function_call>
+[
+    {
+        "name": "create_gantt_chart_to_file",
+        "parameters": {
+            "gantt_chart": {
+                "tasks": [
+                    {"name": "Stakeholder Interviews", "start_date": "2024-11-18", "end_date": "2024-11-29"},
+                    {"name": "Functional Specification", "start_date": "2024-12-02", "end_date": "2024-12-20"},
+                    {"name": "Development of the Database Schema", "start_date": "2025-01-06", "end_date": "2025-01-31"},
+                    {"name": "Design of the User Interface", "start_date": "2025-01-06", "end_date": "2025-01-24"},
+                    {"name": "Development of the REST API", "start_date": "2025-02-03", "end_date": "2025-03-28"},
+                    {"name": "Implementation of the User Interface", "start_date": "2025-01-27", "end_date": "2025-03-21"},
+                    {"name": "Integration Testing", "start_date": "2025-03-31", "end_date": "2025-04-25"},
+                    {"name": "Production Release", "start_date": "2025-04-28", "end_date": "2025-05-09"}
+                ]
+            }
+        }
+    }
+]
+</function_call>""",
+    "GANTT_DURATION_ESTIMATOR_PROMPT": """<function_call>
+[
+    {
+        "name": "estimate_task_durations",
+        "parameters": {
+            "durations": [
+                {"name": "Stakeholder Interviews", "days": 10},
+                {"name": "Functional Specification", "days": 15},
+                {"name": "Development of the Database Schema", "days": 20},
+                {"name": "Design of the User Interface", "days": 15},
+                {"name": "Development of the REST API", "days": 40},
+                {"name": "Implementation of the User Interface", "days": 40},
+                {"name": "Integration Testing", "days": 20},
+                {"name": "Production Release", "days": 10}
+            ]
+        }
+    }
+]
+</function_call>""",
+    "TEAM_STRUCTURE_CREATOR_PROMPT": """<team>
+{
+    "Project Manager": {"Skills": "Planning, stakeholder management", "Seniority": "Senior", "Supervisor": "None"},
+    "Backend Developer": {"Skills": "Python, SQL, REST APIs", "Seniority": "Mid", "Supervisor": "Project Manager"},
+    "Frontend Developer": {"Skills": "React, UX", "Seniority": "Mid", "Supervisor": "Project Manager"},
+    "QA Engineer": {"Skills": "Test automation", "Seniority": "Junior", "Supervisor": "Project Manager"}
+}
+</team>""",
+    "COST_ESTIMATOR_PROMPT.1": """<function_call>
+[
+    {"name": "get_role_average_salary", "parameters": {"role": "Project Manager"}},
+    {"name": "get_role_average_salary", "parameters": {"role": "Backend Developer"}},
+    {"name": "get_role_average_salary", "parameters": {"role": "Frontend Developer"}},
+    {"name": "get_role_average_salary", "parameters": {"role": "QA Engineer"}}
+]
+</function_call>""",
+    "COST_ESTIMATOR_PROMPT.2": """## Personnel Costs
+- Project Manager: $60,000
+- Backend Developer: $55,000
+- Frontend Developer: $52,000
+- QA Engineer: $35,000
+
+## Non-personnel Costs
+- Cloud infrastructure: $6,000
+- Software licenses: $3,000
+
+**Total: $211,000**""",
+    "PROMPT_CARD_CREATOR_FOR_TRELLO.1": """<function_call>
+[
+    {"name": "create_board_on_trello", "parameters": {"board_name": "Project Plan"}}
+]
+</function_call>""",
+    "PROMPT_CARD_CREATOR_FOR_TRELLO.2": """<function_call>
+[
+    {"name": "add_card_to_trello", "parameters": {"card_name": "Functional Specification", "card_description": "Project Manager", "start_date": "2024-12-02", "end_date": "2024-12-20", "id_list": "{board_id}"}},
+    {"name": "add_card_to_trello", "parameters": {"card_name": "Development of the REST API", "card_description": "Backend Developer", "start_date": "2025-02-03", "end_date": "2025-03-28", "id_list": "{board_id}"}},
+    {"name": "add_card_to_trello", "parameters": {"card_name": "Integration Testing", "card_description": "QA Engineer", "start_date": "2025-03-31", "end_date": "2025-04-25", "id_list": "{board_id}"}}
+]
+</function_call>""",
+    "REQUIREMENTS_ANALYZER_PROMPT": "The client needs a web application with a backend, a user interface and a release plan.",
+}
+
+
+class MockSettings:
+    """
+    Behaviour of the mock endpoint
+    """
+
+    def __init__(
+        self,
+        ttft: float = 0.3,
+        tokens_per_second: float = 300.0,
+        malformed_rate: float = 0.0,
+        truncated_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        transcripts_dir: Optional[str] = None,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            ttft (float): Seconds before the first token is sent
+            tokens_per_second (float): Streaming speed after the first token, 0 for no delay
+            malformed_rate (float): Probability of corrupting the JSON inside the function call
+            truncated_rate (float): Probability of cutting the response in the middle of the function call
+            rate_limit_rate (float): Probability of answering 429 Too Many Requests
+            transcripts_dir (str, optional): Folder with recorded transcripts overriding the built-in ones
+            seed (int, optional): Seed of the error injection, for repeatable runs
+        """
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.malformed_rate = malformed_rate
+        self.truncated_rate = truncated_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.transcripts = dict(DEFAULT_TRANSCRIPTS)
+        if transcripts_dir:
+            self.transcripts.update(load_transcripts(transcripts_dir))
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "malformed": 0, "truncated": 0}
+
+    def roll(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] += 1
+
+
+def load_transcripts(directory: str) -> Dict[str, str]:
+    """
+    Loads <PROMPT_NAME>[.<round>].txt files from a folder
+    """
+    transcripts = {}
+    for name in os.listdir(directory):
+        if name.endswith(".txt"):
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                transcripts[name[:-len(".txt")]] = f.read()
+    logger.info(f"Loaded {len(transcripts)} recorded transcripts from {directory}")
+    return transcripts
+
+
+def select_transcript(messages: list, transcripts: Dict[str, str]) -> str:
+    """
+    Picks the transcript answering a request, from its system prompt and the number of previous answers
+    """
+    system_prompt = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    prompt_name = PROMPT_NAMES.get(system_prompt, "REQUIREMENTS_ANALYZER_PROMPT")
+    round_number = 1 + sum(1 for message in messages if message["role"] == "assistant")
+    for key in (f"{prompt_name}.{round_number}", prompt_name, f"{prompt_name}.1"):
+        if key in transcripts:
+            return transcripts[key]
+    return transcripts["REQUIREMENTS_ANALYZER_PROMPT"]
+
+
+def corrupt(text: str) -> str:
+    """
+    Breaks the JSON of the function call the way models usually do
+    """
+    if "<function_call>" not in text:
+        return text + "\n<function_call>\n```json\n[]\n```\n</function_call>"
+    return text.replace("<function_call>", "<function_call>\n```json", 1)
+
+
+def truncate(text: str) -> str:
+    """
+    Cuts the response in the middle of its function call, or in the middle if there is none
+    """
+    start = text.find("<function_call>")
+    end = len(text) if start < 0 else text.find("</function_call>", start)
+    start = 0 if start < 0 else start
+    return text[:(start + end) // 2] if end > start else text[:len(text) // 2]
+
+
+class MockCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings: MockSettings = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _write_event(self, payload) -> None:
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        self._write_chunk(f"data: {data}\n\n".encode("utf-8"))
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        settings = self.settings
+        settings.count("requests")
+
+        if settings.roll(settings.rate_limit_rate):
+            settings.count("rate_limited")
+            self._send_json(429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}}, {"Retry-After": "1"})
+            return
+
+        text = select_transcript(request.get("messages", []), settings.transcripts)
+        finish_reason = "stop"
+        if settings.roll(settings.malformed_rate):
+            settings.count("malformed")
+            text = corrupt(text)
+        elif settings.roll(settings.truncated_rate):
+            settings.count("truncated")
+            text = truncate(text)
+            finish_reason = "length"
+
+        tokens = _TOKEN_PATTERN.findall(text)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get("model", "mock")
+        prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+
+        if not request.get("stream"):
+            time.sleep(settings.ttft + (len(tokens) / settings.tokens_per_second if settings.tokens_per_second else 0))
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta, reason=None):
+            return {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": reason}],
+            }
+
+        try:
+            time.sleep(settings.ttft)
+            interval = 1.0 / settings.tokens_per_second if settings.tokens_per_second else 0
+            next_send = time.perf_counter()
+            for index, token in enumerate(tokens):
+                self._write_event(chunk({"role": "assistant", "content": token} if index == 0 else {"content": token}))
+                if interval:
+                    # Sleep against an absolute schedule so the rate holds for long transcripts
+                    next_send += interval
+                    delay = next_send - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+            self._write_event(chunk({}, finish_reason))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self._write_event({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": [], "usage": usage})
+            self._write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early, e.g. after a validation error
+            self.close_connection = True
+
+
+def start_mock_server(settings: Optional[MockSettings] = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Starts the mock endpoint in a background thread
+
+    Args:
+        settings (MockSettings, optional): Behaviour of the endpoint
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 picks a free one
+
+    Returns:
+        ThreadingHTTPServer: The running server. Its base URL is http://host:server.server_port/v1
+    """
+    handler = type("ConfiguredMockCompletionHandler", (MockCompletionHandler,), {"settings": settings or MockSettings()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"🧪 Mock Samba Nova endpoint listening on http://{host}:{server.server_port}/v1")
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local Samba Nova compatible mock endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=300.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Probability of malformed function call JSON")
+    parser.add_argument("--truncated-rate", type=float, default=0.0, help="Probability of a truncated function call")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Probability of a 429 answer")
+    parser.add_argument("--transcripts-dir", default=None, help="Folder with recorded <PROMPT_NAME>[.<round>].txt transcripts")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    settings = MockSettings(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        malformed_rate=args.malformed_rate,
+        truncated_rate=args.truncated_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        transcripts_dir=args.transcripts_dir,
+        seed=args.seed,
+    )
+    server = start_mock_server(settings, args.host, args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,14 +1,412 @@
-from openai import OpenAI
-from typing import List, Dict, Optional, Generator
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient, APIConnectionError, RateLimitError
+from typing import List, Dict, Optional, Generator, AsyncGenerator
 from prompts import *
+from completion_cache import completion_cache, replay_stream, LLM_CACHE_ENABLED
+from stream_validator import validator_for_prompt
+from tracing import start_span
+from rate_limiter import rate_limiter, estimate_tokens, PRIORITY_DEFAULT, SAMBA_NOVA_RATE_LIMIT_RETRIES
+import prompts
+import asyncio
+import atexit
+import httpx
 import logging
+import os
+import threading
+import time
+import weakref
+
+SAMBA_NOVA_API_KEY = os.environ.get("SAMBA_NOVA_API_KEY", "")
+SAMBA_NOVA_BASE_URL = os.environ.get("SAMBA_NOVA_BASE_URL", "https://api.sambanova.ai/v1")
+
+
+class SambaNovaClientManager:
+    """
+    Owns a single, long-lived Samba Nova client for the whole process.
+
+    The client keeps one HTTP connection pool alive across calls and across Streamlit
+    sessions, so only the first request of a planning run pays for the TLS handshake.
+    """
+
+    def __init__(
+        self,
+        api_key: str = SAMBA_NOVA_API_KEY,
+        base_url: str = SAMBA_NOVA_BASE_URL,
+        max_connections: int = int(os.environ.get("SAMBA_NOVA_MAX_CONNECTIONS", 20)),
+        max_keepalive_connections: int = int(os.environ.get("SAMBA_NOVA_MAX_KEEPALIVE", 10)),
+        keepalive_expiry: float = float(os.environ.get("SAMBA_NOVA_KEEPALIVE_EXPIRY", 120)),
+        connect_timeout: float = float(os.environ.get("SAMBA_NOVA_CONNECT_TIMEOUT", 10)),
+        read_timeout: float = float(os.environ.get("SAMBA_NOVA_READ_TIMEOUT", 120)),
+        max_retries: int = int(os.environ.get("SAMBA_NOVA_MAX_RETRIES", 2)),
+        max_concurrency: int = int(os.environ.get("SAMBA_NOVA_MAX_CONCURRENCY", 8)),
+    ):
+        """
+        Args:
+            api_key (str): The Samba Nova API key
+            base_url (str): The OpenAI compatible endpoint
+            max_connections (int): Maximum number of open connections in the pool
+            max_keepalive_connections (int): Maximum number of idle connections kept alive
+            keepalive_expiry (float): Seconds an idle connection is kept before being closed
+            connect_timeout (float): Seconds to wait for a new connection
+            read_timeout (float): Seconds to wait between two streamed chunks
+            max_retries (int): Retries on connection errors. 429 answers are retried with the rate limiter's backoff.
+            max_concurrency (int): Maximum number of completions, sync and async, streaming at the same time in the process
+        """
+        self.settings = dict(
+            api_key=api_key,
+            base_url=base_url,
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            max_retries=max_retries,
+            max_concurrency=max_concurrency,
+        )
+        self._client = None
+        # Async clients are bound to the event loop that created them
+        self._async_states = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        # Shared by the threads and the event loops of the process
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._stats = {"requests": 0, "connections_opened": 0, "tls_handshakes": 0}
+
+    def _timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            self.settings["read_timeout"],
+            connect=self.settings["connect_timeout"],
+        )
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.settings["max_connections"],
+            max_keepalive_connections=self.settings["max_keepalive_connections"],
+            keepalive_expiry=self.settings["keepalive_expiry"],
+        )
+
+    def _trace(self, event_name: str, info: dict) -> None:
+        # httpcore only emits these events when a brand new connection is opened
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self._stats["connections_opened"] += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self._stats["tls_handshakes"] += 1
+
+    async def _atrace(self, event_name: str, info: dict) -> None:
+        self._trace(event_name, info)
+
+    def _count_request(self) -> None:
+        with self._lock:
+            self._stats["requests"] += 1
+
+    def _on_request(self, request: httpx.Request) -> None:
+        self._count_request()
+        request.extensions["trace"] = self._trace
+
+    async def _on_async_request(self, request: httpx.Request) -> None:
+        self._count_request()
+        request.extensions["trace"] = self._atrace
+
+    def get_client(self) -> OpenAI:
+        """
+        Returns the shared client, creating it on first use
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    http_client = DefaultHttpxClient(
+                        limits=self._limits(),
+                        timeout=self._timeout(),
+                        event_hooks={"request": [self._on_request]},
+                    )
+                    self._client = OpenAI(
+                        api_key=self.settings["api_key"],
+                        base_url=self.settings["base_url"],
+                        timeout=self._timeout(),
+                        # Retries are done by create_stream, coordinated with the rate limiter
+                        max_retries=0,
+                        http_client=http_client,
+                    )
+                    logging.info(f"Created Samba Nova client for {self.settings['base_url']}")
+        return self._client
+
+    def _async_state(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # Forget the clients of loops that were closed, e.g. by a finished asyncio.run()
+            for closed_loop in [l for l in self._async_states if l.is_closed()]:
+                del self._async_states[closed_loop]
+            state = self._async_states.get(loop)
+            if state is None:
+                http_client = DefaultAsyncHttpxClient(
+                    limits=self._limits(),
+                    timeout=self._timeout(),
+                    event_hooks={"request": [self._on_async_request]},
+                )
+                client = AsyncOpenAI(
+                    api_key=self.settings["api_key"],
+                    base_url=self.settings["base_url"],
+                    timeout=self._timeout(),
+                    max_retries=0,
+                    http_client=http_client,
+                )
+                self._async_states[loop] = state = client
+        return state
+
+    def get_async_client(self) -> AsyncOpenAI:
+        """
+        Returns the async client of the running event loop, creating it on first use
+        """
+        return self._async_state()
+
+    def acquire_slot(self) -> threading.BoundedSemaphore:
+        """
+        Waits until fewer than max_concurrency completions stream in the process and takes a slot
+
+        Returns:
+            threading.BoundedSemaphore: The slots the caller must release its slot to, they are replaced by configure
+        """
+        slots = self._slots
+        slots.acquire()
+        return slots
+
+    async def aacquire_slot(self) -> threading.BoundedSemaphore:
+        """
+        Async version of acquire_slot, it waits without blocking the event loop
+        """
+        slots = self._slots
+        # Polling keeps the wait cancellable, a thread blocked on acquire() could take a slot nobody releases
+        while not slots.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+        return slots
+
+    async def aclose(self) -> None:
+        """
+        Closes the async client of the running event loop
+        """
+        with self._lock:
+            state = self._async_states.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state.close()
+
+    def configure(self, **settings) -> None:
+        """
+        Updates the client settings. The current pool is closed and a new one is created on the next call.
+
+        Args:
+            **settings: Any of the keyword arguments accepted by the constructor
+        """
+        unknown = set(settings) - set(self.settings)
+        if unknown:
+            raise ValueError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+        self.close()
+        with self._lock:
+            self.settings.update(settings)
+            self._slots = threading.BoundedSemaphore(self.settings["max_concurrency"])
+
+    def close(self) -> None:
+        """
+        Closes the connection pool. Safe to call multiple times.
+        """
+        with self._lock:
+            client, self._client = self._client, None
+            self._async_states.clear()
+        if client is not None:
+            client.close()
+            logging.info("Closed Samba Nova client")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns connection reuse statistics since the process started
+
+        Returns:
+            dict: requests, connections_opened, tls_handshakes, reused_requests and reuse_ratio
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["reused_requests"] = max(stats["requests"] - stats["connections_opened"], 0)
+        stats["reuse_ratio"] = stats["reused_requests"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+
+client_manager = SambaNovaClientManager()
+atexit.register(client_manager.close)
+
 
-SAMBA_NOVA_API_KEY = ""
 def get_client():
     """
-    Creates and returns an Samba Nova client instance
+    Returns the process-wide Samba Nova client instance
+    """
+    return client_manager.get_client()
+
+def build_messages(prompt: str, previous_messages: Optional[List[Dict[str, str]]], system_prompt: str) -> List[Dict[str, str]]:
+    """
+    Builds the message list sent to the model: system prompt, previous messages and the current prompt
+    """
+    # Start with the system message
+    messages = [{"role": "system", "content": system_prompt}]
+    
+    # Add previous messages if they exist
+    if previous_messages:
+        messages.extend(previous_messages)
+    
+    # Add the current prompt
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+def lookup_cache(messages, model, temperature, top_p, use_cache, refresh_cache):
+    """
+    Resolves the cache settings of a request
+
+    Returns:
+        tuple: (use_cache, cache_key, cached response or None)
+    """
+    if use_cache is None:
+        use_cache = LLM_CACHE_ENABLED
+    if not use_cache:
+        return False, None, None
+    cache_key = completion_cache.make_key(messages, model, temperature, top_p)
+    cached = None if refresh_cache else completion_cache.get(cache_key)
+    if cached is not None:
+        logging.info(f"Completion cache hit: {cache_key[:12]}")
+    return True, cache_key, cached
+
+def store_in_cache(use_cache: bool, cache_key: str, response: List[str], finish_reason: Optional[str]) -> None:
+    # Only complete responses are cached, truncated ones would be replayed forever
+    if use_cache and finish_reason != "length":
+        completion_cache.put(cache_key, "".join(response))
+        logging.info(f"Completion cache stats: {completion_cache.stats()}")
+
+def _retry_after(error: RateLimitError) -> Optional[float]:
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Returns the seconds to wait before retrying a failed request, or raises the error if it should not be retried
+    """
+    if isinstance(error, RateLimitError) and attempt < SAMBA_NOVA_RATE_LIMIT_RETRIES:
+        return rate_limiter.on_rate_limited(attempt, _retry_after(error))
+    if isinstance(error, APIConnectionError) and attempt < client_manager.settings["max_retries"]:
+        logging.warning(f"Samba Nova connection error, retry {attempt + 1}: {error}")
+        return min(0.5 * 2 ** attempt, 8.0)
+    raise error
+
+def create_stream(messages: List[Dict[str, str]], priority: int, estimated_tokens: int, **request):
+    """
+    Opens a streaming completion once the rate limiter admits it and a concurrency slot is free,
+    retrying 429 answers with jittered exponential backoff and connection errors with a short fixed backoff
+
+    The slot is only taken after the admission, so calls waiting in the priority queue or in a
+    backoff do not keep the others from reaching the queue.
+
+    Returns:
+        tuple: The stream and the slots its slot must be released to once the stream is closed
+    """
+    client = get_client()
+    for attempt in range(SAMBA_NOVA_RATE_LIMIT_RETRIES + client_manager.settings["max_retries"] + 1):
+        rate_limiter.acquire(estimated_tokens, priority)
+        slots = client_manager.acquire_slot()
+        try:
+            return client.chat.completions.create(messages=messages, stream=True, stream_options={"include_usage": True}, **request), slots
+        except (RateLimitError, APIConnectionError) as e:
+            slots.release()
+            # Nothing was generated, give the reserved tokens back
+            rate_limiter.record_usage(estimated_tokens, 0)
+            time.sleep(_retry_delay(e, attempt))
+        except BaseException:
+            slots.release()
+            raise
+
+async def acreate_stream(messages: List[Dict[str, str]], priority: int, estimated_tokens: int, **request):
+    """
+    Async version of create_stream
+    """
+    client = client_manager.get_async_client()
+    for attempt in range(SAMBA_NOVA_RATE_LIMIT_RETRIES + client_manager.settings["max_retries"] + 1):
+        await rate_limiter.aacquire(estimated_tokens, priority)
+        slots = await client_manager.aacquire_slot()
+        try:
+            return await client.chat.completions.create(messages=messages, stream=True, stream_options={"include_usage": True}, **request), slots
+        except (RateLimitError, APIConnectionError) as e:
+            slots.release()
+            rate_limiter.record_usage(estimated_tokens, 0)
+            await asyncio.sleep(_retry_delay(e, attempt))
+        except BaseException:
+            slots.release()
+            raise
+
+# Readable names of the system prompts, used to label the traces
+PROMPT_NAMES = {value: name for name, value in vars(prompts).items() if name.isupper() and isinstance(value, str)}
+
+class CompletionObserver:
+    """
+    Follows one streamed completion: collects the response, feeds the optional
+    validator and records an llm.completion span with TTFT, token counts,
+    tokens/second and finish reason
     """
-    return OpenAI(api_key=SAMBA_NOVA_API_KEY,base_url="https://api.sambanova.ai/v1",)
+
+    def __init__(self, system_prompt: str, model: str, validate: bool):
+        self.validator = validator_for_prompt(system_prompt) if validate else None
+        self.response = []
+        self.finish_reason = None
+        self.usage = None
+        self.first_token = None
+        self.chunks = 0
+        self.span = start_span("llm.completion", prompt=PROMPT_NAMES.get(system_prompt, "custom"), model=model, cache_hit=False)
+
+    def on_text(self, text: str) -> None:
+        if self.first_token is None:
+            self.first_token = self.span.elapsed()
+        self.chunks += 1
+        self.response.append(text)
+        if self.validator is not None:
+            self.validator.feed(text)
+
+    def on_chunk(self, chunk) -> Optional[str]:
+        """
+        Handles a chunk of the API stream and returns its text, if any
+        """
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return None
+        content = chunk.choices[0].delta.content
+        if content is not None:
+            self.on_text(content)
+        # Log the finish reason when the stream ends
+        if chunk.choices[0].finish_reason is not None:
+            self.finish_reason = chunk.choices[0].finish_reason
+            logging.info(f"Stream finished with reason: {chunk.choices[0].finish_reason}")
+        return content
+
+    def complete(self) -> None:
+        """
+        Called once the whole response was received
+        """
+        if self.validator is not None:
+            self.validator.close()
+
+    def fail(self, error: BaseException) -> None:
+        self.span.set(error=f"{type(error).__name__}: {error}")
+
+    def finish(self) -> None:
+        """
+        Computes the throughput metrics and closes the span
+        """
+        duration = self.span.elapsed()
+        completion_tokens = self.usage.completion_tokens if self.usage is not None else self.chunks
+        generation_time = duration - (self.first_token or 0)
+        self.span.set(
+            ttft=round(self.first_token, 4) if self.first_token is not None else None,
+            prompt_tokens=self.usage.prompt_tokens if self.usage is not None else None,
+            completion_tokens=completion_tokens,
+            tokens_per_second=round(completion_tokens / generation_time, 1) if generation_time > 0 else None,
+            finish_reason=self.finish_reason,
+        )
+        self.span.end()
 
 def generate_chat_completion(
     prompt: str, 
@@ -16,7 +414,11 @@ def generate_chat_completion(
     system_prompt: str = REQUIREMENTS_ANALYZER_PROMPT,
     model: str = "Meta-Llama-3.1-70B-Instruct",
     temperature: float = 0.3,
-    top_p: float = 1
+    top_p: float = 1,
+    use_cache: Optional[bool] = None,
+    refresh_cache: bool = False,
+    validate: bool = False,
+    priority: int = PRIORITY_DEFAULT
 ) -> Generator[str, None, None]:
     """
     Generates a chat completion using the OpenAI API with streaming
@@ -27,35 +429,161 @@ def generate_chat_completion(
             Each message should be a dict with 'role' and 'content' keys
         system_prompt (str): The system prompt to set the behavior of the AI
         model (str): The model to use (defaults to gpt-4)
+        use_cache (bool, optional): Whether to read and write the completion cache. Defaults to the LLM_CACHE setting
+        refresh_cache (bool): Skip the cached response, if any, and store the new sample in its place
+        validate (bool): Check the output against the schema of the system prompt while it streams
+        priority (int): Queue priority under the shared rate limit, e.g. PRIORITY_INTERACTIVE for the first stages
         
     Yields:
         str: Chunks of the generated response as they become available
+        
+    Raises:
+        StreamValidationError: With validate=True, as soon as the output can no longer become valid.
+            The HTTP stream is closed before the error is raised.
     """
-    client = get_client()
-    
-    # Start with the system message
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    # Add previous messages if they exist
-    if previous_messages:
-        messages.extend(previous_messages)
+    messages = build_messages(prompt, previous_messages, system_prompt)
+    observer = CompletionObserver(system_prompt, model, validate)
     
-    # Add the current prompt
-    messages.append({"role": "user", "content": prompt})
+    # Replay the cached response if this exact request was already answered
+    use_cache, cache_key, cached = lookup_cache(messages, model, temperature, top_p, use_cache, refresh_cache)
+    if cached is not None:
+        observer.span.set(cache_hit=True)
+        try:
+            for piece in replay_stream(cached):
+                observer.on_text(piece)
+                yield piece
+            observer.complete()
+        except BaseException as e:
+            observer.fail(e)
+            raise
+        finally:
+            observer.finish()
+        return
     
-    # Create a streaming response
-    stream = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        stream=True,
-        temperature=temperature,
-        top_p=top_p
-    )
+    # Create a streaming response once the shared rate limit allows it and a concurrency slot is free
+    estimated_tokens = estimate_tokens(messages)
+    try:
+        stream, slots = create_stream(messages, priority, estimated_tokens, model=model, temperature=temperature, top_p=top_p)
+    except BaseException as e:
+        observer.fail(e)
+        observer.finish()
+        raise
     
     # Yield each chunk as it arrives
-    for chunk in stream:
-        if chunk.choices[0].delta.content is not None:
-            yield chunk.choices[0].delta.content
-        # Log the finish reason when the stream ends
-        if chunk.choices[0].finish_reason is not None:
-            logging.info(f"Stream finished with reason: {chunk.choices[0].finish_reason}")
\ No newline at end of file
+    try:
+        for chunk in stream:
+            content = observer.on_chunk(chunk)
+            if content is not None:
+                yield content
+        observer.complete()
+    except BaseException as e:
+        observer.fail(e)
+        raise
+    finally:
+        # Release the connection right away when the stream is aborted or abandoned
+        stream.close()
+        slots.release()
+        observer.finish()
+        rate_limiter.record_usage(estimated_tokens, observer.usage.total_tokens if observer.usage is not None else None)
+    store_in_cache(use_cache, cache_key, observer.response, observer.finish_reason)
+    logging.info(f"Samba Nova connection stats: {client_manager.stats()}, rate limiter: {rate_limiter.metrics()}")
+
+async def agenerate_chat_completion(
+    prompt: str,
+    previous_messages: Optional[List[Dict[str, str]]] = None,
+    system_prompt: str = REQUIREMENTS_ANALYZER_PROMPT,
+    model: str = "Meta-Llama-3.1-70B-Instruct",
+    temperature: float = 0.3,
+    top_p: float = 1,
+    use_cache: Optional[bool] = None,
+    refresh_cache: bool = False,
+    validate: bool = False,
+    priority: int = PRIORITY_DEFAULT
+) -> AsyncGenerator[str, None]:
+    """
+    Async version of generate_chat_completion built on the async OpenAI client.
+
+    At most max_concurrency completions, sync and async, stream at the same time in the process.
+    Cancelling the consuming task, or closing the generator early, closes the HTTP
+    stream right away so the connection goes back to the pool.
+
+    Args:
+        Same as generate_chat_completion
+
+    Yields:
+        str: Chunks of the generated response as they become available
+    """
+    messages = build_messages(prompt, previous_messages, system_prompt)
+    observer = CompletionObserver(system_prompt, model, validate)
+    use_cache, cache_key, cached = lookup_cache(messages, model, temperature, top_p, use_cache, refresh_cache)
+    if cached is not None:
+        observer.span.set(cache_hit=True)
+        try:
+            for piece in replay_stream(cached):
+                observer.on_text(piece)
+                yield piece
+            observer.complete()
+        except BaseException as e:
+            observer.fail(e)
+            raise
+        finally:
+            observer.finish()
+        return
+
+    estimated_tokens = estimate_tokens(messages)
+    try:
+        stream, slots = await acreate_stream(messages, priority, estimated_tokens, model=model, temperature=temperature, top_p=top_p)
+    except BaseException as e:
+        observer.fail(e)
+        observer.finish()
+        raise
+    try:
+        async for chunk in stream:
+            content = observer.on_chunk(chunk)
+            if content is not None:
+                yield content
+        observer.complete()
+        store_in_cache(use_cache, cache_key, observer.response, observer.finish_reason)
+    except BaseException as e:
+        observer.fail(e)
+        raise
+    finally:
+        await stream.close()
+        slots.release()
+        observer.finish()
+        rate_limiter.record_usage(estimated_tokens, observer.usage.total_tokens if observer.usage is not None else None)
+    logging.info(f"Samba Nova connection stats: {client_manager.stats()}, rate limiter: {rate_limiter.metrics()}")
+
+def store_completion(
+    prompt: str,
+    response: str,
+    previous_messages: Optional[List[Dict[str, str]]] = None,
+    system_prompt: str = REQUIREMENTS_ANALYZER_PROMPT,
+    model: str = "Meta-Llama-3.1-70B-Instruct",
+    temperature: float = 0.3,
+    top_p: float = 1
+) -> None:
+    """
+    Stores a response in the completion cache under the key of the given request,
+    e.g. to keep the winning sample of several concurrent ones
+    """
+    if LLM_CACHE_ENABLED:
+        messages = build_messages(prompt, previous_messages, system_prompt)
+        completion_cache.put(completion_cache.make_key(messages, model, temperature, top_p), response)
+
+async def acollect_chat_completion(prompt: str, **kwargs) -> str:
+    """
+    Runs agenerate_chat_completion to the end and returns the whole response.
+    Useful to overlap independent completions with asyncio.gather.
+
+    Args:
+        prompt (str): The user's input prompt
+        **kwargs: Any other argument accepted by agenerate_chat_completion
+
+    Returns:
+        str: The full generated response
+    """
+    response = ""
+    async for chunk in agenerate_chat_completion(prompt, **kwargs):
+        response += chunk
+    return response
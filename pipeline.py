@@ -0,0 +1,312 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, MutableMapping, Optional, Sequence
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Stage results kept by an in-memory memo, about ten plans of the planning pipeline
+PLANNER_MEMO_ENTRIES = int(os.environ.get("PLANNER_MEMO_ENTRIES", 100))
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:  # Headless runs do not need Streamlit
+    add_script_run_ctx = get_script_run_ctx = None
+
+
+class Stage:
+    """
+    A step of the planning pipeline with declared inputs and outputs.
+
+    compute is called with the inputs as keyword arguments, plus container (the Streamlit
+    container receiving the streamed tokens, or None), and returns a dict with the outputs.
+    render, if any, is called on the script thread with the container and the outputs.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        compute: Callable[..., Dict[str, Any]],
+        inputs: Sequence[str],
+        outputs: Sequence[str],
+        render: Optional[Callable[..., None]] = None,
+    ):
+        self.name = name
+        self.compute = compute
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.render = render
+
+
+def memo_key(stage: Stage, inputs: Dict[str, Any]) -> str:
+    """
+    Key of a stage result: the stage name and a hash of its inputs. Since the inputs of a
+    stage are the outputs of the previous ones, a changed client need changes every key downstream.
+    """
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return f"{stage.name}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class StageMemo(MutableMapping):
+    """
+    In-memory memo of stage results keeping only the most recently used ones, so a session
+    planning many projects does not grow without limit. It is shared by the script thread
+    and the job threads, so every access holds a lock.
+    """
+
+    def __init__(self, max_entries: int = PLANNER_MEMO_ENTRIES):
+        """
+        Args:
+            max_entries (int): Stage results kept, the least recently used ones are evicted first
+        """
+        self.max_entries = max(int(max_entries), 1)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            outputs = self._entries[key]
+            self._entries.move_to_end(key)
+            return outputs
+
+    def __setitem__(self, key: str, outputs: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = outputs
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.info(f"🗑️ Stage result {evicted.split(':')[0]} evicted from memo")
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            del self._entries[key]
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PipelineRun:
+    """
+    Results and timings of one pipeline execution
+    """
+
+    def __init__(self, values: Dict[str, Any]):
+        self.values = dict(values)
+        self.started = time.perf_counter()
+        # Stage name -> (start offset, end offset) in seconds from the start of the run
+        self.timings: Dict[str, tuple] = {}
+        self.errors: Dict[str, BaseException] = {}
+        self.skipped: List[str] = []
+        self.memoized: List[str] = []
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors and not self.skipped
+
+    def stage_records(self, pipeline: "Pipeline") -> List[Dict]:
+        """
+        Returns one row per stage with its timing, status and whether it is on the critical path
+        """
+        critical = set(pipeline.critical_path(self))
+        rows = []
+        for stage in pipeline.stages:
+            start, end = self.timings.get(stage.name, (None, None))
+            rows.append({
+                "stage": stage.name,
+                "start": round(start, 3) if start is not None else None,
+                "seconds": round(end - start, 3) if start is not None else None,
+                "status": "failed" if stage.name in self.errors else "skipped" if stage.name in self.skipped else "memoized" if stage.name in self.memoized else "done",
+                "critical_path": stage.name in critical,
+            })
+        return rows
+
+
+class Pipeline:
+    """
+    Runs a DAG of stages, starting each stage on a worker thread as soon as all its inputs
+    are available, so independent stages (e.g. cost estimate and Trello) overlap.
+    """
+
+    def __init__(self, stages: Sequence[Stage], max_workers: int = 4):
+        self.stages = list(stages)
+        self.max_workers = max_workers
+        self.producers: Dict[str, Stage] = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"{output!r} is produced by both {self.producers[output].name} and {stage.name}")
+                self.producers[output] = stage
+
+    def upstream(self, stage: Stage) -> List[Stage]:
+        """
+        Returns the stages producing the inputs of a stage
+        """
+        return [self.producers[name] for name in stage.inputs if name in self.producers]
+
+    def _check_inputs(self, values: Dict[str, Any]) -> None:
+        for stage in self.stages:
+            missing = [name for name in stage.inputs if name not in self.producers and name not in values]
+            if missing:
+                raise ValueError(f"Stage {stage.name} needs {', '.join(missing)}, which no stage produces")
+
+    def _run_stage(self, stage: Stage, inputs: Dict[str, Any], run: PipelineRun, container, script_ctx) -> Dict[str, Any]:
+        if script_ctx is not None:
+            # Let the stage stream into its Streamlit container from this worker thread
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+        start = time.perf_counter() - run.started
+        try:
+            with span(f"stage.{stage.name}"):
+                outputs = stage.compute(container=container, **inputs)
+        finally:
+            run.timings[stage.name] = (start, time.perf_counter() - run.started)
+        missing = set(stage.outputs) - set(outputs)
+        if missing:
+            raise ValueError(f"Stage {stage.name} did not return {', '.join(sorted(missing))}")
+        return outputs
+
+    def _render(self, stage: Stage, run: PipelineRun, container) -> None:
+        if stage.render is None or container is None:
+            return
+        with span(f"render.{stage.name}"):
+            stage.render(container, **{name: run.values[name] for name in stage.outputs})
+
+    def _safe_render(self, stage: Stage, run: PipelineRun, container, on_error) -> None:
+        try:
+            self._render(stage, run, container)
+        except Exception as e:
+            # The outputs are fine, so the downstream stages still run
+            logger.error(f"Rendering stage {stage.name} failed: {e}", exc_info=e)
+            if on_error is not None:
+                on_error(stage, e, container)
+
+    def _replay(self, stage: Stage, run: PipelineRun, outputs: Dict[str, Any], container, on_error) -> None:
+        now = time.perf_counter() - run.started
+        run.timings[stage.name] = (now, now)
+        run.values.update(outputs)
+        run.memoized.append(stage.name)
+        logger.info(f"♻️ Stage {stage.name} restored from memo")
+        self._safe_render(stage, run, container, on_error)
+
+    def run(
+        self,
+        values: Dict[str, Any],
+        containers: Optional[Dict[str, Any]] = None,
+        on_error: Optional[Callable[[Stage, BaseException, Any], None]] = None,
+        memo: Optional[MutableMapping[str, Dict[str, Any]]] = None,
+        replay_only: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+    ) -> PipelineRun:
+        """
+        Executes the pipeline
+
+        Args:
+            values (Dict[str, Any]): The initial inputs, e.g. {"client_need": ...}
+            containers (Dict[str, Any], optional): Stage name -> Streamlit container for its stream and render
+            on_error (Callable, optional): Called on the calling thread with (stage, error, container) when a stage fails
+            memo (MutableMapping, optional): Stage results by memo_key, e.g. a StageMemo in st.session_state.
+                Stages found in it are rendered from it without being computed, new results are added to it.
+            replay_only (bool): Only render the memoized stages and skip the others, e.g. on a Streamlit rerun
+            on_progress (Callable, optional): Called on the calling thread with (event, stage name), where
+                event is started, finished, failed, skipped or memoized
+
+        Returns:
+            PipelineRun: The values produced, per-stage timings and errors. Stages depending
+                on a failed stage are skipped, the independent ones still run.
+        """
+        self._check_inputs(values)
+        containers = containers or {}
+        run = PipelineRun(values)
+        script_ctx = get_script_run_ctx() if get_script_run_ctx is not None else None
+        progress = on_progress or (lambda event, name: None)
+        waiting = list(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as executor:
+            while waiting or running:
+                # Repeat until stable, since memoized stages complete immediately
+                scheduled = None
+                while scheduled != len(waiting):
+                    scheduled = len(waiting)
+                    for stage in list(waiting):
+                        if any(upstream.name in run.errors or upstream.name in run.skipped for upstream in self.upstream(stage)):
+                            waiting.remove(stage)
+                            run.skipped.append(stage.name)
+                            logger.warning(f"⏭️ Skipping stage {stage.name}, one of its inputs is missing")
+                            progress("skipped", stage.name)
+                        elif all(name in run.values for name in stage.inputs):
+                            waiting.remove(stage)
+                            inputs = {name: run.values[name] for name in stage.inputs}
+                            key = memo_key(stage, inputs) if memo is not None else None
+                            if key is not None and key in memo:
+                                self._replay(stage, run, memo[key], containers.get(stage.name), on_error)
+                                progress("memoized", stage.name)
+                                continue
+                            if replay_only:
+                                run.skipped.append(stage.name)
+                                progress("skipped", stage.name)
+                                continue
+                            # Each stage gets a copy of the context so its spans nest under the current run
+                            context = contextvars.copy_context()
+                            future = executor.submit(context.run, self._run_stage, stage, inputs, run, containers.get(stage.name), script_ctx)
+                            running[future] = (stage, key)
+                            logger.info(f"▶️ Stage {stage.name} started")
+                            progress("started", stage.name)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, key = running.pop(future)
+                    container = containers.get(stage.name)
+                    try:
+                        run.values.update(future.result())
+                    except Exception as e:
+                        run.errors[stage.name] = e
+                        logger.error(f"Stage {stage.name} failed: {e}", exc_info=e)
+                        if on_error is not None:
+                            on_error(stage, e, container)
+                        progress("failed", stage.name)
+                        continue
+                    start, end = run.timings[stage.name]
+                    logger.info(f"✅ Stage {stage.name} finished in {end - start:.2f}s")
+                    if key is not None:
+                        memo[key] = {name: run.values[name] for name in stage.outputs}
+                    progress("finished", stage.name)
+                    self._safe_render(stage, run, container, on_error)
+        critical_path = self.critical_path(run)
+        if critical_path:
+            logger.info(f"🛤️ Critical path: {' -> '.join(critical_path)}")
+        return run
+
+    def critical_path(self, run: PipelineRun) -> List[str]:
+        """
+        Returns the chain of stages that determined the duration of a run: starting from the
+        stage that finished last, repeatedly follow the input whose producer finished last
+        """
+        finished = [stage for stage in self.stages if stage.name in run.timings]
+        if not finished:
+            return []
+        stage = max(finished, key=lambda s: run.timings[s.name][1])
+        path = [stage.name]
+        while True:
+            upstream = [s for s in self.upstream(stage) if s.name in run.timings]
+            if not upstream:
+                break
+            stage = max(upstream, key=lambda s: run.timings[s.name][1])
+            path.append(stage.name)
+        return path[::-1]
@@ -0,0 +1,282 @@
+import heapq
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import plotly.graph_objects as go
+
+from gantt_generator import generate_gantt_preview
+from scheduling import WorkCalendar, schedule_tasks
+from task_model import TaskTable, parse_date
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_DAY_MS = 24 * 3600 * 1000
+
+
+class PlanModel:
+    """
+    An editable plan: tasks, durations and dependencies with their critical path schedule.
+
+    The schedule is computed once, then each edit only revisits the tasks it can affect:
+    the earliest start of the downstream cone of the edited task and the distance to the
+    project end of its upstream cone. Slack and critical flags follow from both, the dates
+    and GANTT bars of the other tasks are reused as they are.
+    """
+
+    def __init__(
+        self,
+        tasks: List[Dict],
+        edges: Iterable[Sequence[str]],
+        calendar: Optional[WorkCalendar] = None,
+    ):
+        """
+        Args:
+            tasks (List[Dict] or TaskTable): The GANTT tasks, with duration_days or start_date and end_date, and optionally a role
+            edges (Iterable[Sequence[str]]): [a, b] pairs where b depends on a
+            calendar (WorkCalendar, optional): Defaults to the PLANNER_HOLIDAYS calendar starting with the first task, like schedule_tasks
+        """
+        tasks = TaskTable.of(tasks)
+        if calendar is None:
+            calendar = WorkCalendar.from_env(start=tasks.project_start)
+        self.calendar = calendar
+        durations = {}
+        for task in tasks:
+            if task.duration_days is not None:
+                durations[task.name] = task.duration_days
+            else:
+                start = calendar.index_of(task.start)
+                end = calendar.index_of(task.end + timedelta(days=1))
+                durations[task.name] = max(end - start, 1)
+        schedule = schedule_tasks([task.name for task in tasks], edges, durations, calendar, break_cycles=True)
+
+        self.names = schedule.names
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.roles = [None] * len(self.names)
+        for task in tasks:
+            self.roles[self.index[task.name]] = task.role
+        self.durations = schedule.durations
+        self.predecessors = schedule.predecessors
+        self.successors = [[] for _ in self.names]
+        for task, predecessors in enumerate(self.predecessors):
+            for p in predecessors:
+                self.successors[p].append(task)
+        self._set_order(schedule.order)
+        self.earliest_start = schedule.earliest_start
+        # Working days between the end of a task and the end of the project on its longest path,
+        # unlike the latest start it does not move when the project end moves
+        self.finish = schedule.finish
+        self.tail = [self.finish - latest for latest in schedule.latest_finish]
+
+        self._rows: List[Optional[tuple]] = [None] * len(self.names)
+        self._figure: Optional[go.Figure] = None
+        self._stale: set = set()
+        self.last_changed: List[str] = []
+
+    def _set_order(self, order: List[int]) -> None:
+        self.order = order
+        self.position = [0] * len(order)
+        for position, task in enumerate(order):
+            self.position[task] = position
+
+    def _find(self, name: str) -> int:
+        if name not in self.index:
+            raise KeyError(f"Unknown task {name!r}")
+        return self.index[name]
+
+    def duration(self, name: str) -> int:
+        return self.durations[self._find(name)]
+
+    def dependencies(self, name: str) -> List[str]:
+        """
+        Returns the tasks a task depends on
+        """
+        return [self.names[p] for p in self.predecessors[self._find(name)]]
+
+    def slack(self, task: int) -> int:
+        return self.finish - self.tail[task] - self.durations[task] - self.earliest_start[task]
+
+    @property
+    def finish_date(self):
+        return self.calendar.date_at(self.finish - 1) if self.finish else None
+
+    def _propagate(self, forward: Iterable[int], backward: Iterable[int], changed: set) -> None:
+        """
+        Recomputes the earliest start of the forward seeds and of their successors, and the tail
+        of the backward seeds and of their predecessors, stopping wherever a value does not change
+        """
+        heap = [(self.position[t], t) for t in set(forward)]
+        heapq.heapify(heap)
+        queued = {t for _, t in heap}
+        while heap:
+            _, task = heapq.heappop(heap)
+            queued.discard(task)
+            start = max((self.earliest_start[p] + self.durations[p] for p in self.predecessors[task]), default=0)
+            if start != self.earliest_start[task]:
+                self.earliest_start[task] = start
+                changed.add(task)
+                for s in self.successors[task]:
+                    if s not in queued:
+                        queued.add(s)
+                        heapq.heappush(heap, (self.position[s], s))
+
+        heap = [(-self.position[t], t) for t in set(backward)]
+        heapq.heapify(heap)
+        queued = {t for _, t in heap}
+        while heap:
+            _, task = heapq.heappop(heap)
+            queued.discard(task)
+            tail = max((self.tail[s] + self.durations[s] for s in self.successors[task]), default=0)
+            if tail != self.tail[task]:
+                self.tail[task] = tail
+                changed.add(task)
+                for p in self.predecessors[task]:
+                    if p not in queued:
+                        queued.add(p)
+                        heapq.heappush(heap, (-self.position[p], p))
+
+    def _finish_edit(self, changed: set) -> List[str]:
+        self.finish = max((es + d for es, d in zip(self.earliest_start, self.durations)), default=0)
+        self._stale |= changed
+        for task in changed:
+            self._rows[task] = None
+        self.last_changed = [self.names[t] for t in sorted(changed, key=self.position.__getitem__)]
+        return self.last_changed
+
+    def set_duration(self, name: str, days: int) -> List[str]:
+        """
+        Changes the working days of a task
+
+        Returns:
+            list: The tasks whose dates or slack changed, in topological order
+        """
+        task = self._find(name)
+        days = max(int(days), 0)
+        if days == self.durations[task]:
+            return []
+        self.durations[task] = days
+        changed = {task}
+        self._propagate(self.successors[task], self.predecessors[task], changed)
+        return self._finish_edit(changed)
+
+    def add_dependency(self, before: str, after: str) -> List[str]:
+        """
+        Makes `after` start once `before` is done
+
+        Raises:
+            ValueError: If `before` already depends on `after`, directly or not
+        """
+        first, second = self._find(before), self._find(after)
+        if first == second:
+            raise ValueError(f"{before} cannot depend on itself")
+        if first in self.predecessors[second]:
+            return []
+        # Tasks ordered the other way round may already depend on each other
+        reorder = self.position[first] > self.position[second]
+        if reorder and self._reaches(second, first):
+            raise ValueError(f"{after} cannot depend on {before}: {before} already depends on {after}")
+        self.successors[first].append(second)
+        self.predecessors[second].append(first)
+        if reorder:
+            self._reorder()
+        changed = set()
+        self._propagate([second], [first], changed)
+        return self._finish_edit(changed)
+
+    def remove_dependency(self, before: str, after: str) -> List[str]:
+        """
+        Removes the dependency of `after` on `before`, if any
+        """
+        first, second = self._find(before), self._find(after)
+        if first not in self.predecessors[second]:
+            return []
+        self.predecessors[second].remove(first)
+        self.successors[first].remove(second)
+        changed = set()
+        self._propagate([second], [first], changed)
+        return self._finish_edit(changed)
+
+    def _reaches(self, source: int, target: int) -> bool:
+        # Only tasks placed before the target in the current order can lead to it
+        limit = self.position[target]
+        stack, seen = [source], {source}
+        while stack:
+            task = stack.pop()
+            if task == target:
+                return True
+            for s in self.successors[task]:
+                if s not in seen and self.position[s] <= limit:
+                    seen.add(s)
+                    stack.append(s)
+        return False
+
+    def _reorder(self) -> None:
+        indegree = [len(p) for p in self.predecessors]
+        ready = [(self.position[t], t) for t in range(len(self.names)) if not indegree[t]]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            _, task = heapq.heappop(ready)
+            order.append(task)
+            for s in self.successors[task]:
+                indegree[s] -= 1
+                if not indegree[s]:
+                    heapq.heappush(ready, (self.position[s], s))
+        self._set_order(order)
+
+    def _row(self, task: int) -> tuple:
+        if self._rows[task] is None:
+            start = self.earliest_start[task]
+            end = start + self.durations[task] - 1 if self.durations[task] else start
+            self._rows[task] = (self.calendar.date_at(start).isoformat(), self.calendar.date_at(end).isoformat())
+        return self._rows[task]
+
+    def to_tasks(self) -> List[Dict]:
+        """
+        Returns the GANTT tasks in topological order, the dates of the unchanged tasks are not recomputed
+        """
+        tasks = []
+        for i in self.order:
+            start_date, end_date = self._row(i)
+            slack = self.slack(i)
+            task = {
+                "name": self.names[i],
+                "start_date": start_date,
+                "end_date": end_date,
+                "duration_days": self.durations[i],
+                "slack_days": slack,
+                "critical": slack == 0,
+            }
+            if self.roles[i] is not None:
+                task["role"] = self.roles[i]
+            tasks.append(task)
+        return tasks
+
+    def critical_path(self) -> List[str]:
+        """
+        Returns the tasks without slack, in topological order
+        """
+        return [self.names[i] for i in self.order if self.slack(i) == 0]
+
+    def figure(self) -> go.Figure:
+        """
+        Returns the GANTT figure of the plan. It is built once, later calls only move the bars of the edited tasks.
+        """
+        if self._figure is None:
+            self._figure = generate_gantt_preview(self.to_tasks())
+            self._bar_slot = {task: n for n, task in enumerate(self.order)}
+            self._stale.clear()
+            return self._figure
+        if self._stale:
+            bars = self._figure.data[0]
+            widths, bases = list(bars.x), list(bars.base)
+            slot = self._bar_slot
+            for task in self._stale:
+                start_date, end_date = self._row(task)
+                bases[slot[task]] = start_date
+                widths[slot[task]] = ((parse_date(end_date) - parse_date(start_date)).days + 1) * _DAY_MS
+            with self._figure.batch_update():
+                bars.x, bars.base = widths, bases
+            self._stale.clear()
+        return self._figure
@@ -175,6 +175,35 @@ Here is a list of functions in JSON format that you can invoke:
 """
 
 
+GANTT_DURATION_ESTIMATOR_PROMPT = """
+Instructions:
+- You are a Senior Project Manager with over 20 years of experience in the field.
+- You are given a detailed report about the requirements of a project and its WBS.
+- Your task is to estimate how many working days each WBS sub-task takes. The dates are computed from your estimates and the dependencies of the WBS.
+- A task must take at least 5 working days.
+- DO NOT SKIP TASKS and use exactly the names of the WBS sub-tasks.
+
+You should only return the function call in the tool call section, in this format:
+
+<function_call>
+[
+    {
+        "name": "estimate_task_durations",
+        "parameters": {
+            "durations": [
+                {"name": "Task 1", "days": 10},
+                {"name": "Task 2", "days": 5}
+            ]
+        }
+    }
+]
+</function_call>
+
+DO NOT ADD comments inside and after the <function_call> tags.
+DO NOT USE Markdown format in the function call tags.
+"""
+
+
 TEAM_STRUCTURE_CREATOR_PROMPT = """
 You are a Senior Project Manager with over 10 years of experience in the field.
 You are given a detailed report about the requirements of a project, the WBS, the dependency graph, and the Gantt chart.
@@ -0,0 +1,259 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Limits shared by every session of the process. 0 disables a limit.
+SAMBA_NOVA_REQUESTS_PER_MINUTE = float(os.environ.get("SAMBA_NOVA_REQUESTS_PER_MINUTE", 60))
+SAMBA_NOVA_TOKENS_PER_MINUTE = float(os.environ.get("SAMBA_NOVA_TOKENS_PER_MINUTE", 200000))
+SAMBA_NOVA_RATE_LIMIT_RETRIES = int(os.environ.get("SAMBA_NOVA_RATE_LIMIT_RETRIES", 5))
+BACKOFF_BASE = float(os.environ.get("SAMBA_NOVA_BACKOFF_BASE", 1.0))
+BACKOFF_MAX = float(os.environ.get("SAMBA_NOVA_BACKOFF_MAX", 30.0))
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_DEFAULT: "default", PRIORITY_BACKGROUND: "background"}
+
+# Tokens reserved for the answer when a request is admitted, corrected once the usage is known
+EXPECTED_COMPLETION_TOKENS = int(os.environ.get("SAMBA_NOVA_EXPECTED_COMPLETION_TOKENS", 1500))
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    Rough token count of a request: about 4 characters per token for the prompt plus the expected answer
+    """
+    return sum(len(message.get("content") or "") for message in messages) // 4 + EXPECTED_COMPLETION_TOKENS
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Seconds to wait before retrying a rate limited request, using exponential backoff with full jitter
+
+    Args:
+        attempt (int): 0 for the first retry
+        retry_after (float, optional): Delay asked by the server, used as a lower bound
+
+    Returns:
+        float: The delay in seconds
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+class TokenBucket:
+    """
+    Refills continuously up to its capacity, i.e. a per minute limit without bursts above it
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` is available. A request larger than the whole bucket only waits for a full bucket.
+        """
+        if not self.capacity:
+            return 0.0
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def take(self, amount: float) -> None:
+        if self.capacity:
+            self.level -= amount
+
+
+class RateLimiter:
+    """
+    Admits LLM requests under a requests/minute and a tokens/minute limit shared by the whole process.
+
+    Waiting requests form a priority queue: the head is admitted as soon as both buckets allow
+    it, so interactive calls go ahead of queued background ones. Works from threads (acquire)
+    and from event loops (aacquire) at the same time.
+    """
+
+    def __init__(self, requests_per_minute: float = SAMBA_NOVA_REQUESTS_PER_MINUTE, tokens_per_minute: float = SAMBA_NOVA_TOKENS_PER_MINUTE):
+        """
+        Args:
+            requests_per_minute (float): Maximum requests per minute, 0 for no limit
+            tokens_per_minute (float): Maximum prompt + completion tokens per minute, 0 for no limit
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._paused_until = 0.0
+        self._metrics = {
+            "admitted": 0,
+            "rate_limited": 0,
+            "max_queue_depth": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+            "wait_by_priority": {},
+        }
+
+    def configure(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None) -> None:
+        """
+        Replaces the limits, starting from full buckets
+        """
+        with self._condition:
+            if requests_per_minute is not None:
+                self.requests = TokenBucket(requests_per_minute)
+            if tokens_per_minute is not None:
+                self.tokens = TokenBucket(tokens_per_minute)
+            self._condition.notify_all()
+
+    def _enqueue(self, priority: int) -> tuple:
+        ticket = (priority, next(self._counter))
+        heapq.heappush(self._queue, ticket)
+        self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], len(self._queue))
+        return ticket
+
+    def _try_admit(self, ticket: tuple, tokens: int) -> float:
+        """
+        Admits the ticket if it is at the head of the queue and the buckets allow it.
+        Must be called with the condition held.
+
+        Returns:
+            float: 0 if admitted, otherwise the seconds worth waiting before trying again
+        """
+        now = time.monotonic()
+        if self._queue[0] != ticket:
+            return 0.05
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        wait = max(self._paused_until - now, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+        if wait > 0:
+            return wait
+        heapq.heappop(self._queue)
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self._condition.notify_all()
+        return 0.0
+
+    def _record_wait(self, priority: int, waited: float) -> None:
+        metrics = self._metrics
+        metrics["admitted"] += 1
+        metrics["total_wait"] += waited
+        metrics["max_wait"] = max(metrics["max_wait"], waited)
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        count, total = metrics["wait_by_priority"].get(name, (0, 0.0))
+        metrics["wait_by_priority"][name] = (count + 1, total + waited)
+        if waited > 1:
+            logger.info(f"⏳ LLM request ({name}) waited {waited:.1f}s for the rate limit, {len(self._queue)} still queued")
+
+    def _cancel(self, ticket: tuple) -> None:
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._condition.notify_all()
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_DEFAULT) -> float:
+        """
+        Blocks the calling thread until the request may be sent
+
+        Args:
+            tokens (int): Estimated prompt + completion tokens of the request
+            priority (int): PRIORITY_INTERACTIVE, PRIORITY_DEFAULT or PRIORITY_BACKGROUND
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        start = time.monotonic()
+        with self._condition:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    wait = self._try_admit(ticket, tokens)
+                    if not wait:
+                        break
+                    self._condition.wait(wait)
+            except BaseException:
+                self._cancel(ticket)
+                raise
+            waited = time.monotonic() - start
+            self._record_wait(priority, waited)
+        return waited
+
+    async def aacquire(self, tokens: int, priority: int = PRIORITY_DEFAULT) -> float:
+        """
+        Async version of acquire, waiting without blocking the event loop
+        """
+        start = time.monotonic()
+        with self._condition:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_admit(ticket, tokens)
+                    if not wait:
+                        waited = time.monotonic() - start
+                        self._record_wait(priority, waited)
+                        return waited
+                # Poll again soon: a request ahead in the queue may be admitted by another thread
+                await asyncio.sleep(min(wait, 0.05))
+        except BaseException:
+            with self._condition:
+                self._cancel(ticket)
+            raise
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """
+        Corrects the token bucket once the real usage of an admitted request is known
+        """
+        if actual_tokens is None:
+            return
+        with self._condition:
+            self.tokens.take(actual_tokens - estimated_tokens)
+
+    def on_rate_limited(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Records a 429 answer and pauses every queued request for the backoff delay,
+        so the other sessions slow down too instead of hitting the limit again
+
+        Returns:
+            float: Seconds the caller should wait before retrying
+        """
+        delay = backoff_delay(attempt, retry_after)
+        with self._condition:
+            self._metrics["rate_limited"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logger.warning(f"🚦 Samba Nova rate limit hit, retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        Returns the queue and wait statistics since the process started
+
+        Returns:
+            dict: queue_depth, max_queue_depth, admitted, rate_limited, mean_wait, max_wait
+                and mean_wait_<priority> for each priority seen
+        """
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = len(self._queue)
+        wait_by_priority = metrics.pop("wait_by_priority")
+        metrics["mean_wait"] = metrics["total_wait"] / metrics["admitted"] if metrics["admitted"] else 0.0
+        for name, (count, total) in wait_by_priority.items():
+            metrics[f"mean_wait_{name}"] = total / count
+        return metrics
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,481 @@
+import bisect
+import heapq
+import logging
+import os
+import re
+from collections import Counter, deque
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from task_model import TaskTable, parse_date
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# First day of the project, the date the GANTT prompt has always asked for
+PLANNER_PROJECT_START = os.environ.get("PLANNER_PROJECT_START", "2024-11-18")
+# Comma separated non-working dates or inclusive ranges, e.g. "2024-12-25,2025-01-01" or "2024-12-23..2025-01-03"
+PLANNER_HOLIDAYS = os.environ.get("PLANNER_HOLIDAYS", "")
+# Monday is 0
+WORKING_WEEKDAYS = (0, 1, 2, 3, 4)
+# Working days of a task whose duration is unknown, the one week minimum of the GANTT prompt
+DEFAULT_TASK_DURATION_DAYS = int(os.environ.get("PLANNER_DEFAULT_TASK_DAYS", 5))
+
+
+class WorkCalendar:
+    """
+    Maps working day numbers (0 for the first working day of the project) to dates and back
+    """
+
+    def __init__(self, start: Optional[date] = None, holidays: Iterable[date] = (), weekdays: Sequence[int] = WORKING_WEEKDAYS):
+        """
+        Args:
+            start (date, optional): First day of the project, moved to the next working day if needed.
+                Defaults to PLANNER_PROJECT_START.
+            holidays (Iterable[date]): Non-working dates
+            weekdays (Sequence[int]): Working weekdays, Monday is 0
+        """
+        if start is None:
+            start = parse_date(PLANNER_PROJECT_START)
+        if not weekdays:
+            raise ValueError("A calendar needs at least one working weekday")
+        self.holidays = frozenset(holidays)
+        self.weekdays = frozenset(weekdays)
+        self._days = []
+        self._next = start
+        self.start = self.date_at(0)
+
+    @classmethod
+    def from_env(cls, start: Optional[date] = None) -> "WorkCalendar":
+        """
+        Returns the calendar configured by PLANNER_PROJECT_START and PLANNER_HOLIDAYS
+
+        Args:
+            start (date, optional): First day of the project, overriding PLANNER_PROJECT_START,
+                e.g. the first task of an existing GANTT
+        """
+        holidays = []
+        for item in PLANNER_HOLIDAYS.split(","):
+            first, _, last = item.strip().partition("..")
+            if not first:
+                continue
+            day, last = parse_date(first), parse_date(last) if last else parse_date(first)
+            while day <= last:
+                holidays.append(day)
+                day += timedelta(days=1)
+        return cls(start=start, holidays=holidays)
+
+    def is_working_day(self, day: date) -> bool:
+        return day.weekday() in self.weekdays and day not in self.holidays
+
+    def _extend(self, index: int) -> None:
+        # Working days are generated lazily, only as far as the longest schedule needs
+        while len(self._days) <= index:
+            if self.is_working_day(self._next):
+                self._days.append(self._next)
+            self._next += timedelta(days=1)
+
+    def date_at(self, index: int) -> date:
+        """
+        Returns the date of a working day number
+        """
+        self._extend(index)
+        return self._days[index]
+
+    def index_of(self, day: date) -> int:
+        """
+        Returns the number of the first working day on or after a date, 0 before the start
+        """
+        while not self._days or self._days[-1] < day:
+            self._extend(len(self._days))
+        return bisect.bisect_left(self._days, day)
+
+
+class Schedule:
+    """
+    Result of the critical path method over a dependency graph. Times are working day numbers,
+    a task occupies the working days [earliest_start, earliest_finish).
+    """
+
+    def __init__(self, names: List[str], durations: List[int], predecessors: List[List[int]], order: List[int], calendar: WorkCalendar):
+        self.names = names
+        self.durations = durations
+        self.predecessors = predecessors
+        self.order = order
+        self.calendar = calendar
+        count = len(names)
+        self.earliest_start = [0] * count
+        self.earliest_finish = [0] * count
+        self.latest_start = [0] * count
+        self.latest_finish = [0] * count
+        self.slack = [0] * count
+
+    @property
+    def finish(self) -> int:
+        """
+        Number of working days of the whole project
+        """
+        return max(self.earliest_finish, default=0)
+
+    @property
+    def finish_date(self) -> Optional[date]:
+        return self.calendar.date_at(self.finish - 1) if self.finish else None
+
+    def critical_tasks(self) -> List[str]:
+        """
+        Returns every task without slack, in topological order
+        """
+        return [self.names[i] for i in self.order if self.slack[i] == 0]
+
+    def critical_path(self) -> List[str]:
+        """
+        Returns one chain of critical tasks from the start to the end of the project
+        """
+        finish = self.finish
+        ends = [i for i in self.order if self.slack[i] == 0 and self.earliest_finish[i] == finish]
+        if not ends:
+            return []
+        path = [ends[-1]]
+        while True:
+            task = path[-1]
+            previous = [p for p in self.predecessors[task] if self.slack[p] == 0 and self.earliest_finish[p] == self.earliest_start[task]]
+            if not previous:
+                break
+            path.append(previous[0])
+        return [self.names[i] for i in reversed(path)]
+
+    def to_tasks(self) -> List[Dict]:
+        """
+        Returns the GANTT tasks, in topological order, with the dates every generator expects
+
+        Returns:
+            list: Dicts with name, start_date and end_date (inclusive, YYYY-MM-DD), plus
+                duration_days, slack_days and critical
+        """
+        date_at = self.calendar.date_at
+        tasks = []
+        for i in self.order:
+            start = self.earliest_start[i]
+            # A zero duration task is a milestone on its start day
+            end = self.earliest_finish[i] - 1 if self.durations[i] else start
+            tasks.append({
+                "name": self.names[i],
+                "start_date": date_at(start).isoformat(),
+                "end_date": date_at(end).isoformat(),
+                "duration_days": self.durations[i],
+                "slack_days": self.slack[i],
+                "critical": self.slack[i] == 0,
+            })
+        return tasks
+
+
+def _topological_order(names: List[str], successors: List[List[int]], predecessors: List[List[int]], break_cycles: bool) -> List[int]:
+    """
+    Kahn's algorithm, keeping the input order among tasks that are ready at the same time
+    """
+    count = len(names)
+    indegree = [len(p) for p in predecessors]
+    ready = deque(i for i in range(count) if not indegree[i])
+    order = []
+    done = [False] * count
+    while len(order) < count:
+        if not ready:
+            blocked = [i for i in range(count) if not done[i]]
+            if not break_cycles:
+                raise ValueError(f"The dependency graph has a cycle through {', '.join(names[i] for i in blocked[:5])}")
+            # Start the first blocked task anyway and drop its unresolved dependencies
+            task = min(blocked, key=lambda i: (indegree[i], i))
+            dropped = [p for p in predecessors[task] if not done[p]]
+            logger.warning(f"🔁 Dependency cycle: ignoring {', '.join(names[p] for p in dropped)} -> {names[task]}")
+            predecessors[task] = [p for p in predecessors[task] if done[p]]
+            for p in dropped:
+                successors[p].remove(task)
+            indegree[task] = 0
+            ready.append(task)
+        task = ready.popleft()
+        done[task] = True
+        order.append(task)
+        for successor in successors[task]:
+            indegree[successor] -= 1
+            if not indegree[successor]:
+                ready.append(successor)
+    return order
+
+
+def schedule_tasks(
+    nodes: Sequence[str],
+    edges: Iterable[Sequence[str]],
+    durations: Dict[str, int],
+    calendar: Optional[WorkCalendar] = None,
+    default_duration: int = DEFAULT_TASK_DURATION_DAYS,
+    break_cycles: bool = False,
+) -> Schedule:
+    """
+    Computes earliest and latest dates, slack and critical path of the tasks with the critical path method
+
+    Args:
+        nodes (Sequence[str]): Task names, as in the dependency graph of the WBS
+        edges (Iterable[Sequence[str]]): [a, b] pairs where b depends on a (b starts after a finishes)
+        durations (Dict[str, int]): Working days of each task, estimated by the LLM or given by the user
+        calendar (WorkCalendar, optional): Working day calendar, WorkCalendar.from_env() by default
+        default_duration (int): Working days of the tasks missing from durations
+        break_cycles (bool): Ignore the dependencies closing a cycle instead of raising, for LLM generated graphs
+
+    Returns:
+        Schedule: The schedule, whose to_tasks() gives the GANTT tasks
+
+    Raises:
+        ValueError: If the graph has a cycle and break_cycles is False
+    """
+    calendar = calendar or WorkCalendar.from_env()
+    names = list(dict.fromkeys(nodes))
+    index = {name: i for i, name in enumerate(names)}
+    count = len(names)
+    task_durations = [max(int(round(float(durations.get(name, default_duration)))), 0) for name in names]
+
+    successors = [[] for _ in range(count)]
+    predecessors = [[] for _ in range(count)]
+    unknown = set()
+    for edge in edges:
+        first, second = index.get(edge[0]), index.get(edge[1])
+        if first is None or second is None:
+            unknown.update(name for name in edge[:2] if name not in index)
+            continue
+        if first != second and second not in successors[first]:
+            successors[first].append(second)
+            predecessors[second].append(first)
+    if unknown:
+        logger.warning(f"Ignoring dependencies on unknown tasks: {', '.join(sorted(map(str, unknown))[:5])}")
+
+    order = _topological_order(names, successors, predecessors, break_cycles)
+    schedule = Schedule(names, task_durations, predecessors, order, calendar)
+    es, ef, ls, lf = schedule.earliest_start, schedule.earliest_finish, schedule.latest_start, schedule.latest_finish
+
+    # Forward pass: a task starts when its last dependency finishes
+    for task in order:
+        start = 0
+        for p in predecessors[task]:
+            if ef[p] > start:
+                start = ef[p]
+        es[task] = start
+        ef[task] = start + task_durations[task]
+
+    # Backward pass: a task must finish before its first dependent task has to start
+    finish = schedule.finish
+    for task in reversed(order):
+        latest = finish
+        for s in successors[task]:
+            if ls[s] < latest:
+                latest = ls[s]
+        lf[task] = latest
+        ls[task] = latest - task_durations[task]
+        schedule.slack[task] = ls[task] - es[task]
+    return schedule
+
+
+# Words of a task name that point to a role whose name or skills do not contain them
+TASK_ROLE_HINTS = {
+    "interface": "frontend ui ux designer",
+    "ui": "frontend designer",
+    "design": "designer ux ui architect",
+    "database": "backend data",
+    "api": "backend",
+    "test": "qa quality tester",
+    "deploy": "devops infrastructure",
+    "release": "devops",
+    "requirement": "analyst manager",
+    "stakeholder": "manager analyst",
+}
+_STOP_WORDS = {"the", "and", "of", "for", "with", "to", "an", "in", "on"}
+
+
+def _words(text: str) -> set:
+    words = re.findall(r'[a-z]+', text.lower())
+    return {word.rstrip("s") for word in words if word not in _STOP_WORDS and len(word) > 1}
+
+
+def _related(word: str, other: str) -> bool:
+    # "test" ~ "testing", "develop" ~ "developer" ~ "development", but not "integration" ~ "interface"
+    if word == other or (len(word) > 2 and len(other) > 2 and (word.startswith(other) or other.startswith(word))):
+        return True
+    return len(os.path.commonprefix([word, other])) >= 6
+
+
+def _role_name(role: str) -> str:
+    # "Backend Developer 2" and "Backend Developer #2" are members of the same role
+    return re.sub(r'\s*#?\d+$', '', role.strip())
+
+
+def team_headcount(team: Dict[str, Dict]) -> Dict[str, int]:
+    """
+    Counts the members of each role of the team structure
+
+    Args:
+        team (Dict[str, Dict]): Role -> details, as produced by process_team_structure.
+            Numbered roles are merged and a Headcount detail is honoured.
+
+    Returns:
+        dict: Role -> number of members
+    """
+    headcount = {}
+    for role, details in team.items():
+        count = 1
+        for key, value in (details.items() if isinstance(details, dict) else ()):
+            if key.lower() in ("headcount", "count", "members"):
+                try:
+                    count = max(int(value), 1)
+                except (TypeError, ValueError):
+                    pass
+        name = _role_name(role)
+        headcount[name] = headcount.get(name, 0) + count
+    return headcount
+
+
+def assign_roles(task_names: Sequence[str], team: Dict[str, Dict]) -> Dict[str, str]:
+    """
+    Assigns every task to the role whose name and skills share the most words with the task name.
+    Ties and tasks matching no role (then only non-manager roles) go to the role with the fewest tasks per member.
+
+    Returns:
+        dict: Task name -> role
+    """
+    headcount = team_headcount(team)
+    if not headcount:
+        return {}
+    role_words = {}
+    for role, details in team.items():
+        skills = " ".join(str(v) for k, v in details.items() if "skill" in k.lower()) if isinstance(details, dict) else ""
+        role_words.setdefault(_role_name(role), set()).update(_words(f"{role} {skills}"))
+    workers = [role for role in headcount if "manager" not in role.lower()] or list(headcount)
+    hints = {word: _words(related) for word, related in TASK_ROLE_HINTS.items()}
+
+    # Task names share most of their words, so each word is matched against the roles once
+    word_roles = {}
+    def roles_of(word: str) -> set:
+        if word not in word_roles:
+            words = {word}.union(*(related for hint, related in hints.items() if _related(word, hint)))
+            word_roles[word] = {role for role, known in role_words.items() if any(_related(w, k) for w in words for k in known)}
+        return word_roles[word]
+
+    assignments = {}
+    load = dict.fromkeys(headcount, 0)
+    for name in task_names:
+        scores = Counter(role for word in _words(name) for role in roles_of(word))
+        if scores:
+            top = max(scores.values())
+            candidates = [role for role, score in scores.items() if score == top]
+        else:
+            candidates = workers
+        # Ties go to the role with the fewest tasks per member so far
+        role = min(candidates, key=lambda role: load[role] / headcount[role])
+        load[role] += 1
+        assignments[name] = role
+    return assignments
+
+
+def level_resources(
+    tasks: List[Dict],
+    edges: Iterable[Sequence[str]],
+    team: Dict[str, Dict],
+    headcount: Optional[Dict[str, int]] = None,
+    assignments: Optional[Dict[str, str]] = None,
+    calendar: Optional[WorkCalendar] = None,
+) -> Dict:
+    """
+    Shifts the GANTT tasks so no role works on more tasks at once than it has members.
+
+    Serial list scheduling: the tasks are taken in order of their latest start without
+    resource limits (most urgent first), each one starting when its dependencies are done
+    and a member of its role is free.
+
+    Args:
+        tasks (List[Dict] or TaskTable): The GANTT tasks, with duration_days or start_date and end_date
+        edges (Iterable[Sequence[str]]): [a, b] pairs where b depends on a
+        team (Dict[str, Dict]): The team structure
+        headcount (Dict[str, int], optional): Members per role, overriding the team structure
+        assignments (Dict[str, str], optional): Task name -> role, overriding the role of the tasks and the automatic assignment
+        calendar (WorkCalendar, optional): Defaults to the PLANNER_HOLIDAYS calendar starting with the first task
+
+    Returns:
+        dict: tasks (with role and delay_days, the shift caused by the resource limits),
+            finish_date, working_days, headcount, utilization (role -> busy fraction of its
+            members over the project) and edges, so the plan can be levelled again
+    """
+    edges = [list(edge[:2]) for edge in edges]
+    tasks = TaskTable.of(tasks)
+    if calendar is None:
+        calendar = WorkCalendar.from_env(start=tasks.project_start)
+
+    names = [task.name for task in tasks]
+    durations = {}
+    for task in tasks:
+        if task.duration_days is not None:
+            durations[task.name] = task.duration_days
+        else:
+            start = calendar.index_of(task.start)
+            end = calendar.index_of(task.end + timedelta(days=1))
+            durations[task.name] = max(end - start, 1)
+    cpm = schedule_tasks(names, edges, durations, calendar, break_cycles=True)
+
+    members = {**team_headcount(team), **(headcount or {})}
+    roles = {t.name: t.role for t in tasks if t.role}
+    roles.update(assignments or {})
+    unassigned = [name for name in cpm.names if name not in roles]
+    if unassigned:
+        roles.update(assign_roles(unassigned, team))
+    for role in set(roles.values()) - set(members):
+        members[role] = 1
+    # Each member is represented by the working day from which they are free
+    free_from = {role: [0] * max(int(count), 1) for role, count in members.items()}
+
+    count = len(cpm.names)
+    successors = [[] for _ in range(count)]
+    waiting = [len(p) for p in cpm.predecessors]
+    for task in range(count):
+        for p in cpm.predecessors[task]:
+            successors[p].append(task)
+    eligible = [(cpm.latest_start[i], cpm.earliest_start[i], i) for i in range(count) if not waiting[i]]
+    heapq.heapify(eligible)
+    start = [0] * count
+    finish = [0] * count
+    busy = dict.fromkeys(members, 0)
+    while eligible:
+        _, _, task = heapq.heappop(eligible)
+        ready = max((finish[p] for p in cpm.predecessors[task]), default=0)
+        duration = cpm.durations[task]
+        role = roles.get(cpm.names[task])
+        if duration and role is not None:
+            units = free_from[role]
+            start[task] = max(ready, units[0])
+            heapq.heapreplace(units, start[task] + duration)
+            busy[role] += duration
+        else:
+            start[task] = ready
+        finish[task] = start[task] + duration
+        for s in successors[task]:
+            waiting[s] -= 1
+            if not waiting[s]:
+                heapq.heappush(eligible, (cpm.latest_start[s], cpm.earliest_start[s], s))
+
+    project_days = max(finish, default=0)
+    date_at = calendar.date_at
+    leveled = []
+    position = {task: n for n, task in enumerate(cpm.order)}
+    for i in sorted(range(count), key=lambda i: (start[i], position[i])):
+        leveled.append({
+            "name": cpm.names[i],
+            "start_date": date_at(start[i]).isoformat(),
+            "end_date": date_at(finish[i] - 1 if cpm.durations[i] else start[i]).isoformat(),
+            "duration_days": cpm.durations[i],
+            "role": roles.get(cpm.names[i]),
+            "delay_days": start[i] - cpm.earliest_start[i],
+        })
+    return {
+        "tasks": leveled,
+        "finish_date": date_at(project_days - 1).isoformat() if project_days else None,
+        "working_days": project_days,
+        "unconstrained_working_days": cpm.finish,
+        "headcount": {role: len(units) for role, units in free_from.items()},
+        "utilization": {role: round(busy[role] / (len(free_from[role]) * project_days), 3) if project_days else 0.0 for role in free_from},
+        "edges": edges,
+    }
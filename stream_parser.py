@@ -0,0 +1,253 @@
+import json
+import logging
+import re
+from typing import Any, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Paths of the objects worth emitting while a response is still streaming.
+# "*" matches any array index or object key.
+FUNCTION_CALL_PATH = ("*",)
+GANTT_TASK_PATH = ("*", "parameters", "gantt_chart", "tasks", "*")
+TASK_DURATION_PATH = ("*", "parameters", "durations", "*")
+DEPENDENCY_NODE_PATH = ("*", "parameters", "nodes", "*")
+DEPENDENCY_EDGE_PATH = ("*", "parameters", "edges", "*")
+TEAM_ROLE_PATH = ("*",)
+
+_SCALAR_END = set(",]} \t\r\n")
+_SCALAR_PATTERN = re.compile(r'-?\d+(\.\d+)?([eE][+-]?\d+)?|true|false|null')
+
+
+class JSONStreamError(ValueError):
+    """
+    Raised as soon as a streamed JSON document can no longer become valid
+    """
+
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} at offset {position}")
+        self.position = position
+
+
+def path_matches(path: tuple, pattern: Sequence) -> bool:
+    """
+    Checks if a JSON path matches a pattern where "*" stands for any key or index
+    """
+    if len(path) != len(pattern):
+        return False
+    return all(expected == "*" or expected == actual for actual, expected in zip(path, pattern))
+
+
+class IncrementalJSONScanner:
+    """
+    Scans a JSON document chunk by chunk and emits the values found at the watched
+    paths as soon as they are complete, without waiting for the end of the document.
+    """
+
+    def __init__(self, watch: Sequence[Sequence]):
+        """
+        Args:
+            watch (Sequence[Sequence]): Path patterns of the values to emit, e.g. GANTT_TASK_PATH
+        """
+        self.watch = [tuple(pattern) for pattern in watch]
+        self.text = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.token_start = None
+        self.done = False
+
+    def _child_path(self) -> tuple:
+        if not self.stack:
+            return ()
+        frame = self.stack[-1]
+        return frame["path"] + ((frame["key"] if frame["kind"] == "{" else frame["index"]),)
+
+    def _watched(self, path: tuple) -> bool:
+        return any(path_matches(path, pattern) for pattern in self.watch)
+
+    def _emit(self, path: tuple, start: int, end: int, events: list) -> None:
+        if self._watched(path):
+            events.append((path, json.loads(self.text[start:end])))
+
+    def _close_scalar(self, end: int, events: list) -> None:
+        if self.text[self.token_start] != '"' and not _SCALAR_PATTERN.fullmatch(self.text, self.token_start, end):
+            raise JSONStreamError(f"Invalid value {self.text[self.token_start:end]!r}", self.token_start)
+        self._emit(self._child_path(), self.token_start, end, events)
+        self.token_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[tuple, Any]]:
+        """
+        Consumes the next piece of the document
+
+        Args:
+            chunk (str): The next characters of the JSON document
+
+        Returns:
+            List[Tuple[tuple, Any]]: The (path, value) pairs completed by this chunk
+            
+        Raises:
+            JSONStreamError: If the document is not valid JSON
+        """
+        events = []
+        self.text += chunk
+        text = self.text
+        while self.pos < len(text) and not self.done:
+            char = text[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    frame = self.stack[-1] if self.stack else None
+                    if frame is not None and frame["kind"] == "{" and frame["expect_key"]:
+                        frame["key"] = json.loads(text[self.token_start:self.pos + 1])
+                        frame["expect_key"] = False
+                        self.token_start = None
+                    else:
+                        self._close_scalar(self.pos + 1, events)
+            elif self.token_start is not None and char in _SCALAR_END:
+                # End of a number or of true/false/null, reprocess the delimiter below
+                self._close_scalar(self.pos, events)
+                continue
+            elif self.token_start is not None:
+                pass
+            elif self.stack and self.stack[-1]["kind"] == "{" and self.stack[-1]["expect_key"] and char not in '"}' and not char.isspace():
+                raise JSONStreamError(f"Expected a key but found {char!r}", self.pos)
+            elif char == '"':
+                self.in_string = True
+                self.token_start = self.pos
+            elif char in "{[":
+                self.stack.append({
+                    "kind": char,
+                    "path": self._child_path(),
+                    "start": self.pos,
+                    "key": None,
+                    "index": 0,
+                    "expect_key": char == "{",
+                })
+            elif char in "}]":
+                if not self.stack or self.stack[-1]["kind"] != ("{" if char == "}" else "["):
+                    raise JSONStreamError(f"Unexpected {char!r}", self.pos)
+                frame = self.stack.pop()
+                self._emit(frame["path"], frame["start"], self.pos + 1, events)
+                if not self.stack:
+                    self.done = True
+            elif char in ":," and not self.stack:
+                raise JSONStreamError(f"Unexpected {char!r}", self.pos)
+            elif char == ":":
+                self.stack[-1]["expect_key"] = False
+            elif char == ",":
+                frame = self.stack[-1]
+                if frame["kind"] == "{":
+                    frame["expect_key"] = True
+                else:
+                    frame["index"] += 1
+            elif not char.isspace():
+                if char not in "-0123456789tfn":
+                    raise JSONStreamError(f"Unexpected {char!r}", self.pos)
+                self.token_start = self.pos
+            self.pos += 1
+        return events
+
+    @property
+    def complete(self) -> bool:
+        """
+        True once the top level value has been closed
+        """
+        return self.done
+
+
+class FunctionCallStreamParser:
+    """
+    Finds the <function_call> (or any other tag) section of a streamed response and
+    emits the watched JSON objects inside it as soon as each one closes.
+
+    Example:
+        parser = FunctionCallStreamParser(watch=[GANTT_TASK_PATH])
+        for chunk in response_stream:
+            for path, task in parser.feed(chunk):
+                ...
+    """
+
+    def __init__(self, watch: Sequence[Sequence], tag: str = "function_call"):
+        """
+        Args:
+            watch (Sequence[Sequence]): Path patterns of the values to emit
+            tag (str): The tag enclosing the JSON payload
+        """
+        self.open_tag = f"<{tag}>"
+        self.close_tag = f"</{tag}>"
+        self.scanner = IncrementalJSONScanner(watch)
+        self.text = ""
+        self.content_start = None
+        self.content_fed = 0
+        self.closed = False
+
+    def feed(self, chunk: str) -> List[Tuple[tuple, Any]]:
+        """
+        Consumes the next chunk of the response
+
+        Args:
+            chunk (str): The next piece of the streamed response
+
+        Returns:
+            List[Tuple[tuple, Any]]: The (path, value) pairs completed by this chunk
+        """
+        self.text += chunk
+        if self.closed:
+            return []
+        if self.content_start is None:
+            # The opening tag may be split across chunks, so search again around the boundary
+            index = self.text.find(self.open_tag, max(len(self.text) - len(chunk) - len(self.open_tag), 0))
+            if index < 0:
+                return []
+            self.content_start = index + len(self.open_tag)
+            self.content_fed = self.content_start
+
+        close_index = self.text.find(self.close_tag, max(self.content_fed - len(self.close_tag), self.content_start))
+        if close_index >= 0:
+            end = close_index
+            self.closed = True
+        else:
+            # Hold back what could be the beginning of the closing tag
+            end = max(len(self.text) - len(self.close_tag) + 1, self.content_fed)
+        events = self.scanner.feed(self.text[self.content_fed:end])
+        self.content_fed = end
+        return events
+
+    def close(self) -> List[Tuple[tuple, Any]]:
+        """
+        Flushes the characters held back at the end of the stream
+        """
+        if self.closed or self.content_start is None:
+            return []
+        self.closed = True
+        events = self.scanner.feed(self.text[self.content_fed:])
+        self.content_fed = len(self.text)
+        return events
+
+    @property
+    def started(self) -> bool:
+        return self.content_start is not None
+
+
+def iter_stream_with_events(response_stream, parser: FunctionCallStreamParser):
+    """
+    Passes the chunks of a response stream through the parser
+
+    Args:
+        response_stream: Iterable of text chunks
+        parser (FunctionCallStreamParser): The parser consuming the chunks
+
+    Yields:
+        tuple: (chunk, list of (path, value) events completed by that chunk)
+    """
+    for chunk in response_stream:
+        yield chunk, parser.feed(chunk)
+    events = parser.close()
+    if events:
+        yield "", events
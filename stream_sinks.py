@@ -0,0 +1,224 @@
+import logging
+import os
+import sys
+import time
+import uuid
+from typing import Optional
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Where streamed tokens go: none, log, stdout, file or streamlit.
+# auto streams into the Streamlit tab when there is one and logs otherwise.
+PLANNER_STREAM_SINK = os.environ.get("PLANNER_STREAM_SINK", "auto").lower()
+STREAM_LOG_DIR = os.environ.get("PLANNER_STREAM_LOG_DIR", "stream_logs")
+# Maximum redraws per second of a live Streamlit view, so streaming hundreds of
+# tokens does not flood the browser websocket
+STREAM_RENDER_FPS = float(os.environ.get("PLANNER_STREAM_FPS", 4))
+
+
+class StreamSink:
+    """
+    Receives the tokens of a streamed completion for one pipeline stage.
+    The base class drops everything, so streaming costs nothing when nobody is watching.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def write(self, chunk: str) -> None:
+        pass
+
+    def add_item(self, item) -> None:
+        """
+        Receives a structured item parsed from the stream, e.g. a GANTT task
+        """
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class NullSink(StreamSink):
+    """
+    Discards the streamed tokens
+    """
+
+
+class BufferedLogSink(StreamSink):
+    """
+    Collects the streamed tokens and logs them as a single record when flushed,
+    i.e. once per stage instead of once per token
+    """
+
+    def __init__(self, stage: str):
+        super().__init__(stage)
+        self.chunks = []
+
+    def write(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+
+    def flush(self) -> None:
+        if self.chunks:
+            logger.info(f"📝 [{self.stage}] model output:\n{''.join(self.chunks)}")
+            self.chunks = []
+
+
+class StdoutSink(StreamSink):
+    """
+    Echoes the tokens to stdout for local debugging, relying on the stream's own buffering
+    """
+
+    def write(self, chunk: str) -> None:
+        sys.stdout.write(chunk)
+
+    def flush(self) -> None:
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+
+class FileSink(StreamSink):
+    """
+    Appends the tokens of each stage to <directory>/<stage>.log
+    """
+
+    def __init__(self, stage: str, directory: Optional[str] = None):
+        super().__init__(stage)
+        # Read when the sink is created, so the batch planner can give each request its own folder
+        directory = directory or STREAM_LOG_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(os.path.join(directory, f"{stage}.log"), "a", encoding="utf-8")
+
+    def write(self, chunk: str) -> None:
+        self.file.write(chunk)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.write("\n")
+            self.file.close()
+
+
+class StreamlitSink(StreamSink):
+    """
+    Shows the tokens live in a Streamlit container, redrawing at most fps times per second
+    """
+
+    def __init__(self, stage: str, container, fps: float = STREAM_RENDER_FPS):
+        super().__init__(stage)
+        self.container = container
+        self.placeholder = container.empty()
+        self.refresh_interval = 1.0 / fps if fps > 0 else 0.0
+        self.chunks = []
+        self.last_render = 0.0
+        self.dirty = False
+
+    def _changed(self) -> None:
+        self.dirty = True
+        if time.monotonic() - self.last_render >= self.refresh_interval:
+            self.flush()
+
+    def write(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+        self._changed()
+
+    def render(self) -> None:
+        self.placeholder.code("".join(self.chunks), language=None)
+
+    def flush(self) -> None:
+        if self.dirty:
+            self.render()
+            self.dirty = False
+        self.last_render = time.monotonic()
+
+    def close(self) -> None:
+        # The stage renders its final output itself, so the live view is removed
+        self.placeholder.empty()
+
+
+class StreamlitTaskSink(StreamlitSink):
+    """
+    Live view of the GANTT stage: the tasks appear one by one in a table and in a
+    preview chart that grows with them. The raw tokens are only counted.
+    """
+
+    def __init__(self, stage: str, container, fps: float = STREAM_RENDER_FPS):
+        super().__init__(stage, container, fps)
+        self.chart_placeholder = container.empty()
+        self.tasks = []
+        self.charted_tasks = 0
+        # Retries open a new sink for the same stage in the same script run
+        self.sink_id = uuid.uuid4().hex[:8]
+
+    def add_item(self, item) -> None:
+        self.tasks.append(item)
+        self._changed()
+
+    def render(self) -> None:
+        from gantt_generator import generate_gantt_preview
+
+        characters = sum(len(chunk) for chunk in self.chunks)
+        with self.placeholder.container():
+            st.caption(f"Generating the GANTT... {len(self.tasks)} tasks, {characters} characters received")
+            if self.tasks:
+                st.dataframe(
+                    [{"Task": t.get("name"), "Start": t.get("start_date"), "End": t.get("end_date")} for t in self.tasks],
+                    use_container_width=True,
+                )
+        # Only redraw the chart when new tasks arrived, it is the heaviest element
+        if len(self.tasks) > self.charted_tasks:
+            self.charted_tasks = len(self.tasks)
+            self.chart_placeholder.plotly_chart(
+                generate_gantt_preview(self.tasks),
+                use_container_width=True,
+                key=f"{self.stage}_preview_{self.sink_id}_{self.charted_tasks}",
+            )
+
+    def close(self) -> None:
+        super().close()
+        self.chart_placeholder.empty()
+
+
+# Live views with more than the raw tokens, by stage
+STREAMLIT_SINKS = {
+    "gantt": StreamlitTaskSink,
+}
+
+
+def create_stream_sink(stage: str, container=None, kind: Optional[str] = None) -> StreamSink:
+    """
+    Creates the sink selected for this deployment
+
+    Args:
+        stage (str): Name of the pipeline stage producing the tokens
+        container: Streamlit container used by the streamlit sink
+        kind (str, optional): auto, none, log, stdout, file or streamlit. Defaults to PLANNER_STREAM_SINK
+
+    Returns:
+        StreamSink: The sink receiving the streamed tokens
+    """
+    kind = (kind or PLANNER_STREAM_SINK).lower()
+    if kind == "auto":
+        kind = "streamlit" if container is not None else "log"
+    if kind == "log":
+        return BufferedLogSink(stage)
+    if kind == "stdout":
+        return StdoutSink(stage)
+    if kind == "file":
+        return FileSink(stage)
+    if kind == "streamlit" and container is not None:
+        return STREAMLIT_SINKS.get(stage, StreamlitSink)(stage, container)
+    return NullSink(stage)
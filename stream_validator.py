@@ -0,0 +1,240 @@
+import logging
+from typing import Callable, Dict, Optional, Sequence
+
+from prompts import *
+from task_model import parse_date
+from stream_parser import (
+    FunctionCallStreamParser,
+    JSONStreamError,
+    path_matches,
+    FUNCTION_CALL_PATH,
+    GANTT_TASK_PATH,
+    TASK_DURATION_PATH,
+    DEPENDENCY_NODE_PATH,
+    DEPENDENCY_EDGE_PATH,
+    TEAM_ROLE_PATH,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# A tail this long made only of the same short pattern means the model is looping
+REPETITION_WINDOW = 600
+REPETITION_MAX_PERIOD = 200
+
+
+class StreamValidationError(Exception):
+    """
+    Raised while a completion is streaming, as soon as its output can no longer become valid
+
+    Attributes:
+        reason (str): Short machine readable cause: markdown, duplicate_section, repetition, invalid_json, schema or truncated
+        detail (str): Human readable description of the problem
+        position (int): Offset in the response where the problem was detected
+        partial_text (str): The response received so far
+    """
+
+    def __init__(self, reason: str, detail: str, position: int, partial_text: str):
+        super().__init__(f"{reason}: {detail}")
+        self.reason = reason
+        self.detail = detail
+        self.position = position
+        self.partial_text = partial_text
+
+
+class StreamSchema:
+    """
+    Describes what a valid response to one of the prompts looks like
+    """
+
+    def __init__(
+        self,
+        tag: str = "function_call",
+        functions: Optional[Sequence[str]] = None,
+        items: Optional[Dict[tuple, Callable[[object], Optional[str]]]] = None,
+        single_section: bool = True,
+    ):
+        """
+        Args:
+            tag (str): The tag enclosing the JSON payload
+            functions (Sequence[str], optional): Function names the model may call, None to allow any
+            items (Dict[tuple, Callable], optional): Path pattern -> check returning an error message or None
+            single_section (bool): Whether a second opening tag makes the response invalid
+        """
+        self.tag = tag
+        self.functions = set(functions) if functions is not None else None
+        self.items = items or {}
+        self.single_section = single_section
+
+
+def _check_gantt_task(task) -> Optional[str]:
+    if not isinstance(task, dict):
+        return "a GANTT task must be an object"
+    for field in ("name", "start_date", "end_date"):
+        if field not in task:
+            return f"GANTT task is missing {field}"
+    for field in ("start_date", "end_date"):
+        try:
+            parse_date(task[field])
+        except ValueError:
+            return f"GANTT task {task['name']!r} has an invalid {field} {task[field]!r}"
+    return None
+
+
+def _check_task_duration(estimate) -> Optional[str]:
+    if not isinstance(estimate, dict) or "name" not in estimate:
+        return "a duration estimate must be an object with a name"
+    days = estimate.get("days")
+    if isinstance(days, bool) or not isinstance(days, (int, float)) or days < 0:
+        return f"task {estimate['name']!r} has an invalid duration {days!r}"
+    return None
+
+
+def _check_node(node) -> Optional[str]:
+    return None if isinstance(node, str) else "a dependency graph node must be a string"
+
+
+def _check_edge(edge) -> Optional[str]:
+    if not isinstance(edge, list) or len(edge) != 2:
+        return "a dependency graph edge must be a list of two nodes"
+    return None
+
+
+def _check_team_role(details) -> Optional[str]:
+    return None if isinstance(details, dict) else "each team role must map to an object of details"
+
+
+def _check_trello_call(call) -> Optional[str]:
+    if not isinstance(call, dict):
+        return "a function call must be an object"
+    if call.get("name") == "add_card_to_trello":
+        missing = {"card_name", "card_description", "start_date", "end_date", "id_list"} - set(call.get("parameters", {}))
+        if missing:
+            return f"add_card_to_trello is missing {', '.join(sorted(missing))}"
+    return None
+
+
+PROMPT_SCHEMAS = {
+    WBS_CREATOR_PROMPT: StreamSchema(
+        functions=["generate_dependency_graph"],
+        items={DEPENDENCY_NODE_PATH: _check_node, DEPENDENCY_EDGE_PATH: _check_edge},
+    ),
+    GANTT_CHART_CREATOR_PROMPT: StreamSchema(
+        functions=["create_gantt_chart_to_file"],
+        items={GANTT_TASK_PATH: _check_gantt_task},
+    ),
+    GANTT_DURATION_ESTIMATOR_PROMPT: StreamSchema(
+        functions=["estimate_task_durations"],
+        items={TASK_DURATION_PATH: _check_task_duration},
+    ),
+    TEAM_STRUCTURE_CREATOR_PROMPT: StreamSchema(
+        tag="team",
+        items={TEAM_ROLE_PATH: _check_team_role},
+    ),
+    COST_ESTIMATOR_PROMPT: StreamSchema(
+        functions=["get_role_average_annual_salary", "get_role_average_salary"],
+        single_section=False,
+    ),
+    PROMPT_CARD_CREATOR_FOR_TRELLO: StreamSchema(
+        functions=["create_board_on_trello", "add_card_to_trello"],
+        items={FUNCTION_CALL_PATH: _check_trello_call},
+    ),
+}
+
+
+class StreamValidator:
+    """
+    Watches a streamed completion and raises StreamValidationError as soon as the
+    output can no longer match the schema of its prompt, so the stream can be closed
+    and the request retried without waiting for the last token.
+    """
+
+    def __init__(self, schema: StreamSchema):
+        self.schema = schema
+        watch = list(schema.items)
+        if schema.functions is not None and schema.tag == "function_call":
+            watch.append(FUNCTION_CALL_PATH)
+        self.parser = FunctionCallStreamParser(watch=watch, tag=schema.tag)
+        self.text = ""
+        self.last_repetition_check = 0
+
+    def _fail(self, reason: str, detail: str, position: Optional[int] = None):
+        error = StreamValidationError(reason, detail, len(self.text) if position is None else position, self.text)
+        logger.warning(f"⛔ Aborting stream: {error}")
+        raise error
+
+    def _check_repetition(self) -> None:
+        if len(self.text) - self.last_repetition_check < 50:
+            return
+        self.last_repetition_check = len(self.text)
+        tail = self.text[-REPETITION_WINDOW - REPETITION_MAX_PERIOD:]
+        if len(tail) < REPETITION_WINDOW + 1:
+            return
+        window = tail[-REPETITION_WINDOW:]
+        for period in range(1, REPETITION_MAX_PERIOD + 1):
+            if len(tail) >= REPETITION_WINDOW + period and window == tail[-REPETITION_WINDOW - period:-period]:
+                self._fail("repetition", f"the last {REPETITION_WINDOW} characters repeat every {period} characters")
+
+    def _check_events(self, events) -> None:
+        for path, value in events:
+            if len(path) == 1 and self.schema.functions is not None and self.schema.tag == "function_call":
+                name = value.get("name") if isinstance(value, dict) else None
+                if name not in self.schema.functions:
+                    self._fail("schema", f"unknown function {name!r}")
+            for pattern, check in self.schema.items.items():
+                if path_matches(path, pattern):
+                    error = check(value)
+                    if error:
+                        self._fail("schema", error)
+
+    def _check_duplicate_section(self) -> None:
+        section_start = self.parser.content_start
+        if section_start is not None and self.schema.single_section:
+            if self.text.find(self.parser.open_tag, section_start) >= 0:
+                self._fail("duplicate_section", f"a second {self.parser.open_tag} section was started")
+
+    def feed(self, chunk: str) -> None:
+        """
+        Checks the next chunk of the response
+
+        Raises:
+            StreamValidationError: If the response can no longer become valid
+        """
+        self.text += chunk
+        self._check_repetition()
+
+        try:
+            events = self.parser.feed(chunk)
+        except JSONStreamError as e:
+            # A second section opened inside the first one breaks its JSON, report the actual cause
+            self._check_duplicate_section()
+            position = self.parser.content_start + e.position
+            if self.text[position] in "`#*":
+                self._fail("markdown", f"markdown inside {self.parser.open_tag}", position)
+            self._fail("invalid_json", str(e), position)
+        # Checked once the chunk is parsed, it may contain both sections
+        self._check_duplicate_section()
+        self._check_events(events)
+
+    def close(self) -> None:
+        """
+        Checks the complete response once the stream has ended
+
+        Raises:
+            StreamValidationError: If the payload section was left unfinished
+        """
+        if self.parser.started and not self.parser.closed:
+            try:
+                self._check_events(self.parser.close())
+            except JSONStreamError as e:
+                self._fail("invalid_json", str(e))
+        if self.parser.started and not self.parser.scanner.complete:
+            self._fail("truncated", f"the JSON inside {self.parser.open_tag} was not completed")
+
+
+def validator_for_prompt(system_prompt: str) -> Optional[StreamValidator]:
+    """
+    Returns a new validator for the system prompt, or None if the prompt has no known schema
+    """
+    schema = PROMPT_SCHEMAS.get(system_prompt)
+    return StreamValidator(schema) if schema is not None else None
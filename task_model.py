@@ -0,0 +1,219 @@
+import json
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def parse_date(value: Union[str, date]) -> date:
+    """
+    Parses a task date. The model sometimes writes day 00 for the first day of a month, which is read as day 01.
+
+    Raises:
+        ValueError: If the value is not a YYYY-MM-DD date
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"{value!r} is not a date")
+    if value.endswith('-00'):
+        value = value[:-2] + '01'
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return date.fromisoformat(value)
+    # Slower path for dates without zero padding, e.g. 2025-1-6
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+class Task:
+    """
+    A GANTT task with its dates parsed. Names are interned, since the same task names
+    appear in the WBS, the edges, the GANTT and the resource plan.
+    """
+
+    __slots__ = ("id", "name", "start", "end", "duration_days", "slack_days", "critical", "role")
+
+    def __init__(
+        self,
+        id: int,
+        name: str,
+        start: date,
+        end: date,
+        duration_days: Optional[int] = None,
+        slack_days: Optional[int] = None,
+        critical: Optional[bool] = None,
+        role: Optional[str] = None,
+    ):
+        self.id = id
+        self.name = sys.intern(name)
+        self.start = start
+        self.end = end
+        self.duration_days = duration_days
+        self.slack_days = slack_days
+        self.critical = critical
+        self.role = sys.intern(role) if role else None
+
+    @property
+    def start_date(self) -> str:
+        return self.start.isoformat()
+
+    @property
+    def end_date(self) -> str:
+        return self.end.isoformat()
+
+    @property
+    def days(self) -> int:
+        """
+        Calendar days covered by the task, the end day included
+        """
+        return (self.end - self.start).days + 1
+
+    def to_dict(self) -> Dict:
+        """
+        Returns the task as the dict the prompts, the caches and the checkpoints use
+        """
+        task = {"name": self.name, "start_date": self.start_date, "end_date": self.end_date}
+        for field in ("duration_days", "slack_days", "critical", "role"):
+            value = getattr(self, field)
+            if value is not None:
+                task[field] = value
+        return task
+
+    def __repr__(self) -> str:
+        return f"Task({self.id}, {self.name!r}, {self.start_date} -> {self.end_date})"
+
+
+class TaskTable(Sequence):
+    """
+    The tasks of a plan, parsed and validated once and shared by the generators.
+
+    Rows are Task records; the start and end dates are also kept as columns of day ordinals,
+    so the project span and the date of every bar are computed without touching the rows.
+    """
+
+    def __init__(self, tasks: Iterable[Task]):
+        self.tasks: List[Task] = list(tasks)
+        self.starts = array('l', (task.start.toordinal() for task in self.tasks))
+        self.ends = array('l', (task.end.toordinal() for task in self.tasks))
+        self._key: Optional[str] = None
+
+    @classmethod
+    def from_dicts(cls, tasks: Iterable[Dict], skip_invalid: bool = False) -> "TaskTable":
+        """
+        Parses and validates the tasks of a GANTT
+
+        Args:
+            tasks (Iterable[Dict]): Dicts with name, start_date, end_date and optionally
+                duration_days, slack_days, critical and role
+            skip_invalid (bool): Leave out invalid tasks instead of raising, e.g. for a GANTT still streaming
+
+        Raises:
+            ValueError: If a task has no name, an invalid date, or ends before it starts
+        """
+        rows = []
+        for task in tasks:
+            try:
+                if not isinstance(task, dict):
+                    raise ValueError(f"A task must be an object, got {task!r}")
+                name = task.get('name')
+                if not isinstance(name, str) or not name.strip():
+                    raise ValueError(f"A task has no name: {task!r}")
+                try:
+                    start = parse_date(task.get('start_date'))
+                    end = parse_date(task.get('end_date'))
+                except ValueError as e:
+                    raise ValueError(f"Task {name} has an invalid date: {e}")
+                if end < start:
+                    raise ValueError(f"Task {name} ends before it starts")
+            except ValueError:
+                if skip_invalid:
+                    continue
+                raise
+            rows.append(Task(
+                len(rows), name, start, end,
+                task.get('duration_days'), task.get('slack_days'), task.get('critical'), task.get('role'),
+            ))
+        return cls(rows)
+
+    @classmethod
+    def of(cls, tasks: Union["TaskTable", Iterable[Dict]], skip_invalid: bool = False) -> "TaskTable":
+        """
+        Returns the tasks as a table, parsing them only if they are not one already
+        """
+        if isinstance(tasks, TaskTable):
+            return tasks
+        return cls.from_dicts(tasks, skip_invalid)
+
+    def __getitem__(self, index):
+        return self.tasks[index]
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def __iter__(self) -> Iterator[Task]:
+        return iter(self.tasks)
+
+    @property
+    def project_start(self) -> Optional[date]:
+        return date.fromordinal(min(self.starts)) if self.tasks else None
+
+    @property
+    def project_end(self) -> Optional[date]:
+        return date.fromordinal(max(self.ends)) if self.tasks else None
+
+    @property
+    def span_days(self) -> int:
+        """
+        Calendar days from the first start to the last end
+        """
+        return max(self.ends) - min(self.starts) if self.tasks else 0
+
+    def sorted_by_start(self) -> List[Task]:
+        starts = self.starts
+        return [self.tasks[i] for i in sorted(range(len(self.tasks)), key=starts.__getitem__)]
+
+    def to_dicts(self) -> List[Dict]:
+        return [task.to_dict() for task in self.tasks]
+
+    def key(self) -> str:
+        """
+        Canonical JSON of the tasks, used as cache key by the figure and Excel caches
+        """
+        if self._key is None:
+            self._key = json.dumps(self.to_dicts(), sort_keys=True)
+        return self._key
+
+
+class TableCache:
+    """
+    Results built from a task table, e.g. a figure or a workbook, kept for the most recently
+    used task contents. It is keyed by TaskTable.key() but, unlike an lru_cache on the JSON of
+    the tasks, a miss passes the parsed table to the builder instead of tasks to parse again.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tasks: Union[TaskTable, Iterable[Dict]], build: Callable[..., Any], *args) -> Any:
+        """
+        Returns build(table, *args), built only once per task content and arguments
+        """
+        table = TaskTable.of(tasks)
+        key = (table.key(), args)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = build(table, *args)
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
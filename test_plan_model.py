@@ -0,0 +1,23 @@
+import scheduling
+from plan_model import PlanModel
+from scheduling import WorkCalendar, level_resources, schedule_tasks
+
+
+def dates(tasks):
+    return {task["name"]: (task["start_date"], task["end_date"]) for task in tasks}
+
+
+def test_plan_model_keeps_env_holidays(monkeypatch):
+    monkeypatch.setattr(scheduling, "PLANNER_HOLIDAYS", "2024-11-20..2024-11-22")
+    edges = [["A", "B"]]
+    tasks = schedule_tasks(["A", "B"], edges, {"A": 5, "B": 5}, WorkCalendar.from_env()).to_tasks()
+    assert dates(tasks) == {"A": ("2024-11-18", "2024-11-27"), "B": ("2024-11-28", "2024-12-04")}
+
+    model = PlanModel(tasks, edges)
+    assert dates(model.to_tasks()) == dates(tasks)
+    # The first edit must not move the other tasks onto the holidays
+    model.set_duration("B", 6)
+    assert dates(model.to_tasks()) == {"A": ("2024-11-18", "2024-11-27"), "B": ("2024-11-28", "2024-12-05")}
+
+    leveled = level_resources(tasks, edges, {})
+    assert dates(leveled["tasks"]) == dates(tasks)
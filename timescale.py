@@ -0,0 +1,117 @@
+import os
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+# Time scales of the GANTT outputs, from the finest to the coarsest
+GRANULARITIES = ("day", "week", "month", "quarter")
+
+# Longest project, in calendar days, shown at each scale when the scale is picked automatically
+GANTT_DAY_MAX_DAYS = int(os.environ.get("GANTT_DAY_MAX_DAYS", 62))
+GANTT_WEEK_MAX_DAYS = int(os.environ.get("GANTT_WEEK_MAX_DAYS", 366))
+GANTT_MONTH_MAX_DAYS = int(os.environ.get("GANTT_MONTH_MAX_DAYS", 1096))
+
+# The larger unit grouping the periods of each scale on the chart: its labels and solid grid lines
+PARENT_GRANULARITY = {"day": "week", "week": "month", "month": "quarter", "quarter": "year"}
+
+
+def pick_granularity(span_days: int) -> str:
+    """
+    Picks the time scale of a project from its length, so the number of periods stays readable
+    """
+    if span_days <= GANTT_DAY_MAX_DAYS:
+        return "day"
+    if span_days <= GANTT_WEEK_MAX_DAYS:
+        return "week"
+    if span_days <= GANTT_MONTH_MAX_DAYS:
+        return "month"
+    return "quarter"
+
+
+def resolve_granularity(granularity: Optional[str], span_days: int) -> str:
+    """
+    Returns the time scale asked for by the caller, or the one picked from the project length
+
+    Raises:
+        ValueError: If the time scale is not one of GRANULARITIES
+    """
+    if granularity in (None, "", "auto"):
+        return pick_granularity(span_days)
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown time scale {granularity!r}, expected one of {', '.join(GRANULARITIES)}")
+    return granularity
+
+
+def period_start(day: date, granularity: str) -> date:
+    """
+    Returns the first day of the period containing a day. Weeks start on Monday.
+    """
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if granularity == "year":
+        return day.replace(month=1, day=1)
+    raise ValueError(f"Unknown time scale {granularity!r}")
+
+
+def next_period(start: date, granularity: str) -> date:
+    """
+    Returns the first day of the period after the one starting on `start`
+    """
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(days=7)
+    months = {"month": 1, "quarter": 3, "year": 12}.get(granularity)
+    if months is None:
+        raise ValueError(f"Unknown time scale {granularity!r}")
+    month = start.month - 1 + months
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def periods(start: date, end: date, granularity: str) -> List[Tuple[date, date]]:
+    """
+    Returns the calendar periods covering the days from start to end
+
+    Returns:
+        list: (first day, last day) of each period, the first and the last one may extend beyond start and end
+    """
+    bounds = []
+    current = period_start(start, granularity)
+    while current <= end:
+        following = next_period(current, granularity)
+        bounds.append((current, following - timedelta(days=1)))
+        current = following
+    return bounds
+
+
+def period_label(day: date, granularity: str) -> str:
+    """
+    Short label of the period starting on a day, shown under the label of its parent period
+    """
+    if granularity in ("day", "week"):
+        return str(day.day)
+    if granularity == "month":
+        return day.strftime('%b')
+    if granularity == "quarter":
+        return f"Q{(day.month - 1) // 3 + 1}"
+    return str(day.year)
+
+
+def long_label(day: date, granularity: str) -> str:
+    """
+    Full label of the period containing a day, e.g. "November 2024" for a month
+    """
+    if granularity == "day":
+        return day.strftime('%b %d, %Y')
+    if granularity == "week":
+        return f"Week of {period_start(day, 'week').strftime('%b %d, %Y')}"
+    if granularity == "month":
+        return day.strftime('%B %Y')
+    if granularity == "quarter":
+        return f"Q{(day.month - 1) // 3 + 1} {day.year}"
+    return str(day.year)
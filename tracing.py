@@ -0,0 +1,171 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+TRACE_DIR = os.environ.get("PLANNER_TRACE_DIR", "traces")
+
+_current_run = contextvars.ContextVar("current_run", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed step of a planning run, e.g. a main.create_* stage, an LLM call or a render
+    """
+
+    def __init__(self, run, name: str, parent_id: Optional[str], attributes: Dict):
+        self.run = run
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:12]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes) -> None:
+        """
+        Adds or updates attributes of the span
+        """
+        self.attributes.update(attributes)
+
+    def elapsed(self) -> float:
+        """
+        Returns the seconds elapsed since the span started
+        """
+        return time.perf_counter() - self._start
+
+    def end(self) -> None:
+        """
+        Closes the span and records it in its run. Calling it twice has no effect.
+        """
+        if self.duration is None:
+            self.duration = self.elapsed()
+            if self.run is not None:
+                self.run.add(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "run_id": self.run.run_id if self.run is not None else None,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": datetime.fromtimestamp(self.start_time).isoformat(timespec="milliseconds"),
+            "duration": round(self.duration, 4) if self.duration is not None else None,
+            **self.attributes,
+        }
+
+
+class RunTrace:
+    """
+    Collects the spans of one planning run
+    """
+
+    def __init__(self, run_id: Optional[str] = None):
+        self.run_id = run_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def records(self) -> List[Dict]:
+        """
+        Returns the finished spans as dicts, ordered by start time
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_time)
+        return [s.to_dict() for s in spans]
+
+    def export_jsonl(self, directory: str = TRACE_DIR) -> str:
+        """
+        Writes one JSON line per span to <directory>/<run_id>.jsonl
+
+        Returns:
+            str: Path of the written file
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.run_id}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for record in self.records():
+                f.write(json.dumps(record, default=str) + "\n")
+        logger.info(f"🧭 Trace written to {path}")
+        return path
+
+
+def current_run() -> Optional[RunTrace]:
+    """
+    Returns the run being traced in the current context, if any
+    """
+    return _current_run.get()
+
+
+@contextmanager
+def trace_run(run_id: Optional[str] = None):
+    """
+    Traces every span opened inside the block as part of a new run
+
+    Yields:
+        RunTrace: The run collecting the spans
+    """
+    run = RunTrace(run_id)
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+
+
+def start_span(name: str, **attributes) -> Span:
+    """
+    Starts a span that is a child of the current one without becoming current itself.
+    Meant for generators, where a context manager would leak into the caller.
+    The caller must call span.end().
+    """
+    parent = _current_span.get()
+    return Span(_current_run.get(), name, parent.span_id if parent is not None else None, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the block as a span, nested under the current span
+
+    Yields:
+        Span: The span, whose attributes can be updated inside the block
+    """
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=str(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def traced(name: str):
+    """
+    Decorator recording every call of the function as a span
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
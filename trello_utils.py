@@ -13,21 +13,33 @@ async def add_card_to_trello(card_name:str,card_description:str,start_date:str,e
     if id_list=="{board_id}":
         id_list=current_board_id # Fix for some edge cases of the GenAI model outputting {board_id} instead of the actual board id
     url = f"https://api.trello.com/1/cards?key={TRELLO_API_KEY}&token={TRELLO_TOKEN}"
-    response = requests.post(url, json={"name": card_name, "desc": card_description, "idList": id_list, "start": start_date, "due": end_date})
+    response = await asyncio.to_thread(requests.post, url, json={"name": card_name, "desc": card_description, "idList": id_list, "start": start_date, "due": end_date})
     return response.json()
 
 async def create_board_on_trello(board_name:str):
     global current_board_id
     url = f"https://api.trello.com/1/boards/?key={TRELLO_API_KEY}&token={TRELLO_TOKEN}"
-    response = requests.post(url, json={"name": board_name})
+    response = await asyncio.to_thread(requests.post, url, json={"name": board_name})
     logger.info(response.json())
     board_id= response.json()["id"]
     current_board_id=board_id
     url = f"https://api.trello.com/1/boards/{board_id}/lists?key={TRELLO_API_KEY}&token={TRELLO_TOKEN}"
-    response = requests.post(url, json={"name": "To Do"})
+    response = await asyncio.to_thread(requests.post, url, json={"name": "To Do"})
     logger.info(response.json())
     return response.json()["id"], board_id
 
+def dispatch_trello_call(call:dict):
+    """
+    Returns the coroutine running a single Trello function call, or None if the function is unknown.
+    Used to start each call as soon as it is parsed from the stream.
+    """
+    logger.info(call["name"])
+    if call["name"] == "create_board_on_trello":
+        return create_board_on_trello(call["parameters"]["board_name"])
+    elif call["name"] == "add_card_to_trello":
+        return add_card_to_trello(**call["parameters"])
+    return None
+
 async def process_trello_function_calls(trello_output:str):
     function_call_pattern = r'<function_call>(.*?)</function_call>'
     function_call = re.search(function_call_pattern, trello_output, re.DOTALL)
@@ -35,10 +47,8 @@ async def process_trello_function_calls(trello_output:str):
     if function_call:
         function_call = json.loads(function_call.group(1).strip())
         for call in function_call:
-            logger.info(call["name"])
-            if call["name"] == "create_board_on_trello":
-                tasks.append(create_board_on_trello(call["parameters"]["board_name"]))
-            elif call["name"] == "add_card_to_trello":
-                tasks.append(add_card_to_trello(**call["parameters"]))
+            coroutine = dispatch_trello_call(call)
+            if coroutine is not None:
+                tasks.append(coroutine)
     results = await asyncio.gather(*tasks)
     return results
@@ -1,9 +1,10 @@
 import re
 import json
 from graphviz import Digraph
-from gantt_generator import generate_gantt_chart
+from gantt_generator import gantt_figure
 from scrapy.selector import Selector
-from excel_generator import generate_gantt_excel
+from excel_generator import gantt_excel_bytes
+from task_model import TaskTable
 import logging
 from scrapy.crawler import CrawlerProcess
 from urllib.parse import quote
@@ -19,6 +20,13 @@ import time
 """for logger_name in logging.root.manager.loggerDict:
     logging.getLogger(logger_name).disabled = True"""
 
+# Folder receiving the generated files, e.g. the dependency graph image. The batch planner
+# points it at a scratch folder per request.
+PLANNER_WORK_DIR = os.environ.get("PLANNER_WORK_DIR", ".")
+
+# Seconds the cost estimate waits for the salary lookups, the roles not found by then are reported as such
+SALARY_FETCH_TIMEOUT = float(os.environ.get("SALARY_FETCH_TIMEOUT", 120))
+
 # Configure our logger only
 logger = logging.getLogger(__name__)
 logger.disabled = False
@@ -83,39 +91,151 @@ def process_wbs(wbs_text: str) -> str:
     else:
         function_call = None
     return wbs, function_call
-def process_gantt(gantt_text: str):
+def extract_gantt_tasks(gantt_text: str):
     """
-    Extracts the gantt chart content and processes any function calls
+    Extracts the list of tasks from the gantt chart function call
     
     Args:
-        gantt_text (str): The text containing the gantt chart data and potential function calls
+        gantt_text (str): The text containing the gantt chart function call
         
     Returns:
-        tuple: Tuple containing (list of tasks, plotly chart filename, excel filename)
-    """    
+        list: The tasks of the gantt chart, empty if there is no gantt chart function call
+    """
     if "<function_call>" in gantt_text and "</function_call>" not in gantt_text:
         gantt_text += "</function_call>"
     # Extract function calls
     function_pattern = r'<function_call>(.*?)</function_call>'
     function_call = re.search(function_pattern, gantt_text, re.DOTALL)
-    tasks = []
-    plotly_filename = None
-    excel_filename = None
     
     if function_call:
         function_call = json.loads(function_call.group(1).strip())
         function_call = function_call[0]
         if function_call["name"] == "create_gantt_chart_to_file":
             if "gantt_chart" in function_call["parameters"]:
-                    tasks = function_call["parameters"]["gantt_chart"]["tasks"]
-                    plotly_filename = f"gantt_chart_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-                    excel_filename = f"gantt_chart_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                    logger.info(f"🎨 Creating Gantt chart")
-                    generate_gantt_chart(tasks)
-                    logger.info(f"🎨 Creating Excel file")
-                    generate_gantt_excel(tasks, excel_filename)
-    
-    return tasks, plotly_filename, excel_filename
+                    return function_call["parameters"]["gantt_chart"]["tasks"]
+    return []
+
+def normalize_task_name(name: str) -> str:
+    """
+    Casefolds a task name and strips numbering, punctuation and spaces so that names can be compared.
+    Letters of any script are kept, e.g. accented or Cyrillic names.
+    """
+    return re.sub(r'[\W\d_]+', '', name.casefold())
+
+def validate_gantt_tasks(tasks: list, wbs_nodes: list) -> float:
+    """
+    Checks that a gantt chart is usable and measures how much of the WBS it covers
+    
+    Args:
+        tasks (list or TaskTable): The tasks of the gantt chart
+        wbs_nodes (list): The task names of the dependency graph
+        
+    Returns:
+        float: The fraction of WBS tasks found in the gantt chart
+        
+    Raises:
+        ValueError: If there are no tasks, or a task has missing or invalid dates
+    """
+    if not tasks:
+        raise ValueError("The GANTT chart has no tasks")
+    task_names = [normalize_task_name(task.name) for task in TaskTable.of(tasks)]
+    
+    if not wbs_nodes:
+        return 1.0
+    covered = 0
+    for node in wbs_nodes:
+        node_name = normalize_task_name(node)
+        if node_name and any(node_name in task_name or task_name in node_name for task_name in task_names if task_name):
+            covered += 1
+    return covered / len(wbs_nodes)
+
+def find_wbs_node(name: str, wbs_nodes: list):
+    """
+    Returns the WBS task a task name refers to, matched like extract_task_durations does, or None
+    """
+    name = normalize_task_name(name)
+    if not name:
+        return None
+    normalized = [(node, normalize_task_name(node)) for node in wbs_nodes]
+    exact = next((node for node, node_name in normalized if node_name == name), None)
+    if exact is not None:
+        return exact
+    return next((node for node, node_name in normalized if node_name and (node_name in name or name in node_name)), None)
+
+def extract_task_durations(durations_text: str, wbs_nodes: list) -> dict:
+    """
+    Extracts the working days estimated for each WBS task
+
+    Args:
+        durations_text (str): The text containing the estimate_task_durations function call
+        wbs_nodes (list): The task names of the dependency graph
+
+    Returns:
+        dict: WBS task name -> working days, for the tasks that were estimated
+
+    Raises:
+        ValueError: If there is no estimate_task_durations function call or it matches none of the WBS tasks
+    """
+    if "<function_call>" in durations_text and "</function_call>" not in durations_text:
+        durations_text += "</function_call>"
+    function_call = re.search(r'<function_call>(.*?)</function_call>', durations_text, re.DOTALL)
+    if not function_call:
+        raise ValueError("The duration estimate has no function call")
+    function_call = json.loads(function_call.group(1).strip())[0]
+    if function_call["name"] != "estimate_task_durations":
+        raise ValueError(f"Unexpected function {function_call['name']} in the duration estimate")
+
+    # The model may renumber or slightly rename the WBS tasks
+    estimates = {}
+    for estimate in function_call["parameters"]["durations"]:
+        name = normalize_task_name(estimate["name"])
+        if not name:
+            logger.warning(f"⚠️ Ignoring the estimate of {estimate['name']!r}, its name has no letters")
+        elif name in estimates:
+            # Keep the first estimate rather than silently replacing it
+            logger.warning(f"⚠️ Ignoring a second estimate for {estimate['name']!r}, another task has the same name")
+        else:
+            estimates[name] = float(estimate["days"])
+    durations = {}
+    for node in wbs_nodes:
+        node_name = normalize_task_name(node)
+        if not node_name:
+            continue
+        if node_name in estimates:
+            durations[node] = estimates[node_name]
+        else:
+            match = next((days for name, days in estimates.items() if name and (node_name in name or name in node_name)), None)
+            if match is not None:
+                durations[node] = match
+    if wbs_nodes and not durations:
+        raise ValueError("The duration estimate matches none of the WBS tasks")
+    return durations
+
+def process_gantt(gantt_text: str):
+    """
+    Extracts the gantt chart content and processes any function calls
+    
+    Args:
+        gantt_text (str): The text containing the gantt chart data and potential function calls
+        
+    Returns:
+        tuple: Tuple containing (list of tasks, plotly figure, excel file content as bytes)
+    """    
+    tasks = extract_gantt_tasks(gantt_text)
+    figure = None
+    excel_data = None
+    
+    if tasks:
+        # Dates are parsed once, both generators read the same table
+        table = TaskTable.from_dicts(tasks)
+        logger.info(f"🎨 Creating Gantt chart")
+        # Both are cached by task content, the render reuses them instead of building them again
+        figure = gantt_figure(table)
+        logger.info(f"🎨 Creating Excel file")
+        excel_data = gantt_excel_bytes(table)
+        tasks = table.to_dicts()
+    
+    return tasks, figure, excel_data
 def wrap_text(text: str, width: int = 20) -> str:
     """
     Wraps text to specified width and joins with newlines
@@ -160,7 +280,7 @@ def generate_dependency_graph(nodes: list, edges: list) -> str:
         str: Path to the generated graph image file
     """
     # Create a unique filename using timestamp
-    output_file_filename = f"dependency_graph_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+    output_file_filename = os.path.join(PLANNER_WORK_DIR, f"dependency_graph_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png")
     
     # Create a new directed graph
     dot = Digraph(comment='Dependency Graph')
@@ -235,7 +355,6 @@ class SalarySpider(scrapy.Spider):
     def start_requests(self):
         for url in self.start_urls:
             logger.info(f"🔍 Starting request for {self.role}")
-            sys.stdout.flush()
             
             # Rotate between different user agents
             headers = {
@@ -291,7 +410,6 @@ class SalarySpider(scrapy.Spider):
                 return
             
         logger.info(f"📝 Parsing search for {self.role}")
-        sys.stdout.flush()
         
         try:
             
@@ -299,7 +417,6 @@ class SalarySpider(scrapy.Spider):
             
             if follow_url:
                 logger.info(f"🔗 Found details link for {self.role}")
-                sys.stdout.flush()
                 
                 # Add random delay before following
                 
@@ -326,7 +443,6 @@ class SalarySpider(scrapy.Spider):
             else:
                 self.salary = f"No salary data found for {self.role}"
                 logger.error(f"❌ No details link found for {self.role}")
-                sys.stdout.flush()
         except Exception as e:
             logger.error(f"❌ Error parsing search for {self.role}: {str(e)}")
             self.salary = f"Error fetching salary for {self.role}"
@@ -334,12 +450,10 @@ class SalarySpider(scrapy.Spider):
     def parse2(self, response):
         if response.status in [403, 429]:
             logger.error(f"⚠️ Access denied for {self.role} details (status: {response.status})")
-            sys.stdout.flush()
             self.salary = f"Unable to fetch salary for {self.role} (access denied)"
             return
             
         logger.info(f"💰 Parsing salary for {self.role}")
-        sys.stdout.flush()
         
         try:
             self.salary = response.xpath('//text[@id="top_salary_value"]/tspan/text()').get()
@@ -357,11 +471,9 @@ class SalarySpider(scrapy.Spider):
             logger.error(f"❌ Error parsing salary for {self.role}: {str(e)}")
             self.salary = f"Error fetching salary for {self.role}"
         
-        sys.stdout.flush()
 
     def handle_error(self, failure):
         logger.error(f"❌ Request failed for {self.role}: {failure.value}")
-        sys.stdout.flush()
         self.salary = f"Failed to fetch salary for {self.role}"
 
 # Add this at the module level (outside any function)
@@ -376,7 +488,6 @@ def run_spider_process(function_call, roles, results_dict, completed_roles, tota
             completed_roles.value += 1
             progress = (completed_roles.value / total_roles) * 100
             logger.info(f"✅ [{progress:.1f}%] Completed {spider.role}: {spider.salary}")
-            sys.stdout.flush()
     
     # Create a CrawlerRunner instance with telnet console disabled
     runner = CrawlerRunner({
@@ -435,7 +546,6 @@ async def process_estimate(estimate: str) ->str:
     Processes the estimate to return a list of salaries in the same order as the input roles
     """
     logger.info("🚀 Starting salary fetching process")
-    sys.stdout.flush()
     
     function_pattern = r'<function_call>(.*?)</function_call>'
     function_call = re.search(function_pattern, estimate, re.DOTALL)
@@ -443,7 +553,8 @@ async def process_estimate(estimate: str) ->str:
     
     if function_call:
         function_call = json.loads(function_call.group(1).strip())
-        roles = []
+        # The spider process fills its own copy of the list, the order of the results comes from here
+        roles = [call['parameters']['role'] for call in function_call if call["name"] == "get_role_average_salary"]
         
         # Use Manager for shared objects between processes
         from multiprocessing import Manager, Value
@@ -451,7 +562,7 @@ async def process_estimate(estimate: str) ->str:
         with Manager() as manager:
             results_dict = manager.dict()
             completed_roles = Value('i', 0)
-            total_roles = len([call for call in function_call if call["name"] == "get_role_average_salary"])
+            total_roles = len(roles)
             
             try:
                 import multiprocessing
@@ -459,18 +570,20 @@ async def process_estimate(estimate: str) ->str:
                 # Run the spider in a separate process
                 process = multiprocessing.Process(
                     target=run_spider_process,
-                    args=(function_call, roles, results_dict, completed_roles, total_roles)
+                    args=(function_call, [], results_dict, completed_roles, total_roles)
                 )
                 process.start()
                 
-                # Wait for the process to complete
-                while completed_roles.value < total_roles:
+                # Wait for the process to complete, without hanging the stage when the site cannot be reached
+                deadline = time.monotonic() + SALARY_FETCH_TIMEOUT
+                while completed_roles.value < total_roles and process.is_alive() and time.monotonic() < deadline:
                     await asyncio.sleep(0.1)
+                if completed_roles.value < total_roles:
+                    logger.warning(f"⏱️ Salary fetching stopped with {completed_roles.value}/{total_roles} roles done")
                 
                 # Create ordered results list
                 results = [f"{role}: {results_dict.get(role, 'Not found')}" for role in roles]
                 logger.info("✨ Salary fetching completed!")
-                sys.stdout.flush()
                 
                 # Terminate and clean up the process
                 process.terminate()